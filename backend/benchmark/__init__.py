@@ -0,0 +1,9 @@
+"""
+micro benchmarks of the backend
+
+run from the backend dir, e.g.
+python -m benchmark.router
+
+python -m benchmark.suite load tests a PictureServer and times the catalog, saving the results as json
+to compare with a baseline run
+"""
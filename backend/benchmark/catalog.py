@@ -0,0 +1,95 @@
+"""
+load and persist time, and memory, of the picture catalog against its size:
+legacy (the former Picture, dir() based serialization and an instance __dict__),
+slots (schema driven serialization, interned tags and dirs) and columnar (ColumnarCatalog).
+each run loads the same db.json in a fresh process, reports its max RSS (the parsed json included)
+and, in another run under tracemalloc, the memory kept once loaded (catalog and indexes)
+
+python -m benchmark.catalog [--sizes 100000,1000000] [--modes legacy,slots,columnar]
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import resource
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import List
+
+import serializable
+
+class LegacyPicture(serializable.Json):
+    """
+    the Picture before __slots__
+    """
+    def __init__(self, path:str = "") -> None:
+        self.path = path
+        self.name:str = "untitled"
+        self.dir:List[str] = ['uncategorized']
+        self.tags:List[str] = []
+
+def make_database(root_dir:str, size:int) -> None:
+    rand = random.Random(size)
+    vocabulary = [f'tag-{i}' for i in range(2000)]
+    dirs = [f'dir-{i}' for i in range(50)]
+    items = [{'path': f'2024{i:010d}-abcde.webp', 'name': 'untitled' if i % 3 else f'picture {i}',
+              'dir': [rand.choice(dirs)], 'tags': rand.sample(vocabulary, rand.randint(0, 6))} for i in range(size)]
+    with open(os.path.join(root_dir, 'db.json'), 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False, indent=2)
+
+def run(mode:str, root_dir:str, traced:bool) -> None:
+    """
+    in the child process. traced: measure the memory kept by the catalog with tracemalloc, which slows the load
+    """
+    logging.disable(logging.CRITICAL)
+    import tracemalloc
+    import picture_server
+    if mode == 'legacy':
+        picture_server.Picture = LegacyPicture
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    pictures = picture_server.Pictures(root_dir, 'db.json', scan_root=False, columnar=mode == 'columnar')
+    load = time.perf_counter() - start
+    gc.collect()
+    if traced:
+        print(json.dumps({'kept_mb': tracemalloc.get_traced_memory()[0] / 1024 / 1024}))
+        return
+    start = time.perf_counter()
+    pictures.compact()
+    persist = time.perf_counter() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on linux
+    print(json.dumps({'load': load, 'persist': persist, 'maxrss_mb': maxrss / 1024}))
+
+def child(mode:str, root_dir:str, traced:bool) -> dict:
+    out = subprocess.run([sys.executable, '-m', 'benchmark.catalog', '--child', mode, root_dir] + (['--traced'] if traced else []),
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--modes', default='legacy,slots,columnar')
+    args = parser.parse_args()
+
+    print(f"{'pictures':>9} {'mode':>9} {'load s':>7} {'persist s':>10} {'max RSS MB':>11} {'kept MB':>8}")
+    for size in map(int, args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as root_dir:
+            make_database(root_dir, size)
+            for mode in args.modes.split(','):
+                r = child(mode, root_dir, traced=False)
+                r.update(child(mode, root_dir, traced=True))
+                print(f"{size:>9} {mode:>9} {r['load']:>7.2f} {r['persist']:>10.2f} {r['maxrss_mb']:>11.1f} {r['kept_mb']:>8.1f}")
+                sys.stdout.flush()
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == '--child':
+        run(sys.argv[2], sys.argv[3], traced='--traced' in sys.argv)
+    else:
+        main()
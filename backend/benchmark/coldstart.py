@@ -0,0 +1,69 @@
+"""
+cold start of the picture catalog against its size: the json snapshot (db.json, parsed and indexed at load)
+and the binary snapshot (db.snap, mapped, decoded and indexed on demand).
+each run opens the database in a fresh process and reports the time to open it, to look one picture up,
+to answer the first tag query (which builds the index of a binary snapshot) and the max RSS.
+the files are in the page cache, as after a restart of the server, not after a reboot
+
+python -m benchmark.coldstart [--sizes 10000,100000,1000000] [--modes json,binary]
+"""
+
+import sys
+import json
+import time
+import resource
+import logging
+import argparse
+import tempfile
+import subprocess
+from storage import JournalStore
+from benchmark.catalog import make_database
+
+Files = {'json': 'db.json', 'binary': 'db.snap'}
+
+def run(mode:str, root_dir:str) -> None:
+    """
+    in the child process
+    """
+    logging.disable(logging.CRITICAL)
+    import picture_server
+    start = time.perf_counter()
+    pictures = picture_server.Pictures(root_dir, Files[mode], scan_root=False)
+    open_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pictures.path_pictures['2024%010d-abcde.webp' % (len(pictures.path_pictures) // 2)]
+    lookup = time.perf_counter() - start
+    start = time.perf_counter()
+    pictures.query(tags=['tag-1'], limit=10)
+    first_query = time.perf_counter() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on linux
+    print(json.dumps({'open': open_time, 'lookup': lookup, 'first_query': first_query, 'maxrss_mb': maxrss / 1024}))
+
+def child(mode:str, root_dir:str) -> dict:
+    out = subprocess.run([sys.executable, '-m', 'benchmark.coldstart', '--child', mode, root_dir],
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--modes', default='json,binary')
+    args = parser.parse_args()
+
+    print(f"{'pictures':>9} {'mode':>7} {'open ms':>9} {'lookup ms':>10} {'1st query ms':>13} {'max RSS MB':>11}")
+    for size in map(int, args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as root_dir:
+            make_database(root_dir, size)
+            json_store = JournalStore(f'{root_dir}/db.json')
+            JournalStore(f'{root_dir}/db.snap').compact(json_store.load().values())
+            for mode in args.modes.split(','):
+                r = child(mode, root_dir)
+                print(f"{size:>9} {mode:>7} {r['open'] * 1000:>9.1f} {r['lookup'] * 1000:>10.3f} "
+                      f"{r['first_query'] * 1000:>13.1f} {r['maxrss_mb']:>11.1f}")
+                sys.stdout.flush()
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == '--child':
+        run(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,69 @@
+"""
+peak memory of gif to animated webp conversion against the number of frames.
+the streaming encoder should stay flat, the former way (all frames copied in a list) grows with frames.
+each conversion runs in a fresh process and reports its max RSS
+
+python -m benchmark.gif [--size 480x270] [--frames 20,80,320]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from PIL import Image
+
+def make_gif(path:str, width:int, height:int, frames:int) -> None:
+    def frame_iter():
+        for i in range(frames):
+            yield Image.effect_noise((width, height), 32 + i % 64).convert('P')
+    first, *rest = frame_iter()
+    first.save(path, save_all=True, append_images=rest, duration=40, loop=0)
+
+def convert(mode:str, old_path:str, new_path:str) -> None:
+    """
+    run in the child process
+    """
+    import resource
+    import picture_utils
+    start = time.perf_counter()
+    if mode == 'streaming':
+        picture_utils._gif_to_webp(old_path, new_path)
+    else: # the former way
+        import webp
+        with Image.open(old_path) as gif:
+            fps = int(1000 / gif.info['duration'])
+            frames = []
+            for fid in range(gif.n_frames):
+                gif.seek(fid)
+                frames.append(gif.copy())
+            webp.save_images(frames, new_path, fps=fps, lossless = False)
+    elapsed = time.perf_counter() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KiB on linux
+    print(json.dumps({'seconds': elapsed, 'maxrss_mb': maxrss / 1024}))
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='480x270')
+    parser.add_argument('--frames', default='20,80,320')
+    args = parser.parse_args()
+    width, height = map(int, args.size.split('x'))
+
+    print(f"{'frames':>7} {'mode':>10} {'seconds':>8} {'max RSS MB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for frames in map(int, args.frames.split(',')):
+            gif = os.path.join(tmp, f'{frames}.gif')
+            make_gif(gif, width, height, frames)
+            for mode in ('list', 'streaming'):
+                out = subprocess.run([sys.executable, '-m', 'benchmark.gif', '--child', mode, gif, os.path.join(tmp, f'{frames}-{mode}.webp')],
+                                     capture_output=True, text=True, check=True).stdout
+                r = json.loads(out)
+                print(f"{frames:>7} {mode:>10} {r['seconds']:>8.2f} {r['maxrss_mb']:>11.1f}")
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == '--child':
+        convert(*sys.argv[2:])
+    else:
+        main()
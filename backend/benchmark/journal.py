@@ -0,0 +1,61 @@
+"""
+cost of persisting one edited picture against the size of the library:
+appending to the journal against rewriting the whole database (the former persistence, now compact).
+both fsync every time
+
+python -m benchmark.journal [--sizes 1000,10000,100000] [--edits 200]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from picture_server import Pictures
+
+def make_database(root_dir:str, size:int) -> None:
+    items = [{'path': f'{i:08d}-abcdef.webp', 'name': f'picture {i}', 'dir': ['uncategorized'], 'tags': ['a', 'b']}
+             for i in range(size)]
+    with open(os.path.join(root_dir, 'db.json'), 'w', encoding='utf-8') as f:
+        json.dump(items, f, indent=2)
+
+def bench(size:int, edits:int) -> dict:
+    with tempfile.TemporaryDirectory() as root_dir:
+        make_database(root_dir, size)
+        pictures = Pictures(root_dir, 'db.json', fsync_interval=0, compact_min_records=edits * 2 + size)
+        paths = list(pictures.path_pictures)
+        def edit(i:int) -> None:
+            path = paths[i % len(paths)]
+            pictures.path_pictures[path].tags.append(str(i))
+            pictures.changed(path)
+
+        start = time.perf_counter()
+        for i in range(edits):
+            edit(i)
+            pictures.persistence()
+        journal = (time.perf_counter() - start) / edits
+
+        rewrites = max(1, min(edits, 200_000 // size))
+        start = time.perf_counter()
+        for i in range(rewrites):
+            edit(i)
+            pictures.compact()
+        rewrite = (time.perf_counter() - start) / rewrites
+        pictures.store.close()
+    return {'size': size, 'journal_ms': journal * 1000, 'rewrite_ms': rewrite * 1000}
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--edits', type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    for size in map(int, args.sizes.split(',')):
+        r = bench(size, args.edits)
+        print(f"{r['size']:>8} pictures  journal {r['journal_ms']:8.3f} ms/edit  rewrite {r['rewrite_ms']:8.3f} ms/edit")
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+event loop lag of the picture handler under a simulated slow disk.
+every picture read sleeps --disk-ms; with the io thread pool the loop should stay responsive,
+with reads inline in the loop the lag grows with the load
+
+python -m benchmark.loop_lag [--disk-ms 20] [--connections 16] [--seconds 5]
+"""
+
+import os
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import multiprocessing
+import concurrent.futures
+import picture_utils
+from http_server import HTTPServer
+from executors import BoundedExecutor
+from picture_server import PictureServer
+
+PORT = 35082
+PICTURES = 64
+PICTURE_SIZE = 64 * 1024
+
+class InlineExecutor(concurrent.futures.Executor):
+    """
+    run the call at once in the caller thread, i.e. block the event loop like a plain open().read()
+    """
+    def submit(self, fn, /, *args, **kwargs) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+def serve(port:int, root_dir:str, mode:str, disk_ms:float) -> None:
+    logging.disable(logging.CRITICAL)
+    read_picture = picture_utils.read_picture
+    def slow_read_picture(path:str) -> bytes:
+        time.sleep(disk_ms / 1000)
+        return read_picture(path)
+    picture_utils.read_picture = slow_read_picture
+
+    if mode == 'inline':
+        io = BoundedExecutor('inline', InlineExecutor, max_pending=1 << 30)
+    else:
+        io = BoundedExecutor.threads('io', workers=16, max_pending=1024)
+    s = HTTPServer(ip='127.0.0.1', port=port, timeout=30.0)
+    # the cache holds one picture, every request misses and reads the slow disk
+    ps = PictureServer(root_dir=root_dir, cache_bytes=PICTURE_SIZE, cache_item_bytes=PICTURE_SIZE, io=io)
+    ps.register_routers(s)
+    s.start()
+
+async def fetch(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, path:str) -> bytes:
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    head = await reader.readuntil(b'\r\n\r\n')
+    start = head.find(b'Content-Length: ') + len(b'Content-Length: ')
+    return await reader.readexactly(int(head[start:head.find(b'\r\n', start)]))
+
+async def client(port:int, deadline:float, counter:list) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    rand = random.Random()
+    while time.perf_counter() < deadline:
+        await fetch(reader, writer, f'/pic/{rand.randrange(PICTURES)}.webp')
+        counter[0] += 1
+    writer.close()
+
+async def load(port:int, connections:int, seconds:float) -> dict:
+    for _ in range(100): # wait for server
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+    counter = [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, start + seconds, counter) for _ in range(connections)))
+    rps = counter[0] / (time.perf_counter() - start)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    stats = json.loads(await fetch(reader, writer, '/stats'))
+    writer.close()
+    return {'rps': rps, **stats['loop_lag']}
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--disk-ms', type=float, default=20.0)
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        for i in range(PICTURES):
+            with open(os.path.join(root_dir, f'{i}.webp'), 'wb') as f:
+                f.write(os.urandom(PICTURE_SIZE))
+        print(f"{'mode':>8} {'rps':>8} {'lag avg ms':>11} {'lag max ms':>11}")
+        for i, mode in enumerate(('inline', 'threads')):
+            port = PORT + i
+            server = multiprocessing.Process(target=serve, args=(port, root_dir, mode, args.disk_ms), daemon=True)
+            server.start()
+            try:
+                r = asyncio.run(load(port, args.connections, args.seconds))
+                print(f"{mode:>8} {r['rps']:>8.0f} {r['avg_ms']:>11.1f} {r['max_ms']:>11.1f}")
+            finally:
+                server.terminate()
+                server.join()
+        shutil.rmtree(os.path.normpath(root_dir) + '-variants', ignore_errors=True) # made by PictureServer
+
+if __name__ == '__main__':
+    main()
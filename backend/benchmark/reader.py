@@ -0,0 +1,46 @@
+"""
+request parse throughput of HTTPReader against body size
+
+python -m benchmark.reader
+"""
+
+import time
+import asyncio
+from http_server import HTTPReader
+
+CHUNK = 64 * 1024
+
+def make_request(body_size:int) -> bytes:
+    header = (f"POST /api/tags HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+              f"Content-Length: {body_size}\r\n\r\n").encode()
+    return header + b'x' * body_size
+
+async def parse_once(raw:bytes, body_size:int) -> float:
+    reader = asyncio.StreamReader(limit=2 ** 16)
+    http_reader = HTTPReader(reader=reader, peername='bench', timeout=60.0, max_body_size=body_size)
+
+    async def feed() -> None: # data arrives in socket sized chunks
+        for i in range(0, len(raw), CHUNK):
+            reader.feed_data(raw[i:i + CHUNK])
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    start = time.perf_counter()
+    feeder = asyncio.create_task(feed())
+    request = await http_reader.read_request_header()
+    request = await http_reader.read_request_body(request)
+    elapsed = time.perf_counter() - start
+    await feeder
+    assert len(request.content) == body_size
+    return elapsed
+
+async def main() -> None:
+    print(f"{'body':>10} {'ms/request':>11} {'MB/s':>8}")
+    for body_size in (1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024, 32 * 1024 * 1024):
+        raw = make_request(body_size)
+        repeat = max(3, (64 * 1024 * 1024) // len(raw))
+        elapsed = min([await parse_once(raw, body_size) for _ in range(min(repeat, 50))])
+        print(f"{body_size:>10} {elapsed * 1000:>11.3f} {len(raw) / elapsed / 1e6:>8.1f}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""
+route lookup cost against the number of registered routes.
+lookup should stay flat from 10 to 10,000 routes
+
+python -m benchmark.router
+"""
+
+import random
+import string
+import timeit
+from http_server import Router, HTTPHandle, HTTPRequest
+
+def random_prefix(rand:random.Random) -> str:
+    segments = rand.randint(1, 4)
+    return '/' + '/'.join(''.join(rand.choices(string.ascii_lowercase, k=rand.randint(3, 8))) for _ in range(segments))
+
+async def _callback(request:HTTPRequest):
+    return None
+
+def build_router(n:int, rand:random.Random) -> Router:
+    router = Router()
+    for _ in range(n - 1):
+        router.add_router(HTTPHandle(path_prefix=random_prefix(rand), method=rand.choice(('GET', 'POST')), async_callback=_callback))
+    router.add_router(HTTPHandle(path_prefix='/pic/', method='GET', async_callback=_callback))
+    return router
+
+def main() -> None:
+    rand = random.Random(0)
+    requests = [HTTPRequest(method='GET', path='/pic/202411201620-aaibs.webp'),
+                HTTPRequest(method='GET', path='/resource/app.js'),
+                HTTPRequest(method='POST', path='/api/tags/list')]
+    number = 20000
+    print(f"{'routes':>8} {'ns/lookup':>10}")
+    for n in (10, 100, 1000, 10000):
+        router = build_router(n, rand)
+        seconds = timeit.timeit(lambda: [router.route(r) for r in requests], number=number)
+        print(f"{n:>8} {seconds / number / len(requests) * 1e9:>10.0f}")
+
+if __name__ == '__main__':
+    main()
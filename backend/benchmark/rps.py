@@ -0,0 +1,74 @@
+"""
+requests per second of small JSON responses over loopback keep-alive connections
+
+python -m benchmark.rps [--connections 16] [--seconds 5]
+"""
+
+import time
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from http_server import HTTPServer, HTTPHandle
+
+PORT = 35081
+
+def serve(port:int) -> None:
+    logging.disable(logging.CRITICAL)
+    s = HTTPServer(ip='127.0.0.1', port=port, timeout=30.0)
+    s.add_router(HTTPHandle.handle_json(path_prefix='/hello', method='GET', callback=lambda o:{'user':'madokast'}))
+    s.start()
+
+async def client(port:int, deadline:float, counter:list) -> None:
+    """
+    requests one after the other on a keep-alive connection, reopened when the server closes it
+    (max_requests_per_conn reached)
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request = b'GET /hello HTTP/1.1\r\nHost: localhost\r\n\r\n'
+    while time.perf_counter() < deadline:
+        writer.write(request)
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            start = head.find(b'Content-Length: ') + len(b'Content-Length: ')
+            length = int(head[start:head.find(b'\r\n', start)])
+            await reader.readexactly(length)
+            counter[0] += 1
+            closed = b'\r\nconnection: close\r\n' in head.lower()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            closed = True
+        if closed:
+            writer.close()
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.close()
+
+async def load(port:int, connections:int, seconds:float) -> float:
+    for _ in range(50): # wait for server
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+    counter = [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, start + seconds, counter) for _ in range(connections)))
+    return counter[0] / (time.perf_counter() - start)
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    server = multiprocessing.Process(target=serve, args=(args.port,), daemon=True)
+    server.start()
+    try:
+        rps = asyncio.run(load(args.port, args.connections, args.seconds))
+        print(f"connections={args.connections} rps={rps:.0f}")
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+regression suite of the backend: a PictureServer over a synthetic catalog (webp files and db.json)
+driven by a keep-alive load generator, then micro benchmarks of the catalog.
+results are saved as json; given a baseline, each metric is compared with it and the run fails (exit status 1)
+when one is worse by more than the tolerance. the load generator shares the machine with the server,
+compare results from the same machine only
+
+python -m benchmark.suite [--pictures 10000] [--concurrency 1,16] [--seconds 5] [--scenarios tags,pictures,random,pic]
+                          [--output benchmark-results.json] [--baseline old.json] [--tolerance 0.1]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from benchmark.catalog import make_database
+
+PORT = 35090
+Request = Tuple[str, str, bytes] # method, path, body
+Scenario = Callable[[random.Random, List[str]], Request]
+
+SCENARIOS:Dict[str, Scenario] = {
+    'tags': lambda rand, paths: ('GET', '/tags', b''),
+    'pictures': lambda rand, paths: ('POST', '/pictures', json.dumps({'tags': [f'tag-{rand.randrange(2000)}'], 'limit': 50}).encode()),
+    'random': lambda rand, paths: ('GET', '/random', b''),
+    'pic': lambda rand, paths: ('GET', f'/pic/{rand.choice(paths)}', b''),
+}
+
+def make_catalog(root_dir:str, size:int) -> List[str]:
+    """
+    db.json of size pictures with random tags and dirs, and a small webp file for each. return their paths
+    """
+    from PIL import Image
+    make_database(root_dir, size)
+    with open(os.path.join(root_dir, 'db.json'), encoding='utf-8') as f:
+        paths = [item['path'] for item in json.load(f)]
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'WEBP')
+    content = buffer.getvalue()
+    for path in paths:
+        with open(os.path.join(root_dir, path), 'wb') as f:
+            f.write(content)
+    return paths
+
+def serve(port:int, root_dir:str) -> None:
+    logging.disable(logging.CRITICAL)
+    from http_server import HTTPServer
+    from picture_server import PictureServer
+    s = HTTPServer(ip='127.0.0.1', port=port, timeout=30.0)
+    ps = PictureServer(root_dir=root_dir, watch=False, cpu_workers=1)
+    ps.register_routers(s)
+    s.start()
+
+async def request(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, req:Request) -> Tuple[int, bool]:
+    """
+    send req and read its response, return (status, connection kept alive)
+    """
+    method, path, body = req
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    length, keep_alive = 0, True
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if key == 'content-length':
+            length = int(value)
+        elif key == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+    await reader.readexactly(length)
+    return status, keep_alive
+
+async def client(port:int, scenario:Scenario, paths:List[str], deadline:float, latencies:List[int], errors:List[int]) -> None:
+    """
+    send requests one after the other on a keep-alive connection until deadline, reconnecting when the server closes it
+    """
+    rand = random.Random()
+    reader:Optional[asyncio.StreamReader] = None
+    writer:Optional[asyncio.StreamWriter] = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        req = scenario(rand, paths)
+        start = time.perf_counter_ns()
+        try:
+            status, keep_alive = await request(reader, writer, req)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors[0] += 1
+            writer.close()
+            writer = None
+            continue
+        latencies.append(time.perf_counter_ns() - start)
+        if status >= 400:
+            errors[0] += 1
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+async def wait_for_server(port:int) -> None:
+    for _ in range(300):
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'server not listening on {port}')
+
+async def load(port:int, scenario:Scenario, paths:List[str], concurrency:int, seconds:float) -> Dict[str, float]:
+    await wait_for_server(port)
+    latencies:List[int] = []
+    errors = [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, scenario, paths, start + seconds, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    def percentile(q:float) -> float:
+        return latencies[int(q * (len(latencies) - 1))] / 1e6 if latencies else 0.0
+    return {'rps': len(latencies) / elapsed, 'p50_ms': percentile(0.5), 'p99_ms': percentile(0.99), 'errors': errors[0]}
+
+def rss_mb(pid:int) -> Optional[float]:
+    """
+    resident set size of process pid, None where /proc is unavailable
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def run_http(root_dir:str, paths:List[str], scenarios:List[str], concurrencies:List[int], seconds:float) -> Dict[str, Dict[str, Any]]:
+    results:Dict[str, Dict[str, Any]] = dict()
+    server = multiprocessing.Process(target=serve, args=(PORT, root_dir), daemon=True)
+    server.start()
+    try:
+        for name in scenarios:
+            for concurrency in concurrencies:
+                r:Dict[str, Any] = asyncio.run(load(PORT, SCENARIOS[name], paths, concurrency, seconds))
+                r['rss_mb'] = rss_mb(server.pid)
+                results[f'{name}@{concurrency}'] = r
+                print(f"{name:>9} {concurrency:>5} {r['rps']:>8.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                      f"{r['errors']:>7} {r['rss_mb'] or 0:>8.1f}")
+                sys.stdout.flush()
+    finally:
+        server.terminate()
+        server.join()
+    return results
+
+def median_time(func:Callable[[], Any], repeat:int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def run_micro(root_dir:str, paths:List[str]) -> Dict[str, float]:
+    """
+    in this process, once the server is stopped: persistence edits the catalog
+    """
+    logging.disable(logging.CRITICAL)
+    from picture_server import Pictures
+    rand = random.Random(0)
+    results:Dict[str, float] = dict()
+    results['load_database_s'] = median_time(lambda: Pictures(root_dir, 'db.json', scan_root=False), repeat=3)
+    pictures = Pictures(root_dir, 'db.json', scan_root=False)
+
+    def edit_and_persist() -> None:
+        for path in rand.sample(paths, 100):
+            pictures.set_tags(path, [f'tag-{rand.randrange(2000)}'])
+        pictures.persistence()
+    results['persistence_100_ms'] = median_time(edit_and_persist, repeat=5) * 1000
+    results['get_all_tags_us'] = median_time(lambda: [pictures.get_all_tags() for _ in range(100)], repeat=5) * 1e4
+    results['rand_picture_us'] = median_time(lambda: [pictures.rand_picture() for _ in range(10000)], repeat=5) * 100
+    results['rand_picture_tag_us'] = median_time(lambda: [pictures.rand_picture(tags=['tag-1']) for _ in range(10000)], repeat=5) * 100
+    for name, value in results.items():
+        print(f"{name:>22} {value:>10.3f}")
+    return results
+
+def flatten(results:Dict[str, Any], prefix:str = '') -> Dict[str, float]:
+    flat:Dict[str, float] = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+def compare(results:Dict[str, Any], baseline:Dict[str, Any], tolerance:float) -> List[str]:
+    """
+    print each metric against the baseline, return the ones worse by more than tolerance.
+    rps is better higher, everything else lower; error counts are shown, not judged
+    """
+    current = flatten({k:v for k, v in results.items() if k != 'meta'})
+    base = flatten({k:v for k, v in baseline.items() if k != 'meta'})
+    if results.get('meta', {}).get('pictures') != baseline.get('meta', {}).get('pictures'):
+        print('warning: the baseline was run with another number of pictures')
+    regressions = []
+    print(f"\n{'metric':>40} {'baseline':>10} {'current':>10} {'change':>8}")
+    for key in sorted(current.keys() & base.keys()):
+        old, new = base[key], current[key]
+        change = (new - old) / old if old else 0.0
+        worse = -change if key.endswith('.rps') else change
+        flag = ''
+        if not key.endswith('.errors') and worse > tolerance:
+            flag = ' REGRESSION'
+            regressions.append(key)
+        print(f"{key:>40} {old:>10.3f} {new:>10.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pictures', type=int, default=10000)
+    parser.add_argument('--concurrency', default='1,16', help='comma separated connection counts')
+    parser.add_argument('--seconds', type=float, default=5.0, help='per scenario and concurrency')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+    scenarios = args.scenarios.split(',')
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name}, expect some of {",".join(SCENARIOS)}')
+
+    results:Dict[str, Any] = {
+        'meta': {'pictures': args.pictures, 'seconds': args.seconds, 'python': platform.python_version(),
+                 'machine': platform.machine(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+    }
+    with tempfile.TemporaryDirectory() as root_dir:
+        paths = make_catalog(root_dir, args.pictures)
+        print(f"{'scenario':>9} {'conns':>5} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MB':>8}")
+        results['http'] = run_http(root_dir, paths, scenarios, [int(c) for c in args.concurrency.split(',')], args.seconds)
+        print()
+        results['micro'] = run_micro(root_dir, paths)
+        shutil.rmtree(os.path.normpath(root_dir) + '-variants', ignore_errors=True) # made by PictureServer
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nsaved {args.output}')
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.tolerance:.0%}')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
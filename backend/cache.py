@@ -0,0 +1,83 @@
+import os
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ByteCache:
+    """
+    LRU cache of file contents, bounded by the total bytes cached.
+    an entry is valid while the file keeps its mtime and size
+    """
+    def __init__(self, max_bytes:int = 64 * 1024 * 1024, max_item_bytes:int = 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self.items:OrderedDict[str, Tuple[int, int, bytes]] = OrderedDict() # path -> (mtime_ns, size, data)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(self, path:str, st:Optional[os.stat_result] = None) -> Optional[bytes]:
+        """
+        content of file at path, from memory if cached and unchanged.
+        st is the fresh os.stat of path if the caller already has it.
+        return None when the file is larger than max_item_bytes, the caller should stream it.
+        raise FileNotFoundError if no such file
+        """
+        if st is None:
+            st = os.stat(path)
+        if st.st_size > self.max_item_bytes:
+            return None
+        data = self.get(path, st)
+        if data is None:
+            with open(file=path, mode='rb') as f:
+                data = f.read(st.st_size)
+            self.put(path, st.st_mtime_ns, data)
+        return data
+
+    def get(self, path:str, st:os.stat_result) -> Optional[bytes]:
+        """
+        cached content of path if still valid for its fresh os.stat st, without any I/O.
+        a None is counted as a miss
+        """
+        item = self.items.get(path)
+        if item is not None:
+            mtime_ns, size, data = item
+            if mtime_ns == st.st_mtime_ns and size == st.st_size:
+                self.hits += 1
+                self.items.move_to_end(path)
+                return data
+            self.remove(path)
+        self.misses += 1
+        return None
+
+    def put(self, path:str, mtime_ns:int, data:bytes) -> None:
+        if len(data) > self.max_item_bytes:
+            return
+        self.remove(path)
+        self.items[path] = (mtime_ns, len(data), data)
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes:
+            _, (_, size, _) = self.items.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def remove(self, path:str) -> None:
+        item = self.items.pop(path, None)
+        if item is not None:
+            self.total_bytes -= item[1]
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'items': len(self.items),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,139 @@
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, MutableMapping, Optional, Tuple, TypeVar
+
+Path = str
+P = TypeVar('P') # Picture, not imported to keep picture_server free to import this module
+
+class StringTable:
+    """
+    each distinct string once, by id
+    """
+    def __init__(self) -> None:
+        self.ids:Dict[str, int] = dict()
+        self.strings:List[str] = []
+
+    def id(self, s:str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+class ColumnarCatalog(MutableMapping[Path, P]):
+    """
+    path -> Picture stored by column instead of one object per picture: names, tags and dirs are ids into a
+    string table, tags and dirs of all rows are concatenated in two arrays with per-row offsets.
+    Picture objects are built on access, the ones handed out last are kept, so edit one in place
+    then call changed(path) to write it back. replaced and removed rows leave holes, compacted once they
+    are half of the rows
+    """
+    Recent_Pictures = 4096
+
+    def __init__(self, make:Callable[[Path, str, List[str], List[str]], P]) -> None:
+        """
+        make(path, name, dir, tags): the Picture of a row
+        """
+        self.make = make
+        self.strings = StringTable()
+        self.rows:Dict[Path, int] = dict()
+        self.paths:List[Optional[Path]] = [] # None for a hole
+        self.names = array('I')
+        self.tag_offsets = array('I', [0]) # tags of row r are tag_ids[tag_offsets[r]:tag_offsets[r + 1]]
+        self.tag_ids = array('I')
+        self.dir_offsets = array('I', [0])
+        self.dir_ids = array('I')
+        self.holes = 0
+        self.handed:'OrderedDict[Path, P]' = OrderedDict()
+
+    def __getitem__(self, path:Path) -> P:
+        p = self.handed.get(path)
+        if p is None:
+            p = self.build(self.rows[path])
+            self.handed[path] = p
+            if len(self.handed) > ColumnarCatalog.Recent_Pictures:
+                self.handed.popitem(last=False)
+        else:
+            self.handed.move_to_end(path)
+        return p
+
+    def __setitem__(self, path:Path, picture:P) -> None:
+        row = self.rows.get(path)
+        if row is not None:
+            self.hole(row)
+        self.rows[path] = len(self.paths)
+        self.paths.append(path)
+        self.names.append(self.strings.id(picture.name))
+        self.tag_ids.extend(self.strings.id(tag) for tag in picture.tags)
+        self.tag_offsets.append(len(self.tag_ids))
+        self.dir_ids.extend(self.strings.id(dir) for dir in picture.dir)
+        self.dir_offsets.append(len(self.dir_ids))
+        if path in self.handed:
+            self.handed[path] = picture
+        if self.holes > 1024 and self.holes * 2 > len(self.paths):
+            self.compact()
+
+    def __delitem__(self, path:Path) -> None:
+        self.hole(self.rows.pop(path))
+        self.handed.pop(path, None)
+
+    def __contains__(self, path:object) -> bool:
+        return path in self.rows
+
+    def __iter__(self) -> Iterator[Path]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def values(self) -> Iterator[P]: # type: ignore[override]
+        """
+        every picture, built without being kept
+        """
+        for path, row in self.rows.items():
+            p = self.handed.get(path)
+            yield self.build(row) if p is None else p
+
+    def items(self) -> Iterator[Tuple[Path, P]]: # type: ignore[override]
+        for p in self.values():
+            yield p.path, p
+
+    def changed(self, path:Path) -> None:
+        """
+        write back a picture handed out and edited in place
+        """
+        p = self.handed.get(path)
+        if p is not None and path in self.rows:
+            self[path] = p
+
+    def build(self, row:int) -> P:
+        s = self.strings.strings
+        return self.make(self.paths[row], s[self.names[row]],
+                         [s[i] for i in self.dir_ids[self.dir_offsets[row]:self.dir_offsets[row + 1]]],
+                         [s[i] for i in self.tag_ids[self.tag_offsets[row]:self.tag_offsets[row + 1]]])
+
+    def hole(self, row:int) -> None:
+        self.paths[row] = None
+        self.holes += 1
+
+    def compact(self) -> None:
+        """
+        rewrite the columns without the holes
+        """
+        paths, names = [], array('I')
+        tag_offsets, tag_ids = array('I', [0]), array('I')
+        dir_offsets, dir_ids = array('I', [0]), array('I')
+        for row, path in enumerate(self.paths):
+            if path is None:
+                continue
+            self.rows[path] = len(paths)
+            paths.append(path)
+            names.append(self.names[row])
+            tag_ids.extend(self.tag_ids[self.tag_offsets[row]:self.tag_offsets[row + 1]])
+            tag_offsets.append(len(tag_ids))
+            dir_ids.extend(self.dir_ids[self.dir_offsets[row]:self.dir_offsets[row + 1]])
+            dir_offsets.append(len(dir_ids))
+        self.paths, self.names = paths, names
+        self.tag_offsets, self.tag_ids = tag_offsets, tag_ids
+        self.dir_offsets, self.dir_ids = dir_offsets, dir_ids
+        self.holes = 0
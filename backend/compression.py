@@ -0,0 +1,83 @@
+"""
+content encoding negotiated by Accept-Encoding: gzip, and brotli when the brotli module is installed.
+only textual types are compressed, images like webp are already compressed
+"""
+
+import zlib
+import functools
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError: # optional, gzip only without it
+    brotli = None
+
+Encodings = ('br', 'gzip') if brotli is not None else ('gzip',) # by preference
+Min_Size = 1024 # smaller content is sent as is, the saving would not pay the cost
+Compressible_Types = {'application/json', 'application/javascript', 'application/x-javascript',
+                      'application/xml', 'image/svg+xml'}
+
+def compressible(content_type:Optional[str]) -> bool:
+    if content_type is None:
+        return False
+    base = content_type.partition(';')[0].strip().lower()
+    return base.startswith('text/') or base in Compressible_Types
+
+@functools.lru_cache(maxsize=256)
+def negotiate(accept_encoding:Optional[str]) -> Optional[str]:
+    """
+    the preferred encoding acceptable by an Accept-Encoding value, None for identity.
+    clients send a few distinct values, so the answers are cached
+    """
+    if not accept_encoding:
+        return None
+    weights:Dict[str, float] = dict()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for coding in Encodings:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+def compress(data:bytes, encoding:str, best:bool = False) -> bytes:
+    """
+    best: maximal compression, for content compressed once and served many times
+    """
+    if encoding == 'gzip':
+        return zlib.compress(data, 9 if best else 5, wbits=31) # gzip container
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11 if best else 4)
+    raise ValueError(f'unsupported encoding {encoding}')
+
+class PrecompressedCache:
+    """
+    compressed content of files by (path, encoding), compressed once at best level and kept
+    until the file mtime or size changes. safe to call from io threads
+    """
+    def __init__(self) -> None:
+        self.entries:Dict[Tuple[str, str], Tuple[int, int, bytes]] = dict() # (path, encoding) -> (mtime_ns, size, content)
+
+    def get(self, path:str, encoding:str, mtime_ns:int, size:int) -> bytes:
+        """
+        the content of the file at path, version (mtime_ns, size), compressed by encoding.
+        raise FileNotFoundError if no such file
+        """
+        key = (path, encoding)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == mtime_ns and entry[1] == size:
+            return entry[2]
+        with open(file=path, mode='rb') as f:
+            content = compress(f.read(), encoding, best=True)
+        self.entries[key] = (mtime_ns, size, content) # two threads may compress the same file, the last one is kept
+        return content
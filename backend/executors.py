@@ -0,0 +1,113 @@
+import time
+import asyncio
+import logging
+import functools
+import concurrent.futures
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class BoundedExecutor:
+    """
+    run blocking calls off the event loop with at most max_pending calls submitted or running.
+    when full, run raises BoundedExecutor.Saturated at once instead of queueing,
+    the http server answers it by 503.
+    the executor is created at first use, so it is never shared by forked workers
+    """
+    class Saturated(Exception):
+        def __init__(self, *args: object) -> None:
+            super().__init__(*args)
+
+    def __init__(self, name:str, factory:Callable[[], concurrent.futures.Executor], max_pending:int) -> None:
+        self.name = name
+        self.factory = factory
+        self.max_pending = max_pending
+        self.executor:Optional[concurrent.futures.Executor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, func:Callable[..., Any], *args:Any, **kwargs:Any) -> Any:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise BoundedExecutor.Saturated(f'{self.name} executor saturated ({self.pending} pending)')
+        if self.executor is None:
+            self.executor = self.factory()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def shutdown(self, wait:bool = False) -> None:
+        """
+        cancel the pending calls. wait for the running ones, and for a process pool its processes to exit, if wait
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+            self.executor = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    @staticmethod
+    def threads(name:str, workers:int, max_pending:int) -> 'BoundedExecutor':
+        """
+        for blocking file I/O
+        """
+        return BoundedExecutor(name, lambda: concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name), max_pending)
+
+    @staticmethod
+    def processes(name:str, workers:Optional[int], max_pending:int) -> 'BoundedExecutor':
+        """
+        for CPU heavy work such as Pillow/webp conversion. func and args must be picklable
+        """
+        return BoundedExecutor(name, lambda: concurrent.futures.ProcessPoolExecutor(max_workers=workers), max_pending)
+
+class LoopLagMonitor:
+    """
+    measure how late the event loop wakes up a task sleeping interval seconds.
+    a large lag means something blocks the loop
+    """
+    def __init__(self, interval:float = 0.1) -> None:
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self.total = 0.0
+        self.samples = 0
+        self.task:Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, time.perf_counter() - start - self.interval)
+            self.max = max(self.max, self.last)
+            self.total += self.last
+            self.samples += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'last_ms': self.last * 1000,
+            'max_ms': self.max * 1000,
+            'avg_ms': self.total / self.samples * 1000 if self.samples else 0.0,
+            'samples': self.samples,
+        }
+
+async def run(executor:Optional[BoundedExecutor], func:Callable[..., Any], *args:Any, **kwargs:Any) -> Any:
+    """
+    run func in executor, or inline in the event loop if executor is None
+    """
+    if executor is None:
+        return func(*args, **kwargs)
+    return await executor.run(func, *args, **kwargs)
@@ -13,28 +13,68 @@ s.start()
 """
 
 import os
+import time
 import json
+import signal
+import socket
+import secrets
 import logging
 import asyncio
 import inspect
-from typing import List, Literal, Coroutine, Callable, Tuple, Dict, Any, NoReturn, Optional, Union
+import email.utils
+import executors
+import compression
+from executors import BoundedExecutor, LoopLagMonitor
+from metrics import Registry, registry
+from typing import BinaryIO, List, Literal, Coroutine, Callable, Tuple, Dict, Any, NoReturn, Optional, Union
 
 logger = logging.getLogger(__name__)
 JsonObj = Any
 
 class HTTPStatus:
+    """
+    status line. instances are immutable and shared, the encoded line is computed once per code
+    """
+    statuses:Dict[int, 'HTTPStatus'] = dict()
     def __init__(self, code:int, description:str) -> None:
+        self.code = code
         self.value = f"HTTP/1.1 {code} {description}"
+        self.encoded = self.value.encode() + b'\r\n'
     def __str__(self) -> str:
         return self.value
     def bytes(self) -> bytes:
-        return self.value.encode() + b'\r\n'
+        return self.encoded
+    @staticmethod
+    def of(code:int, description:str) -> 'HTTPStatus':
+        status = HTTPStatus.statuses.get(code)
+        if status is None:
+            status = HTTPStatus(code, description)
+            HTTPStatus.statuses[code] = status
+        return status
     @staticmethod
     def OK() -> 'HTTPStatus':
-        return HTTPStatus(200, "OK")
+        return HTTPStatus.of(200, "OK")
+    @staticmethod
+    def PartialContent() -> 'HTTPStatus':
+        return HTTPStatus.of(206, "PARTIAL CONTENT")
+    @staticmethod
+    def NotModified() -> 'HTTPStatus':
+        return HTTPStatus.of(304, "NOT MODIFIED")
+    @staticmethod
+    def BadRequest() -> 'HTTPStatus':
+        return HTTPStatus.of(400, "BAD REQUEST")
     @staticmethod
     def NotFound() -> 'HTTPStatus':
-        return HTTPStatus(404, "NOT FOUND")
+        return HTTPStatus.of(404, "NOT FOUND")
+    @staticmethod
+    def RangeNotSatisfiable() -> 'HTTPStatus':
+        return HTTPStatus.of(416, "RANGE NOT SATISFIABLE")
+    @staticmethod
+    def InternalServerError() -> 'HTTPStatus':
+        return HTTPStatus.of(500, "INTERNAL SERVER ERROR")
+    @staticmethod
+    def ServiceUnavailable() -> 'HTTPStatus':
+        return HTTPStatus.of(503, "SERVICE UNAVAILABLE")
 
 class HTTPHeader:
     """
@@ -52,10 +92,33 @@ class HTTPHeader:
         return self.header("Content-Length", length)
     def keep_alive(self, flag:bool) -> 'HTTPHeader':
         return self.header("Connection", "keep-alive" if flag else "close")
+    def cache_control(self, value:str) -> 'HTTPHeader':
+        return self.header("Cache-Control", value)
+    def get(self, key:str, default:Optional[str] = None) -> Optional[str]:
+        """
+        value of header key, the key is case-insensitive
+        """
+        value = self.kv.get(key)
+        if value is not None:
+            return value
+        key = key.lower()
+        for k, v in self.kv.items():
+            if k.lower() == key:
+                return v
+        return default
     def __str__(self) -> str:
         return ("\r\n".join((f"{k}: {v}" for k, v in self.kv.items()))) + '\r\n\r\n'
     def bytes(self) -> bytes:
-        return bytes(str(self).encode())
+        lines = HTTPHeader.encoded_lines
+        return b''.join([lines.get((k, v)) or f"{k}: {v}\r\n".encode() for k, v in self.kv.items()]) + b'\r\n'
+    
+    encoded_lines:Dict[Tuple[str, str], bytes] = dict() # pre-encoded "key: value\r\n" of common headers
+    @staticmethod
+    def precompute(key:str, value:str) -> None:
+        """
+        keep the encoded line of header key: value, for values repeated in many responses
+        """
+        HTTPHeader.encoded_lines[(key, value)] = f"{key}: {value}\r\n".encode()
     @staticmethod
     def JSONContentType() -> 'HTTPHeader':
         return HTTPHeader().content_type("application/json; charset=utf-8")
@@ -63,19 +126,97 @@ class HTTPHeader:
     def HTMLContentType() -> 'HTTPHeader':
         return HTTPHeader().content_type("text/html; charset=utf-8")
 
+for _key, _value in (("Connection", "keep-alive"), ("Connection", "close"), ("Accept-Ranges", "bytes"),
+                     ("Content-type", "application/json; charset=utf-8"), ("Content-type", "text/html; charset=utf-8"),
+                     ("Content-type", "application/x-javascript"), ("Content-type", "image/webp"),
+                     ("Vary", "Accept-Encoding"), ("Content-Encoding", "gzip"), ("Content-Encoding", "br")):
+    HTTPHeader.precompute(_key, _value)
+
 class HttpResponse:
     """
     use ok_json to create quickly
     """
+    Small_Content = 16 * 1024 # content up to this size is sent in the same buffer as the header
+    Write_Chunk = 64 * 1024 # a larger content is written by chunks, each once the previous one is flushed
     def __init__(self, status:HTTPStatus, header:HTTPHeader, content:bytes) -> None:
         self.status = status
         self.header = header
         self.content = content
     
+    def encode(self) -> List[bytes]:
+        """
+        the response as buffers to write in order.
+        a small response is one buffer, a large content is not copied
+        """
+        head = self.status.bytes() + self.header.bytes()
+        if len(self.content) <= HttpResponse.Small_Content:
+            return [head + self.content]
+        return [head, self.content]
+    
     def send(self, dest:Callable[[bytes], None]) -> None:
-        dest(self.status.bytes())
-        dest(self.header.bytes())
-        dest(self.content)
+        for buffer in self.encode():
+            dest(buffer)
+    
+    def compress(self, request:Optional['HTTPRequest'], min_size:int = compression.Min_Size) -> 'HttpResponse':
+        """
+        encode the content as accepted by request if its type is compressible and it has min_size bytes.
+        compressible responses Vary on Accept-Encoding, compressed or not
+        """
+        if not compression.compressible(self.header.get('Content-type')):
+            return self
+        self.header.header('Vary', 'Accept-Encoding')
+        if len(self.content) < min_size or request is None or request.header is None:
+            return self
+        encoding = compression.negotiate(request.header.get('Accept-Encoding'))
+        if encoding is not None:
+            self.content = compression.compress(self.content, encoding)
+            self.header.header('Content-Encoding', encoding).content_length(len(self.content))
+        return self
+    
+    async def write(self, writer:asyncio.StreamWriter) -> int:
+        """
+        send the whole response to writer and wait until flushed, return the bytes sent.
+        a large content is written by chunks, so a slow reader holds no more than a chunk
+        above the write buffer limit of the transport
+        """
+        buffers = self.encode()
+        if len(buffers) == 1 or len(self.content) <= HttpResponse.Write_Chunk:
+            writer.writelines(buffers)
+        else:
+            writer.write(buffers[0])
+            content = memoryview(self.content)
+            for offset in range(0, len(content), HttpResponse.Write_Chunk):
+                writer.write(content[offset:offset + HttpResponse.Write_Chunk])
+                await writer.drain()
+        await writer.drain()
+        return sum(len(buffer) for buffer in buffers)
+    
+    @staticmethod
+    def file(path:str, content_type:str, request:Optional['HTTPRequest'] = None, validator:Optional['FileValidator'] = None) -> 'HttpResponse':
+        """
+        response whose body is sent from the file at path without reading it into memory.
+        if request is given, its Range/If-Range header is honored (206 or 416).
+        validator is the FileValidator of the file if the caller already has it.
+        raise FileNotFoundError if no such file
+        """
+        st = os.stat(path)
+        size = st.st_size
+        range_value = None if request is None or request.header is None else request.header.get('Range')
+        if range_value is not None:
+            if validator is None:
+                validator = FileValidator(st)
+            ranges = parse_range(range_value, size) if validator.if_range(request) else None
+            if ranges is not None:
+                if len(ranges) == 0:
+                    return HttpResponse.range_not_satisfiable(size)
+                return FileResponse.ranges(path=path, st=st, ranges=ranges, content_type=content_type)
+        header = HTTPHeader().content_type(content_type).content_length(size).header('Accept-Ranges', 'bytes')
+        return FileResponse(status=HTTPStatus.OK(), header=header, path=path, st=st, parts=[(0, size)])
+    
+    @staticmethod
+    def range_not_satisfiable(size:int) -> 'HttpResponse':
+        header = HTTPHeader().header('Content-Range', f'bytes */{size}').content_length(0)
+        return HttpResponse(status=HTTPStatus.RangeNotSatisfiable(), header=header, content=b'')
     
     @staticmethod
     def ok_json(obj:JsonObj) -> 'HttpResponse':
@@ -83,12 +224,249 @@ class HttpResponse:
         header = HTTPHeader.JSONContentType().content_length(len(content))
         return HttpResponse(status=HTTPStatus.OK(), header=header, content=content)
 
+    def validated(self, validator:'FileValidator', cache_control:Optional[str] = None, encoding:Optional[str] = None) -> 'HttpResponse':
+        """
+        add ETag, Last-Modified and cache_control to a 200 or 206 response. an error such as 416 is left as is,
+        a cache must not keep it as the representation of the file
+        """
+        if self.status.code in (200, 206):
+            validator.apply(self.header, encoding)
+            if cache_control is not None:
+                self.header.cache_control(cache_control)
+        return self
+
+    @staticmethod
+    def not_modified(validator:'FileValidator', cache_control:Optional[str] = None, encoding:Optional[str] = None) -> 'HttpResponse':
+        """
+        304 response without body
+        """
+        header = validator.apply(HTTPHeader(), encoding)
+        if cache_control is not None:
+            header.cache_control(cache_control)
+        return HttpResponse(status=HTTPStatus.NotModified(), header=header, content=b'')
+
     @staticmethod
     def not_found(obj:JsonObj) -> 'HttpResponse':
         content = json.dumps(obj, ensure_ascii=False).encode()
         header = HTTPHeader.JSONContentType().content_length(len(content))
         return HttpResponse(status=HTTPStatus.NotFound(), header=header, content=content)
 
+    @staticmethod
+    def service_unavailable(obj:JsonObj, retry_after:int = 1) -> 'HttpResponse':
+        content = json.dumps(obj, ensure_ascii=False).encode()
+        header = HTTPHeader.JSONContentType().content_length(len(content)).header('Retry-After', retry_after)
+        return HttpResponse(status=HTTPStatus.ServiceUnavailable(), header=header, content=content)
+
+    @staticmethod
+    def bad_request(obj:JsonObj) -> 'HttpResponse':
+        content = json.dumps(obj, ensure_ascii=False).encode()
+        header = HTTPHeader.JSONContentType().content_length(len(content))
+        return HttpResponse(status=HTTPStatus.BadRequest(), header=header, content=content)
+
+    @staticmethod
+    def internal_server_error(obj:JsonObj) -> 'HttpResponse':
+        content = json.dumps(obj, ensure_ascii=False).encode()
+        header = HTTPHeader.JSONContentType().content_length(len(content))
+        return HttpResponse(status=HTTPStatus.InternalServerError(), header=header, content=content)
+
+class FileResponse(HttpResponse):
+    """
+    response with body taken from the file at path, of the version stat st.
+    the body is a list of parts, either literal bytes or an (offset, count) slice of the file.
+    file slices are sent by loop.sendfile (os.sendfile when the transport supports it,
+    chunked reads otherwise), so they never live in the python heap as a whole.
+    the file is opened when the response is sent and closed once sent, a response dropped unsent holds no file
+    """
+    Part = Union[bytes, Tuple[int, int]]
+    Max_Ranges = 16 # more ranges in one request are served as the full file
+
+    def __init__(self, status:HTTPStatus, header:HTTPHeader, path:str, st:os.stat_result, parts:List[Part]) -> None:
+        super().__init__(status=status, header=header, content=b'')
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.parts = parts
+
+    def open(self) -> BinaryIO:
+        """
+        the file, checked to be the version the header was made from.
+        raise FileNotFoundError if removed since, RuntimeError if changed
+        """
+        f = open(file=self.path, mode='rb')
+        st = os.fstat(f.fileno())
+        if st.st_size != self.size or st.st_mtime_ns != self.mtime_ns:
+            f.close()
+            raise RuntimeError(f'{self.path} changed since its response was made')
+        return f
+
+    def send(self, dest:Callable[[bytes], None]) -> None:
+        """
+        blocking, the file slices are read by chunks of Write_Chunk
+        """
+        with self.open() as f:
+            dest(self.status.bytes() + self.header.bytes())
+            for part in self.parts:
+                if isinstance(part, bytes):
+                    dest(part)
+                    continue
+                offset, count = part
+                f.seek(offset)
+                while count > 0:
+                    chunk = f.read(min(count, HttpResponse.Write_Chunk))
+                    if not chunk:
+                        raise RuntimeError(f'{self.path} truncated while sent')
+                    dest(chunk)
+                    count -= len(chunk)
+
+    async def write(self, writer:asyncio.StreamWriter) -> int:
+        with self.open() as f:
+            head = self.status.bytes() + self.header.bytes()
+            writer.write(head)
+            sent = len(head)
+            loop = asyncio.get_running_loop()
+            for part in self.parts:
+                if isinstance(part, bytes):
+                    writer.write(part)
+                    sent += len(part)
+                    continue
+                offset, count = part
+                if count > 0:
+                    await writer.drain()
+                    sent += await loop.sendfile(writer.transport, f, offset=offset, count=count, fallback=True)
+            await writer.drain()
+            return sent
+
+    @staticmethod
+    def ranges(path:str, st:os.stat_result, ranges:List[Tuple[int, int]], content_type:str) -> 'FileResponse':
+        """
+        206 response of satisfiable (offset, count) ranges of the file at path, of the version stat st.
+        a single range is sent as is, several ranges as multipart/byteranges
+        """
+        size = st.st_size
+        if len(ranges) == 1:
+            offset, count = ranges[0]
+            header = HTTPHeader().content_type(content_type).content_length(count)
+            header.header('Content-Range', f'bytes {offset}-{offset + count - 1}/{size}')
+            return FileResponse(status=HTTPStatus.PartialContent(), header=header, path=path, st=st, parts=[ranges[0]])
+        if len(ranges) > FileResponse.Max_Ranges:
+            header = HTTPHeader().content_type(content_type).content_length(size).header('Accept-Ranges', 'bytes')
+            return FileResponse(status=HTTPStatus.OK(), header=header, path=path, st=st, parts=[(0, size)])
+        boundary = secrets.token_hex(16)
+        parts:List[FileResponse.Part] = []
+        length = 0
+        for offset, count in ranges:
+            preamble = (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                        f'Content-Range: bytes {offset}-{offset + count - 1}/{size}\r\n\r\n').encode()
+            parts.append(preamble)
+            parts.append((offset, count))
+            parts.append(b'\r\n')
+            length += len(preamble) + count + 2
+        epilogue = f'--{boundary}--\r\n'.encode()
+        parts.append(epilogue)
+        length += len(epilogue)
+        header = HTTPHeader().content_type(f'multipart/byteranges; boundary={boundary}').content_length(length)
+        return FileResponse(status=HTTPStatus.PartialContent(), header=header, path=path, st=st, parts=parts)
+
+def parse_range(value:str, size:int) -> Optional[List[Tuple[int, int]]]:
+    """
+    parse Range header value of a file of size bytes into (offset, count) ranges.
+    return None if the header is invalid and should be ignored,
+    an empty list if no range is satisfiable
+    """
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+    ranges:List[Tuple[int, int]] = []
+    for spec in specs.split(','):
+        first, sep, last = spec.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep:
+            return None
+        if not first: # suffix range, the last bytes
+            if not last.isdigit():
+                return None
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            if not first.isdigit() or (last and not last.isdigit()):
+                return None
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last), size - 1) if last else size - 1
+        if start <= end:
+            ranges.append((start, end - start + 1))
+    return ranges
+
+class FileValidator:
+    """
+    strong validators (ETag, Last-Modified) of a file version, derived from its size and mtime.
+    compute once per file version and keep it, see FileValidator.of
+    """
+    def __init__(self, st:os.stat_result) -> None:
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.mtime = int(st.st_mtime)
+        self.etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        self.encoded_etags = {encoding:f'"{st.st_size:x}-{st.st_mtime_ns:x}-{encoding}"' for encoding in compression.Encodings}
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+
+    def matches(self, st:os.stat_result) -> bool:
+        return self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+
+    def apply(self, header:'HTTPHeader', encoding:Optional[str] = None) -> 'HTTPHeader':
+        """
+        encoding: the content is sent encoded, its ETag is then suffixed by the encoding
+        """
+        etag = self.etag if encoding is None else self.encoded_etags[encoding]
+        return header.header('ETag', etag).header('Last-Modified', self.last_modified)
+
+    def if_range(self, request:'HTTPRequest') -> bool:
+        """
+        whether the Range of request should be honored according to If-Range
+        """
+        if_range = request.header.get('If-Range')
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == self.etag
+        return if_range == self.last_modified
+
+    def not_modified(self, request:'HTTPRequest') -> bool:
+        """
+        whether the client copy is fresh according to If-None-Match, or If-Modified-Since if absent.
+        the ETags of the encoded content match as well
+        """
+        if request.header is None:
+            return False
+        if_none_match = request.header.get('If-None-Match')
+        if if_none_match is not None:
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                tag = tag.removeprefix('W/')
+                if tag == '*' or tag == self.etag or tag in self.encoded_etags.values():
+                    return True
+            return False
+        if_modified_since = request.header.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return self.mtime <= since.timestamp()
+        return False
+
+    @staticmethod
+    def of(validators:Dict[str, 'FileValidator'], key:str, st:os.stat_result) -> 'FileValidator':
+        """
+        validator of file key from the side index validators, recompute if the file changed
+        """
+        validator = validators.get(key)
+        if validator is None or not validator.matches(st):
+            validator = FileValidator(st)
+            validators[key] = validator
+        return validator
+
 class HTTPRequest:
     def __init__(self, method:str = 'GET', path:str = '/hello', protocol:str = 'HTTP/1.1', header:HTTPHeader = None, content:Optional[bytes] = None) -> None:
         self.method = method
@@ -108,6 +486,16 @@ class HTTPRequest:
             'header': self.header.kv,
         }
     
+    def keep_alive(self) -> bool:
+        """
+        whether the client wants the connection to persist after this request.
+        HTTP/1.1 is persistent unless 'Connection: close', HTTP/1.0 only with 'Connection: keep-alive'
+        """
+        connection = '' if self.header is None else self.header.get('Connection', '').lower()
+        if self.protocol == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+    
     class Error(BaseException):
         def __init__(self, *args: Any) -> None:
             super().__init__(*args)
@@ -121,10 +509,14 @@ class HTTPHandle:
     use handle_json to create quickly
     """
     Callback = Callable[[HTTPRequest], Coroutine[None, None, HttpResponse]]
-    def __init__(self, path_prefix:str, method:Literal['GET', 'POST'], async_callback:Callback) -> None:
+    def __init__(self, path_prefix:str, method:Literal['GET', 'POST'], async_callback:Callback, max_in_flight:Optional[int] = None) -> None:
+        """
+        max_in_flight: requests handled at once, more are answered 503. the default of the Router if None
+        """
         self.path_prefix = path_prefix
         self.method = method
         self.async_callback = async_callback
+        self.max_in_flight = max_in_flight
     
     def __str__(self) -> str:
         return f"{self.method} {self.path_prefix}"
@@ -133,12 +525,15 @@ class HTTPHandle:
     def handle_json(path_prefix:str, method:Literal['GET', 'POST'], callback:Union[Callable[[Optional[JsonObj]], JsonObj],Callable[[Optional[JsonObj]], Coroutine[None, None, JsonObj]]]) -> 'HTTPHandle':
 
         async def _callback(request:HTTPRequest) -> 'HttpResponse':
-            obj = json.loads(request.content) if request.content else None
-            if inspect.iscoroutinefunction(callback):
-                res = await callback(obj)
-            else:
-                res = callback(obj)
-            return HttpResponse.ok_json(res)
+            try: # malformed json, or a callback rejecting its input with ValueError
+                obj = json.loads(request.content) if request.content else None
+                if inspect.iscoroutinefunction(callback):
+                    res = await callback(obj)
+                else:
+                    res = callback(obj)
+            except ValueError as e:
+                return HttpResponse.bad_request({'error': str(e)})
+            return HttpResponse.ok_json(res).compress(request)
         
         return HTTPHandle(path_prefix=path_prefix, method=method, async_callback=_callback)
     
@@ -147,13 +542,18 @@ class HTTPHandle:
                  'webp':'image/webp'}
     
     @staticmethod
-    def handle_static_resource(dir:str = 'res', path_prefix:str='/res') -> 'HTTPHandle':
+    def handle_static_resource(dir:str = 'res', path_prefix:str='/res', io:Optional[BoundedExecutor] = None) -> 'HTTPHandle':
         """
-        when requesting 'GET {path_prefix}/a/b/c.html', return resource at '{dir}/a/b/c.html'
+        when requesting 'GET {path_prefix}/a/b/c.html', return resource at '{dir}/a/b/c.html'.
+        textual resources are sent compressed as the client accepts, compressed once per file version;
+        range requests get the plain file
 
         dir: the root dir of all resource
         path_prefix: the URL path prefix when requested
+        io: executor of the blocking stat/open, inline in the event loop if None
         """
+        validators:Dict[str, FileValidator] = dict()
+        precompressed = compression.PrecompressedCache()
         async def _callback(request:HTTPRequest) -> 'HttpResponse':
             path = request.path[len(path_prefix)+1:]
             dot = path.rfind('.')
@@ -162,10 +562,40 @@ class HTTPHandle:
                 content_type = 'application/octet-stream'
             else:
                 content_type = HTTPHandle.mimetypes[path[dot+1:]]
-            with open(file=os.path.join(dir, path), mode='rb') as f:
-                data = f.read()
-            header = HTTPHeader().content_type(content_type).content_length(len(data))
-            return HttpResponse(status=HTTPStatus.OK(), header=header, content=data)
+            compressible = compression.compressible(content_type)
+            try:
+                file = os.path.join(dir, path)
+                st = await executors.run(io, os.stat, file)
+                validator = FileValidator.of(validators, file, st)
+                encoding = None
+                if compressible and st.st_size >= compression.Min_Size and request.header.get('Range') is None:
+                    encoding = compression.negotiate(request.header.get('Accept-Encoding'))
+                if validator.not_modified(request):
+                    response = HttpResponse.not_modified(validator, encoding=encoding)
+                elif encoding is not None:
+                    content = await executors.run(io, precompressed.get, file, encoding, st.st_mtime_ns, st.st_size)
+                    header = HTTPHeader().content_type(content_type).content_length(len(content)).header('Content-Encoding', encoding)
+                    response = HttpResponse(status=HTTPStatus.OK(), header=header, content=content).validated(validator, encoding=encoding)
+                else:
+                    response = await executors.run(io, HttpResponse.file, path=file, content_type=content_type, request=request, validator=validator)
+                    response.validated(validator)
+            except FileNotFoundError:
+                return HttpResponse.not_found({'path':request.path})
+            if compressible:
+                response.header.header('Vary', 'Accept-Encoding')
+            return response
+
+        return HTTPHandle(path_prefix=path_prefix, method='GET', async_callback=_callback)
+    
+    @staticmethod
+    def handle_metrics(path_prefix:str = '/metrics', registry:Registry = registry) -> 'HTTPHandle':
+        """
+        GET the metrics of registry in the prometheus text format
+        """
+        async def _callback(request:HTTPRequest) -> 'HttpResponse':
+            content = registry.render().encode()
+            header = HTTPHeader().content_type(Registry.Content_Type).content_length(len(content))
+            return HttpResponse(status=HTTPStatus.OK(), header=header, content=content)
 
         return HTTPHandle(path_prefix=path_prefix, method='GET', async_callback=_callback)
     
@@ -176,84 +606,217 @@ class HTTPHandle:
 class HTTPReader:
     """
     inner method
+
+    the request line and header are read by readuntil, the body by readexactly,
+    so bytes are copied once whatever the body size. bytes after a request stay in the StreamReader.
+    each request has one deadline, set when its header starts to be read, and its header a shorter one
+    against clients sending it byte by byte (slow loris). the header of the first request has it from the accept,
+    so connections sending nothing are not kept
     """
-    def __init__(self, reader:asyncio.StreamReader, peername:str, timeout:float, ) -> None:
+    HEADER_END = b"\r\n\r\n"
+
+    def __init__(self, reader:asyncio.StreamReader, peername:str, timeout:float, max_header_size:int = 10240, max_body_size:int = 32 * 1024 * 1024,
+                 header_timeout:Optional[float] = None) -> None:
         self.peername = peername
         self.reader = reader
         self.timeout = timeout
+        self.header_timeout = timeout if header_timeout is None else min(header_timeout, timeout)
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.deadline = 0.0
+        self.started_ns = 0 # perf_counter_ns at the first byte of the request
+        self.accepted = asyncio.get_running_loop().time()
 
         logger.debug("conn with %s", peername)
 
-    async def read_request_header(self) -> HTTPRequest:
-        """
-        read request line and header
-        the content may read part and should use read_request_body
-        """
-        async def read_header() -> Tuple[bytes, bytes]:
-            HEADER_END = b"\r\n\r\n"
-            buffer = bytes()
-            while True: # read 
-                data = await asyncio.wait_for(self.reader.read(1024), timeout=self.timeout)
-                if len(data) == 0: # conn closed
-                    raise HTTPRequest.Exception("connection closed")
-                buffer += data
-                delimiter = buffer.find(HEADER_END)
-                if delimiter != -1: #  read whole header
-                    return buffer[:delimiter], buffer[delimiter + len(HEADER_END):]
-                if len(buffer) > 10240:
-                    raise HTTPRequest.Error(f'request header too long! ({buffer.decode(encoding='utf-8')})')
+    async def read_request_header(self, idle_timeout:Optional[float] = None) -> HTTPRequest:
+        """
+        wait at most idle_timeout for the next request, then read its request line and header.
+        the first request of the connection (idle_timeout None) has header_timeout from the accept for both.
+        the deadline of the request starts with its first byte.
+        a pipelined request already buffered is read at once.
+        the body should be read by read_request_body
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            header_deadline = self.accepted + self.header_timeout
+            async with asyncio.timeout_at(header_deadline if idle_timeout is None else loop.time() + idle_timeout):
+                first = await self.reader.readexactly(1)
+            self.started_ns = time.perf_counter_ns()
+            now = loop.time()
+            self.deadline = now + self.timeout
+            if idle_timeout is not None:
+                header_deadline = now + self.header_timeout
+            async with asyncio.timeout_at(header_deadline):
+                header_content = first + await self.reader.readuntil(HTTPReader.HEADER_END)
+        except asyncio.IncompleteReadError as e:
+            raise HTTPRequest.Exception("connection closed") from e
+        except asyncio.LimitOverrunError as e:
+            raise HTTPRequest.Error(f'request header too long! ({e.consumed} bytes)') from e
+        if len(header_content) > self.max_header_size:
+            raise HTTPRequest.Error(f'request header too long! ({len(header_content)} bytes)')
+        
+        lines = header_content[:-len(HTTPReader.HEADER_END)].decode(encoding='utf-8').split('\r\n')
+        logger.debug("request %s", lines[0])
+        parts = lines[0].split(' ')
+        if len(parts) != 3:
+            raise HTTPRequest.Error(f'bad http request line {lines[0]}')
+        method, path, protocol = parts
         
-        header_content, part_content = await read_header()
-        method, path, protocol = None, None, None
         header = HTTPHeader()
-
-        for line in header_content.decode(encoding='utf-8').split('\r\n'):
-            if method is None: # first line
-                logger.debug("request %s", line)
-                parts = line.split(' ')
-                if len(parts) != 3:
-                    raise HTTPRequest.Error(f'bad http request line {line}')
-                method, path, protocol = parts
-            else:
-                delimiter = line.find(': ')
-                if delimiter == -1:
-                    raise HTTPRequest.Error(f'bad http request header {line}')
-                key, value = line[:delimiter], line[delimiter + len(': '):]
-                header.kv[key] = value
+        for line in lines[1:]:
+            key, delimiter, value = line.partition(':')
+            if not delimiter:
+                raise HTTPRequest.Error(f'bad http request header {line}')
+            header.kv[key] = value.strip()
         
-        return HTTPRequest(method=method, path=path, protocol=protocol, header=header, content=part_content)
-
+        return HTTPRequest(method=method, path=path, protocol=protocol, header=header, content=b'')
 
     async def read_request_body(self, part_request:HTTPRequest) -> HTTPRequest:
         """
-        read request body and combine with part_request.content
+        read request body into part_request.content, within the deadline of the request
         """
-        async def read_content(part_content:bytes, content_length:int) -> bytes:
-            while len(part_content) < content_length:
-                data = await asyncio.wait_for(self.reader.read(1024), timeout=self.timeout)
-                if len(data) == 0:
-                    raise HTTPRequest.Exception("connection closed")
-                part_content += data
-            return part_content
-        
-        content_length = int(part_request.header.kv.get(HTTPHeader.Key_Content_Length, '0'))
+        try:
+            content_length = int(part_request.header.get(HTTPHeader.Key_Content_Length, '0'))
+        except ValueError as e:
+            raise HTTPRequest.Error(f'bad content length {part_request.header.get(HTTPHeader.Key_Content_Length)}') from e
+        if content_length < 0 or content_length > self.max_body_size:
+            raise HTTPRequest.Error(f'request body too long! ({content_length} bytes)')
         if content_length > 0:
-            content = await read_content(part_content=part_request.content, content_length=content_length)
-            part_request.content = content
+            try:
+                async with asyncio.timeout_at(self.deadline):
+                    part_request.content = await self.reader.readexactly(content_length)
+            except asyncio.IncompleteReadError as e:
+                raise HTTPRequest.Exception("connection closed") from e
         
         return part_request
         
-class Router:
+class RadixTree:
     """
-    TODO optimize
+    inner class. compressed prefix tree over path strings
+
+    each edge is labeled by a substring, children are indexed by the first char of the label,
+    so a lookup costs O(len(path)) whatever the number of registered prefixes.
+    lookup returns the value of the longest registered prefix of path
     """
+    class Node:
+        __slots__ = ('label', 'children', 'value')
+        def __init__(self, label:str = '') -> None:
+            self.label = label
+            self.children:Dict[str, 'RadixTree.Node'] = dict()
+            self.value:Any = None
+
     def __init__(self) -> None:
+        self.root = RadixTree.Node()
+        self.size = 0
+
+    def insert(self, prefix:str, value:Any) -> None:
+        """
+        register value for prefix. overwrite the old value if prefix exists
+        """
+        node = self.root
+        i = 0
+        while i < len(prefix):
+            child = node.children.get(prefix[i])
+            if child is None:
+                child = RadixTree.Node(prefix[i:])
+                node.children[prefix[i]] = child
+                node = child
+                break
+            label = child.label
+            common = 0
+            while common < len(label) and i + common < len(prefix) and label[common] == prefix[i + common]:
+                common += 1
+            if common < len(label): # split edge
+                middle = RadixTree.Node(label[:common])
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[prefix[i]] = middle
+                child = middle
+            node = child
+            i += common
+        if node.value is None:
+            self.size += 1
+        node.value = value
+
+    def longest_prefix(self, path:str) -> Any:
+        """
+        value of the longest registered prefix of path, or None
+        """
+        node = self.root
+        found = node.value
+        i = 0
+        while i < len(path):
+            node = node.children.get(path[i])
+            if node is None or not path.startswith(node.label, i):
+                break
+            i += len(node.label)
+            if node.value is not None:
+                found = node.value
+        return found
+
+    def __len__(self) -> int:
+        return self.size
+
+class Route:
+    """
+    a compiled route: its callback, its limit of requests handled at once,
+    the latency of each phase of its requests and the bytes of their responses
+    """
+    __slots__ = ('callback', 'max_in_flight', 'in_flight', 'parse', 'handler', 'write', 'sent', 'rejected')
+
+    def __init__(self, method:str, path_prefix:str, callback:HTTPHandle.Callback, registry:Registry, max_in_flight:Optional[int] = None) -> None:
+        self.callback = callback
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        registry.gauge('http_in_flight', 'requests being handled', func=lambda: self.in_flight, method=method, route=path_prefix)
+        self.parse = registry.histogram('http_parse_seconds', 'read of the request line, header and body, from its first byte',
+                                        method=method, route=path_prefix)
+        self.handler = registry.histogram('http_handler_seconds', 'callback of the route, postprocess included',
+                                          method=method, route=path_prefix)
+        self.write = registry.histogram('http_write_seconds', 'write of the response until flushed',
+                                        method=method, route=path_prefix)
+        self.sent = registry.counter('http_sent_bytes_total', 'bytes of the responses, header included',
+                                     method=method, route=path_prefix)
+        self.rejected = registry.counter('http_rejected_total', 'requests answered 503 at once, max_in_flight reached',
+                                         method=method, route=path_prefix)
+
+    def full(self) -> bool:
+        return self.max_in_flight is not None and self.in_flight >= self.max_in_flight
+
+class Router:
+    """
+    routes are compiled into a RadixTree per method when added.
+    the most specific (longest) path_prefix wins, whatever the order of add_router
+    """
+    def __init__(self, max_in_flight:Optional[int] = None, registry:Optional[Registry] = None) -> None:
+        """
+        max_in_flight: requests handled at once by a route whose HTTPHandle has no limit, unlimited if None
+        registry: of the metrics of the routes, one of this router only if None, dropped with it
+        """
+        self.registry = Registry() if registry is None else registry
         self.handles:List[HTTPHandle] = []
-        self.fall_back:HTTPHandle.Callback = HTTPHandle.not_found
         self.postprocesses:List[Callable[[HttpResponse], None]] = []
+        self.trees:Dict[str, RadixTree] = dict() # method -> path prefix -> Route
+        self.max_in_flight = max_in_flight
+        self.fall_back = HTTPHandle.not_found
+    
+    @property
+    def fall_back(self) -> HTTPHandle.Callback:
+        return self.fall_back_route.callback
+    
+    @fall_back.setter
+    def fall_back(self, callback:HTTPHandle.Callback) -> None:
+        self.fall_back_route = Route('*', '*', self._bind(callback), self.registry, self.max_in_flight)
     
     def add_router(self, handler:HTTPHandle) -> None:
         self.handles.append(handler)
+        tree = self.trees.get(handler.method)
+        if tree is None:
+            tree = RadixTree()
+            self.trees[handler.method] = tree
+        max_in_flight = self.max_in_flight if handler.max_in_flight is None else handler.max_in_flight
+        tree.insert(handler.path_prefix, Route(handler.method, handler.path_prefix, self._bind(handler.async_callback), self.registry, max_in_flight))
         logger.debug('add router %s', str(handler))
 
     def add_postprocess(self, postprocess:Callable[[HttpResponse], None]) -> None:
@@ -262,63 +825,308 @@ class Router:
     def keep_alive(self, flag:bool) -> None:
         self.add_postprocess(lambda res:res.header.keep_alive(flag=flag))
     
-    def route(self, request:HTTPRequest) -> HTTPHandle.Callback:
-        callback:HTTPHandle.Callback = None
-        for handle in self.handles:
-            if handle.method == request.method:
-                if request.path.startswith(handle.path_prefix):
-                    callback = handle.async_callback
-        if callback is None:
-            callback = self.fall_back
-        
+    def _bind(self, callback:HTTPHandle.Callback) -> HTTPHandle.Callback:
+        """
+        wrap callback with the postprocess chain once, at registration
+        """
+        postprocesses = self.postprocesses # shared list, postprocess added later also apply
         async def _full_callback(request:HTTPRequest) -> HttpResponse:
             response = await callback(request)
-            for postprocess in self.postprocesses:
+            for postprocess in postprocesses:
                 postprocess(response)
             return response
-        
         return _full_callback
 
+    def route(self, request:HTTPRequest) -> HTTPHandle.Callback:
+        return self.match(request).callback
+
+    def match(self, request:HTTPRequest) -> Route:
+        tree = self.trees.get(request.method)
+        if tree is None:
+            return self.fall_back_route
+        route = tree.longest_prefix(request.path)
+        if route is None:
+            return self.fall_back_route
+        return route
+
 class HTTPServer:
-    def __init__(self, ip = '0.0.0.0', port = 35000, timeout = 5.0, keep_alive = True) -> None:
+    """
+    timeout: deadline of reading a request, and of writing its response
+    header_timeout: deadline of reading the request line and header, from their first byte,
+             or from the accept for the first request of a connection
+    idle_timeout: how long a keep-alive connection may wait for its next request
+    max_requests_per_conn: the connection is closed after serving so many requests
+    max_connections: connections open at once per worker, a connection beyond is answered 503 and closed
+             without being read. if None, most of the file descriptors the process may open
+    max_in_flight: requests handled at once per route (see HTTPHandle max_in_flight), more are answered 503
+    write_buffer_high: bytes buffered for a connection before its writes wait for the client to read
+    workers: number of processes forked to serve the same listening socket (needs os.fork).
+             crashed workers are restarted, SIGTERM/SIGINT stop them gracefully
+    """
+    Reject_Timeout = 0.5 # to read the request of a connection over max_connections, then to answer it
+
+    def __init__(self, ip = '0.0.0.0', port = 35000, timeout = 5.0, keep_alive = True,
+                 max_header_size = 10240, max_body_size = 32 * 1024 * 1024,
+                 idle_timeout = 15.0, max_requests_per_conn = 1000, workers = 1,
+                 header_timeout = 2.0, max_connections:Optional[int] = None, max_in_flight:Optional[int] = None,
+                 write_buffer_high = 64 * 1024) -> None:
         self.ip = ip
         self.port = port
         self.timeout = timeout
-        self.router = Router()
-
-        self.router.keep_alive(flag=keep_alive)
+        self.keep_alive = keep_alive
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.idle_timeout = idle_timeout
+        self.max_requests_per_conn = max_requests_per_conn
+        self.workers = workers
+        self.header_timeout = header_timeout
+        self.max_connections = HTTPServer.default_max_connections() if max_connections is None else max_connections
+        self.write_buffer_high = write_buffer_high
+        self.router = Router(max_in_flight=max_in_flight, registry=registry) # served routes are in /metrics
+        self.startup_hooks:List[Callable[[int], None]] = []
+        self.shutdown_hooks:List[Callable[[], None]] = []
+        self.conns:Dict[asyncio.StreamWriter, bool] = dict() # open connections -> serving a request now
+        self.stopping = False
+        self.loop_lag = LoopLagMonitor()
+        self.accepted = registry.counter('http_connections_total', 'connections accepted')
+        self.rejected = registry.counter('http_rejected_connections_total', 'connections answered 503 at once, max_connections reached')
+        registry.gauge('http_open_connections', 'connections open now', func=lambda: len(self.conns))
+        registry.gauge('event_loop_lag_seconds', 'last lag of the event loop measured by LoopLagMonitor', func=lambda: self.loop_lag.last)
 
     def add_router(self, handler:HTTPHandle) -> None:
         self.router.add_router(handler)
 
+    @staticmethod
+    def default_max_connections() -> int:
+        """
+        the soft limit of open files less a quarter, kept for picture files, pipes and the log
+        """
+        try:
+            import resource
+            soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        except (ImportError, OSError, ValueError): # no resource module on windows
+            return 512
+        if soft == resource.RLIM_INFINITY:
+            return 8192
+        return max(16, soft - max(64, soft // 4))
+
+    def add_startup(self, hook:Callable[[int], None]) -> None:
+        """
+        hook(worker_id) is called in the event loop of each worker before serving.
+        worker_id is 0 in single process mode
+        """
+        self.startup_hooks.append(hook)
+
+    def add_shutdown(self, hook:Callable[[], None]) -> None:
+        """
+        hook() is called in the event loop of each worker once it stopped serving, before the worker exits.
+        a forked worker exits by os._exit, what its startup hooks started is not cleaned up otherwise
+        """
+        self.shutdown_hooks.append(hook)
+
     async def server_each_conn(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        self.accepted.inc()
+        if len(self.conns) >= self.max_connections:
+            await self.reject(reader, writer)
+            return
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_high)
         peername = str(writer.get_extra_info('peername', default='unknon'))
-        http_reader = HTTPReader(reader=reader, peername=peername, timeout=self.timeout)
+        http_reader = HTTPReader(reader=reader, peername=peername, timeout=self.timeout,
+                                 max_header_size=self.max_header_size, max_body_size=self.max_body_size,
+                                 header_timeout=self.header_timeout)
+        served = 0
+        self.conns[writer] = False
         try:
             while True:
-                part_request = await http_reader.read_request_header()
-                callback = self.router.route(part_request)
+                # pipelined requests wait in the StreamReader, they are served one by one so responses keep their order
+                part_request = await http_reader.read_request_header(idle_timeout=self.idle_timeout if served > 0 else None)
+                self.conns[writer] = True
+                route = self.router.match(part_request)
                 request = await http_reader.read_request_body(part_request=part_request)
-                response = await callback(request)
-                response.send(writer.write)
-                await asyncio.wait_for(writer.drain(), timeout=self.timeout)
+                handler_start = time.perf_counter_ns()
+                route.parse.observe_ns(handler_start - http_reader.started_ns)
+                served += 1
+                keep_alive = self.keep_alive and request.keep_alive() and served < self.max_requests_per_conn and not self.stopping
+                if route.full():
+                    route.rejected.inc()
+                    response = HttpResponse.service_unavailable({'error':'overloaded'})
+                else:
+                    route.in_flight += 1
+                    try:
+                        response = await route.callback(request)
+                    except BoundedExecutor.Saturated as e:
+                        logger.warning("%s when %s", str(e), str(request))
+                        response = HttpResponse.service_unavailable({'error':'overloaded'})
+                    except Exception as e:
+                        logger.exception("%s in %s when %s", type(e).__name__, peername, str(request))
+                        response = HttpResponse.internal_server_error({'error':type(e).__name__})
+                        keep_alive = False
+                    finally:
+                        route.in_flight -= 1
+                write_start = time.perf_counter_ns()
+                route.handler.observe_ns(write_start - handler_start)
+                response.header.keep_alive(flag=keep_alive)
+                route.sent.inc(await asyncio.wait_for(response.write(writer), timeout=self.timeout))
+                route.write.observe_ns(time.perf_counter_ns() - write_start)
+                if not keep_alive:
+                    break
+                self.conns[writer] = False
+        except HTTPRequest.Exception as e:
+            logger.debug("%s with %s. closed", str(e), peername)
+        except HTTPRequest.Error as e:
+            logger.warning("bad request from %s, %s. closed", peername, str(e))
+            response = HttpResponse.bad_request({'error':str(e)})
+            response.header.keep_alive(flag=False)
+            try:
+                await asyncio.wait_for(response.write(writer), timeout=self.timeout)
+            except Exception:
+                pass
         except TimeoutError:
-            logger.debug(f"timeout with %s. closed", peername)
+            logger.debug("timeout with %s. closed", peername)
         except Exception as e:
-            logger.warning(f"%s in %s, %s. closed", type(e).__name__, peername, str(e))
+            logger.warning("%s in %s, %s. closed", type(e).__name__, peername, str(e))
         finally:
+            self.conns.pop(writer, None)
             writer.close()
 
-    async def start_async(self) -> NoReturn:
-        server = await asyncio.start_server(self.server_each_conn, self.ip, self.port)
+    async def reject(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        """
+        answer 503 to a connection over max_connections and close it. the request header is read first
+        and the input discarded until the client closes, each within Reject_Timeout: closing a socket
+        with unread input resets it, and the client may lose the answer
+        """
+        self.rejected.inc()
+        response = HttpResponse.service_unavailable({'error':'too many connections'})
+        response.header.keep_alive(flag=False)
+        try:
+            try:
+                async with asyncio.timeout(HTTPServer.Reject_Timeout):
+                    await reader.readuntil(HTTPReader.HEADER_END)
+            except (TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                pass
+            async with asyncio.timeout(HTTPServer.Reject_Timeout):
+                await response.write(writer)
+                if writer.can_write_eof():
+                    writer.write_eof()
+                while await reader.read(HttpResponse.Write_Chunk):
+                    pass
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    async def start_async(self, sock:Optional[socket.socket] = None, worker_id:int = 0) -> None:
+        """
+        serve on sock if given (inherited from the master process), else on ip:port.
+        SIGTERM stops the server gracefully when the loop can handle it, in the main thread
+        """
+        limit = max(self.max_header_size, 2 ** 16)
+        if sock is None:
+            server = await asyncio.start_server(self.server_each_conn, self.ip, self.port, limit=limit)
+        else:
+            server = await asyncio.start_server(self.server_each_conn, sock=sock, limit=limit)
         addr = server.sockets[0].getsockname()
-        logger.info(f'Serving on {addr}')
-        async with server:
-            await server.serve_forever()
+        logger.info(f'Serving on {addr}' + (f' (worker {worker_id}, pid {os.getpid()})' if sock is not None else ''))
+        self.loop_lag.start()
+        for hook in self.startup_hooks:
+            hook(worker_id)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (RuntimeError, NotImplementedError): # not the main thread, or a loop without signals (windows)
+            logger.debug('no SIGTERM handler, the server stops when cancelled')
+        try:
+            async with server:
+                await server.start_serving()
+                await stop.wait()
+                await self.shutdown(server)
+        finally:
+            for hook in self.shutdown_hooks:
+                try:
+                    hook()
+                except Exception:
+                    logger.exception('shutdown hook %s failed', getattr(hook, '__qualname__', hook))
+
+    async def shutdown(self, server:asyncio.Server) -> None:
+        """
+        stop accepting, close idle connections and wait at most timeout for requests being served
+        """
+        self.stopping = True
+        server.close()
+        for writer, busy in list(self.conns.items()):
+            if not busy:
+                writer.close()
+        deadline = time.monotonic() + self.timeout
+        while self.conns and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        logger.info('stop server (pid %d)', os.getpid())
     
     def start(self) -> NoReturn:
+        if self.workers > 1 and not hasattr(os, 'fork'):
+            logger.warning('multi-process workers need os.fork, serve in one process')
+            self.workers = 1
+        if self.workers > 1:
+            self.start_workers()
+            return
         try:
             asyncio.run(self.start_async())
         except KeyboardInterrupt:
             logger.info('stop server')
+
+    def start_workers(self) -> None:
+        """
+        bind the listening socket once and fork workers sharing it.
+        the master only restarts crashed workers and forwards SIGTERM/SIGINT to them
+        """
+        sock = socket.create_server((self.ip, self.port), backlog=1024)
+        children:Dict[int, int] = dict() # pid -> worker_id
+        stopping = False
+
+        def spawn(worker_id:int) -> None:
+            pid = os.fork()
+            if pid == 0: # worker
+                code = 0
+                try:
+                    signal.signal(signal.SIGINT, signal.SIG_IGN) # the master forwards it as SIGTERM
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    asyncio.run(self.start_async(sock=sock, worker_id=worker_id))
+                except BaseException:
+                    logger.exception('worker %d crashed', worker_id)
+                    code = 1
+                finally:
+                    logging.shutdown() # flush the queued log records, os._exit skips atexit
+                    os._exit(code)
+            children[pid] = worker_id
+
+        def stop(signum, _) -> None:
+            nonlocal stopping
+            stopping = True
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for worker_id in range(self.workers):
+            spawn(worker_id)
+        logger.info('started %d workers on %s:%d', self.workers, self.ip, self.port)
+
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker_id = children.pop(pid, None)
+            if worker_id is None or stopping:
+                continue
+            logger.warning('worker %d (pid %d) exited with status %d, restart it', worker_id, pid, status)
+            time.sleep(0.5) # do not spin if it crashes at once
+            if not stopping:
+                spawn(worker_id)
+        sock.close()
+        logger.info('stop server')
         
@@ -0,0 +1,187 @@
+import heapq
+import bisect
+import random
+from sampling import DenseSet, WeightedSampler
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+Path = str
+Paths = Union[DenseSet[Path], Set[Path]]
+
+class TagCounts:
+    """
+    number of pictures of each tag, kept ordered by count as tags are added and removed.
+    tags are bucketed by count and the distinct counts kept sorted, a change moves one tag between two buckets
+    """
+    def __init__(self) -> None:
+        self.count:Dict[str, int] = dict()
+        self.buckets:Dict[int, Dict[str, None]] = dict() # count -> tags, a dict as an ordered set
+        self.counts:List[int] = [] # distinct counts, ascending
+
+    def increase(self, tag:str, delta:int) -> None:
+        old = self.count.get(tag, 0)
+        new = old + delta
+        if old > 0:
+            bucket = self.buckets[old]
+            del bucket[tag]
+            if not bucket:
+                del self.buckets[old]
+                del self.counts[bisect.bisect_left(self.counts, old)]
+        if new > 0:
+            self.count[tag] = new
+            bucket = self.buckets.get(new)
+            if bucket is None:
+                bucket = self.buckets[new] = dict()
+                bisect.insort(self.counts, new)
+            bucket[tag] = None
+        else:
+            self.count.pop(tag, None)
+
+    def most_common(self) -> Iterator[Tuple[str, int]]:
+        for count in reversed(self.counts):
+            for tag in self.buckets[count]:
+                yield tag, count
+
+class PictureIndex:
+    """
+    inverted indexes tag -> paths and dir -> paths, with the tag counts and the random selection of paths.
+    the tags and dirs indexed for each path are remembered, so a picture edited in place is reindexed by update.
+    paths are kept in DenseSet, any of them (or of a tag) is picked uniformly in O(1),
+    and with weighted, in a WeightedSampler for picks in proportion to their weight.
+    once an unfiltered page is asked, the paths are also kept sorted for the next ones
+    """
+    Max_Tries = 32 # rejected draws before sample falls back to listing the matches
+    Empty:DenseSet[Path] = DenseSet()
+
+    def __init__(self, weighted:bool = False) -> None:
+        self.by_tag:Dict[str, DenseSet[Path]] = dict()
+        self.by_dir:Dict[str, DenseSet[Path]] = dict()
+        self.tag_counts = TagCounts()
+        self.indexed:Dict[Path, Tuple[Tuple[str, ...], Tuple[str, ...]]] = dict()
+        self.paths:DenseSet[Path] = DenseSet()
+        self.ordered:Optional[List[Path]] = None # paths sorted, built by the first unfiltered page
+        self.weights:Optional[WeightedSampler[Path]] = WeightedSampler() if weighted else None
+
+    def update(self, path:Path, tags:Optional[Iterable[str]], dirs:Optional[Iterable[str]] = None, weight:float = 1.0) -> None:
+        """
+        index path under tags and dirs, replacing what it was indexed under. tags None removes the path
+        """
+        old_tags, old_dirs = self.indexed.pop(path, ((), ()))
+        new_tags = () if tags is None else tuple(dict.fromkeys(tags))
+        new_dirs = () if tags is None or dirs is None else tuple(dict.fromkeys(dirs))
+        for tag in set(old_tags).difference(new_tags) if old_tags else ():
+            self._remove(self.by_tag, tag, path)
+            self.tag_counts.increase(tag, -1)
+        for tag in set(new_tags).difference(old_tags) if old_tags else new_tags:
+            self._add(self.by_tag, tag, path)
+            self.tag_counts.increase(tag, 1)
+        for dir in set(old_dirs).difference(new_dirs) if old_dirs else ():
+            self._remove(self.by_dir, dir, path)
+        for dir in set(new_dirs).difference(old_dirs) if old_dirs else new_dirs:
+            self._add(self.by_dir, dir, path)
+        if tags is None:
+            if self.paths.discard(path) is not None and self.ordered is not None:
+                del self.ordered[bisect.bisect_left(self.ordered, path)]
+            if self.weights is not None:
+                self.weights.discard(path)
+        else:
+            self.indexed[path] = (new_tags, new_dirs)
+            if self.paths.add(path) and self.ordered is not None:
+                bisect.insort(self.ordered, path)
+            if self.weights is not None:
+                self.weights.set(path, weight)
+
+    def clear(self) -> None:
+        self.__init__(weighted=self.weights is not None)
+
+    def select(self, tags:Iterable[str] = (), any_tags:bool = False, dir:Optional[str] = None) -> Set[Path]:
+        """
+        paths having all tags (any of them if any_tags), in dir if not None.
+        membership is tested against the smallest set, so the cost follows the smallest set, not the library.
+        without any filter it is a copy of every path, see page
+        """
+        sets = self._sets(tags, any_tags, dir)
+        if not sets:
+            return set(self.paths)
+        return self._intersect(sets)
+
+    def page(self, tags:Iterable[str] = (), any_tags:bool = False, dir:Optional[str] = None,
+             offset:int = 0, limit:int = 50) -> Tuple[int, List[Path]]:
+        """
+        (number of matches, matches offset to offset + limit in path order) of select.
+        a filtered page keeps the offset + limit smallest of the m matches, O(m log(offset + limit)).
+        an unfiltered page is a slice of the sorted paths, O(offset + limit) once they are sorted:
+        the first one sorts the library, adds and removes then cost a bisect and a memmove
+        """
+        sets = self._sets(tags, any_tags, dir)
+        if not sets:
+            if self.ordered is None:
+                self.ordered = sorted(self.paths)
+            return len(self.ordered), self.ordered[offset:offset + limit]
+        matches = sets[0] if len(sets) == 1 else self._intersect(sets)
+        return len(matches), heapq.nsmallest(offset + limit, matches)[offset:]
+
+    def sample(self, rand:random.Random, tags:Iterable[str] = (), dir:Optional[str] = None,
+               weighted:bool = False, exclude:Container[Path] = ()) -> Optional[Path]:
+        """
+        a random path having all tags, in dir if not None, not in exclude unless every match is.
+        uniform, or in proportion to the weights if weighted. O(1) (O(log n) weighted) while matches are not rare,
+        otherwise the matches are listed
+        """
+        if weighted and self.weights is None:
+            raise ValueError('weighted random selection is not enabled')
+        sets = self._sets(tags, False, dir)
+        if weighted:
+            draw, checks = self.weights.choice, sets
+        elif sets:
+            draw, checks = sets[0].choice, sets[1:]
+        else:
+            draw, checks = self.paths.choice, []
+        for _ in range(PictureIndex.Max_Tries):
+            path = draw(rand)
+            if path is None:
+                return None
+            if path not in exclude and all(path in s for s in checks):
+                return path
+        matches = sorted(self.select(tags, dir=dir))
+        candidates = [path for path in matches if path not in exclude] or matches
+        if not candidates:
+            return None
+        if weighted:
+            weights = [self.weights.weight(path) for path in candidates]
+            if sum(weights) <= 0:
+                return None
+            return rand.choices(candidates, weights=weights)[0]
+        return rand.choice(candidates)
+
+    def _sets(self, tags:Iterable[str], any_tags:bool, dir:Optional[str]) -> List[Paths]:
+        """
+        the sets to intersect, smallest first
+        """
+        sets:List[Paths] = [self.by_tag.get(tag, PictureIndex.Empty) for tag in dict.fromkeys(tags)]
+        if any_tags and sets:
+            sets = [set().union(*sets)]
+        if dir is not None:
+            sets.append(self.by_dir.get(dir, PictureIndex.Empty))
+        sets.sort(key=len)
+        return sets
+
+    @staticmethod
+    def _intersect(sets:List[Paths]) -> Set[Path]:
+        """
+        paths of all sets, smallest first
+        """
+        return {path for path in sets[0] if all(path in s for s in sets[1:])}
+
+    @staticmethod
+    def _add(index:Dict[str, DenseSet[Path]], key:str, path:Path) -> None:
+        paths = index.get(key)
+        if paths is None:
+            paths = index[key] = DenseSet()
+        paths.add(path)
+
+    @staticmethod
+    def _remove(index:Dict[str, DenseSet[Path]], key:str, path:Path) -> None:
+        paths = index[key]
+        paths.discard(path)
+        if not paths:
+            del index[key]
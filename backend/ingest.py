@@ -0,0 +1,142 @@
+"""
+batch import of pictures into the picture database
+
+convert every picture under src into webp in the picture root dir, in the same subdirectory as under src,
+in parallel, then register the new pictures in the database with a single persistence.
+progress is appended to a manifest, an interrupted run skips what is already done
+
+python ingest.py SRC [--root pic] [--database db.json] [--workers 32] [--manifest ingest-manifest.jsonl]
+"""
+
+import os
+import json
+import hashlib
+import logging
+import argparse
+import picture_utils
+from typing import Dict, Iterator, List, Optional, Tuple
+from picture_server import Pictures, open_pictures
+
+logger = logging.getLogger(__name__)
+
+class Manifest:
+    """
+    append-only jsonl record of each source file converted or failed.
+    the last record of a source wins
+    """
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.done:Dict[str, str] = dict() # source -> picture path
+        self.failed:Dict[str, str] = dict() # source -> error
+        if os.path.exists(path):
+            with open(file=path, mode='r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError: # torn last line of an interrupted run
+                        continue
+                    self._apply(record)
+        self.file = open(file=path, mode='a', encoding='utf-8')
+
+    def _apply(self, record:Dict) -> None:
+        if record['status'] == 'done':
+            self.done[record['src']] = record['dest']
+            self.failed.pop(record['src'], None)
+        else:
+            self.failed[record['src']] = record['error']
+            self.done.pop(record['src'], None)
+
+    def record(self, src:str, dest:str, error:Optional[str]) -> None:
+        record = {'src':src, 'dest':dest, 'status':'done'} if error is None else {'src':src, 'dest':dest, 'status':'failed', 'error':error}
+        self._apply(record)
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+def find_sources(src:str, manifest:Manifest, retry_failed:bool) -> Iterator[str]:
+    """
+    pictures under src not done yet. done sources are skipped by the manifest alone, without stat
+    """
+    for dir, _, fs in os.walk(src):
+        for f in sorted(fs):
+            if '.' not in f:
+                continue
+            p = os.path.join(dir, f)
+            if p in manifest.done or (not retry_failed and p in manifest.failed):
+                continue
+            yield p
+
+def destination(src:str, p:str, root_dir:str, owners:Dict[str, str]) -> str:
+    """
+    picture path of source p, its path under src as webp. a picture path taken by another source
+    (a.jpg beside a.png), or whose file exists without being done from p, gets a suffix from the hash of p.
+    owners: picture path -> source, updated
+    """
+    rel = os.path.relpath(p, src).replace(os.sep, '/')
+    stem = rel[:rel.rfind('.')]
+    dest = stem + '.webp'
+    owner = owners.get(dest)
+    if owner != p and (owner is not None or os.path.exists(os.path.join(root_dir, dest))):
+        dest = f'{stem}-{hashlib.sha1(p.encode()).hexdigest()[:8]}.webp'
+    owners[dest] = p
+    return dest
+
+def ingest(src:str, pictures:Pictures, manifest:Manifest, workers:Optional[int] = None,
+           delete_source = False, retry_failed = True) -> Tuple[int, int]:
+    """
+    convert the pictures under src into pictures.root_dir and register them, persist once at the end.
+    return the number of pictures converted and failed
+    """
+    owners = {dest:p for p, dest in manifest.done.items()}
+    dests:Dict[str, str] = dict() # source -> picture path, of this run
+
+    def jobs() -> Iterator[Tuple[str, str]]:
+        for p in find_sources(src, manifest, retry_failed):
+            dest = dests[p] = destination(src, p, pictures.root_dir, owners)
+            file = pictures.picture_file(dest)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            yield p, file
+
+    converted:List[str] = []
+    failed = 0
+    for old_path, _, error in picture_utils.convert_batch(jobs(), workers=workers, delete_source=delete_source):
+        dest = dests.pop(old_path)
+        manifest.record(old_path, dest, error)
+        if error is None:
+            converted.append(dest)
+            logger.debug('converted %s', old_path)
+        else:
+            failed += 1
+            logger.warning('convert %s failed, %s', old_path, error)
+
+    # register every picture done, also those of an interrupted run never persisted
+    for dest in set(manifest.done.values()):
+        if dest not in pictures.path_pictures:
+            pictures.add_new_pictures(dest)
+    pictures.persistence()
+    return len(converted), failed
+
+if __name__ == '__main__':
+    from logger import setup_logging
+    setup_logging()
+    parser = argparse.ArgumentParser(description='convert and import pictures into the picture database')
+    parser.add_argument('src')
+    parser.add_argument('--root', default='pic', help='picture root dir')
+    parser.add_argument('--database', default='db.json', help='database file in the root dir, sqlite if .sqlite3 or .db, binary snapshot if .snap')
+    parser.add_argument('--workers', type=int, default=None, help='conversion processes, the number of CPUs by default')
+    parser.add_argument('--manifest', default='ingest-manifest.jsonl')
+    parser.add_argument('--delete-source', action='store_true')
+    parser.add_argument('--skip-failed', action='store_true', help='do not retry sources failed in a previous run')
+    args = parser.parse_args()
+
+    os.makedirs(args.root, exist_ok=True)
+    manifest = Manifest(args.manifest)
+    try:
+        pictures = open_pictures(root_dir=args.root, database_file=args.database)
+        converted, failed = ingest(args.src, pictures, manifest, workers=args.workers,
+                                   delete_source=args.delete_source, retry_failed=not args.skip_failed)
+        logger.info('ingest %s: %d converted, %d failed, %d done in total', args.src, converted, failed, len(manifest.done))
+    finally:
+        manifest.close()
@@ -1,11 +1,62 @@
+"""
+logging of the application: records are queued by the caller and written to app.log and stderr by a QueueListener thread,
+so a log call in the event loop never waits on a file or a terminal.
+scripts call setup_logging once, before logging anything
+"""
+
+import os
+import queue
 import logging
+import logging.handlers
+from typing import List
+
+Max_Pending = 10000 # records waiting for the listener, more are dropped
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    when the queue is full, records are dropped and counted rather than blocking the caller.
+    closing it (logging.shutdown) stops its listener once the queued records are written
+    """
+    def __init__(self, q:queue.Queue) -> None:
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record:logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
+    def close(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+def start_listener(handler:DroppingQueueHandler, handlers:List[logging.Handler]) -> None:
+    """
+    a fresh queue and listener thread, also in forked children: the thread is not forked, the queue lock may be held
+    """
+    handler.queue = queue.Queue(Max_Pending)
+    handler.listener = logging.handlers.QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    handler.listener.start()
+
+def setup_logging() -> DroppingQueueHandler:
+    """
+    log to app.log and stderr through a queue, in this process and the ones it forks. return the queue handler
+    """
+    formatter = logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    handlers:List[logging.Handler] = [
         logging.FileHandler("app.log"),
         logging.StreamHandler()
     ]
-)
\ No newline at end of file
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_handler = DroppingQueueHandler(queue.Queue(Max_Pending))
+    queue_handler.setFormatter(logging.Formatter()) # the message and traceback only, the listener's handlers format the rest
+    start_listener(queue_handler, handlers)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: start_listener(queue_handler, handlers))
+
+    logging.basicConfig(level=logging.DEBUG, handlers=[queue_handler])
+    return queue_handler
@@ -1,11 +1,28 @@
-import logger as _
+import argparse
+from logger import setup_logging
 from http_server import HTTPHandle, HTTPServer
 from picture_server import PictureServer
+from executors import BoundedExecutor
 
-hs = HTTPServer()
-hs.add_router(HTTPHandle.handle_static_resource(path_prefix='/resource', dir='frontend'))
+parser = argparse.ArgumentParser(description="picture service")
+parser.add_argument("--workers", type=int, default=1, help="number of worker processes sharing the port")
+parser.add_argument("--max-connections", type=int, default=None, help="connections open at once in each worker, more are answered 503")
+parser.add_argument("--max-in-flight", type=int, default=None, help="requests handled at once per route in each worker, more are answered 503")
+parser.add_argument("--io-threads", type=int, default=8, help="threads of blocking file reads in each worker")
+parser.add_argument("--cpu-workers", type=int, default=None, help="processes of picture conversions in each worker")
+parser.add_argument("--prewarm-widths", type=int, nargs="*", default=[], help="thumbnail widths generated for every picture at startup")
+parser.add_argument("--no-watch", action="store_true", help="list the picture dir once at startup instead of watching it")
+parser.add_argument("--columnar", action="store_true", help="keep the picture catalog by column, for millions of pictures")
+parser.add_argument("--database", default="db.json", help="database file in the picture dir, sqlite if .sqlite3 or .db, binary snapshot if .snap")
+args = parser.parse_args()
+setup_logging()
 
-ps = PictureServer()
+io = BoundedExecutor.threads('io', workers=args.io_threads, max_pending=32 * args.io_threads)
+
+hs = HTTPServer(workers=args.workers, max_connections=args.max_connections, max_in_flight=args.max_in_flight)
+hs.add_router(HTTPHandle.handle_static_resource(path_prefix='/resource', dir='frontend', io=io))
+
+ps = PictureServer(database_file=args.database, watch=not args.no_watch, columnar=args.columnar, io=io, cpu_workers=args.cpu_workers, prewarm_widths=tuple(args.prewarm_widths))
 ps.register_routers(hs)
 
-hs.start()
+hs.start()
\ No newline at end of file
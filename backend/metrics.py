@@ -0,0 +1,138 @@
+"""
+in-process metrics: counters, gauges and latency histograms, rendered in the prometheus text exposition format.
+
+durations are measured with time.perf_counter_ns and bucketed as integers, an observation is a bisect and two adds.
+metrics live in the registry of the process, so each forked worker reports its own
+
+h = registry.histogram('load_seconds', 'time to load', kind='json')
+start = time.perf_counter_ns()
+...
+h.observe_ns(time.perf_counter_ns() - start)
+print(registry.render())
+"""
+
+import bisect
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount:Union[int, float] = 1) -> None:
+        self.value += amount
+
+    def samples(self, name:str, labels:Labels) -> List[str]:
+        return [f'{name}{Registry.format_labels(labels)} {self.value}']
+
+class Gauge:
+    """
+    a value set by its owner, or read from func at each render
+    """
+    __slots__ = ('value', 'func')
+
+    def __init__(self, func:Optional[Callable[[], Union[int, float]]] = None) -> None:
+        self.value:Union[int, float] = 0
+        self.func = func
+
+    def set(self, value:Union[int, float]) -> None:
+        self.value = value
+
+    def inc(self, amount:Union[int, float] = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount:Union[int, float] = 1) -> None:
+        self.value -= amount
+
+    def samples(self, name:str, labels:Labels) -> List[str]:
+        value = self.value if self.func is None else self.func()
+        return [f'{name}{Registry.format_labels(labels)} {value}']
+
+class Histogram:
+    """
+    durations in fixed buckets, from 50 us to 10 s
+    """
+    Bounds_Seconds = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                      0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    Bounds_Ns = tuple(int(b * 1e9) for b in Bounds_Seconds)
+    __slots__ = ('buckets', 'sum_ns', 'count')
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(Histogram.Bounds_Ns) + 1) # the last one is +Inf
+        self.sum_ns = 0
+        self.count = 0
+
+    def observe_ns(self, ns:int) -> None:
+        self.buckets[bisect.bisect_left(Histogram.Bounds_Ns, ns)] += 1
+        self.sum_ns += ns
+        self.count += 1
+
+    def samples(self, name:str, labels:Labels) -> List[str]:
+        lines = []
+        seen = 0
+        for bound, n in zip(Histogram.Bounds_Seconds + ('+Inf',), self.buckets):
+            seen += n
+            lines.append(f'{name}_bucket{Registry.format_labels(labels + (("le", str(bound)),))} {seen}')
+        lines.append(f'{name}_sum{Registry.format_labels(labels)} {self.sum_ns / 1e9}')
+        lines.append(f'{name}_count{Registry.format_labels(labels)} {self.count}')
+        return lines
+
+Metric = Union[Counter, Gauge, Histogram]
+
+class Registry:
+    """
+    metrics by name and labels. a metric is created at its first request and the same one returned after,
+    so callers keep it instead of looking it up on each observation
+    """
+    Content_Type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self) -> None:
+        self.families:Dict[str, Tuple[str, str, Dict[Labels, Metric]]] = dict() # name -> (type, help, labels -> metric)
+
+    def counter(self, name:str, help:str = '', **labels:str) -> Counter:
+        return self.metric(name, 'counter', help, labels, Counter) # type: ignore[return-value]
+
+    def gauge(self, name:str, help:str = '', func:Optional[Callable[[], Union[int, float]]] = None, **labels:str) -> Gauge:
+        """
+        func: read the value from func at each render instead of keeping it
+        """
+        gauge = self.metric(name, 'gauge', help, labels, Gauge)
+        gauge.func = func # type: ignore[union-attr]
+        return gauge # type: ignore[return-value]
+
+    def histogram(self, name:str, help:str = '', **labels:str) -> Histogram:
+        return self.metric(name, 'histogram', help, labels, Histogram) # type: ignore[return-value]
+
+    def metric(self, name:str, type:str, help:str, labels:Dict[str, str], make:Callable[[], Metric]) -> Metric:
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = (type, help, dict())
+        elif family[0] != type:
+            raise ValueError(f'metric {name} is a {family[0]}, not a {type}')
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = make()
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for name, (type, help, metrics) in sorted(self.families.items()):
+            if help:
+                lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for labels, metric in metrics.items():
+                lines.extend(metric.samples(name, labels))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def format_labels(labels:Labels) -> str:
+        if not labels:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+registry = Registry() # of this process
@@ -1,94 +1,612 @@
 import os
 import time
-import json
 import random
+import asyncio
 import logging
 import serializable
 import picture_utils
 from utils import timeit
-from collections import defaultdict
-from typing import List, Dict, Tuple
-from http_server import HTTPServer, HTTPHandle, HTTPRequest, HttpResponse, HTTPStatus, HTTPHeader
+from cache import ByteCache
+from storage import JournalStore
+from index import PictureIndex
+from columnar import ColumnarCatalog
+from snapshot import SnapshotCatalog
+from sampling import RecentPicks
+from watcher import DirectoryWatcher
+from executors import BoundedExecutor
+from variants import VariantCache
+from typing import List, Dict, Set, Tuple, Iterable, Container, Optional, Callable
+from http_server import HTTPServer, HTTPHandle, HTTPRequest, HttpResponse, HTTPStatus, HTTPHeader, FileValidator
 
 logger = logging.getLogger(__name__)
 Path = str
 
 class Picture(serializable.Json):
+    __slots__ = ('path', 'name', 'dir', 'tags')
+    __interned__ = ('name', 'dir', 'tags') # few distinct values shared by many pictures
+
     def __init__(self, path:Path = "") -> None:
         self.path = path # "202411201620-aaibs.webp"
         self.name:str = "untitled" # 
         self.dir:List[str] = ['uncategorized']
         self.tags:List[str] = []
+    
+    @staticmethod
+    def of(path:Path, name:str, dir:List[str], tags:List[str]) -> 'Picture':
+        p = Picture(path)
+        p.name = name
+        p.dir = dir
+        p.tags = tags
+        return p
 
 class Pictures:
-    def __init__(self, root_dir:str, database_file:str, json_indent=2) -> None:
-        self.path_pictures:Dict[Path, Picture] = dict()
+    Persist_In_Thread = True # persistence may run in an io thread while the event loop reads the catalog
+
+    def __init__(self, root_dir:str, database_file:str, json_indent=2, cache:Optional[ByteCache] = None,
+                 on_load:Optional[Callable[['Pictures'], None]] = None,
+                 fsync_interval:float = 1.0, compact_min_records:int = 1000,
+                 weight_of:Optional[Callable[[Picture], float]] = None, scan_root:bool = True, columnar:bool = False) -> None:
+        """
+        on_load: called at the end of load_database, unless read only
+        database_file: a json snapshot, or a binary one if it ends with .snap: it is mapped at load instead of read,
+            pictures are decoded as they are accessed and the index is built by index_snapshot, or at its first use
+        columnar: keep path_pictures in a ColumnarCatalog, smaller than a dict of Picture for large libraries
+        scan_root: load_database lists root_dir for new pictures, off when a DirectoryWatcher reports them
+        weight_of: weight of a picture in weighted rand_picture, which is disabled if None
+        fsync_interval: journal appends are fsynced at most this often, 0 to fsync every persistence
+        compact_min_records: the journal is compacted into the snapshot once it holds more records
+            than this and than the pictures
+        """
+        self.columnar = columnar
+        self.path_pictures:Dict[Path, Picture] = self.new_catalog()
         self.root_dir = root_dir
         self.database_file = os.path.join(root_dir, database_file)
         self.json_indent = json_indent
         self.rand = random.Random(int(time.time()))
+        self.cache = ByteCache() if cache is None else cache
+        self.validators:Dict[Path, FileValidator] = dict() # side index of ETag/Last-Modified
+        self.read_only = False # worker processes other than the writer never persist
+        self.store = JournalStore(self.database_file, fsync_interval=fsync_interval, json_indent=json_indent)
+        if columnar and self.store.binary:
+            raise ValueError('the columnar catalog needs the json snapshot')
+        self.compact_min_records = compact_min_records
+        self.dirty:Set[Path] = set() # added, changed or removed since the last persistence
+        self.weight_of = weight_of
+        self.scan_root = scan_root
+        self._index:Optional[PictureIndex] = None # built by load_database, or lazily over a binary snapshot
+        self.on_load = on_load
 
         self.load_database()
         self.persistence()
     
-    @timeit
+    def new_catalog(self) -> Dict[Path, Picture]:
+        return ColumnarCatalog(Picture.of) if self.columnar else dict()
+    
+    @property
+    def index(self) -> PictureIndex:
+        """
+        tag/dir -> paths, tag counts and random picks, follows every change of path_pictures
+        """
+        if self._index is None:
+            self._index = PictureIndex(weighted=self.weight_of is not None)
+            for p in self.path_pictures.values():
+                self.reindex(p.path, p)
+            logger.info('indexed %d pictures', len(self.path_pictures))
+        return self._index
+    
+    def index_pending(self) -> bool:
+        """
+        the index of a binary snapshot is not built yet
+        """
+        return self._index is None and isinstance(self.path_pictures, SnapshotCatalog)
+    
+    def index_snapshot(self, catalog:SnapshotCatalog) -> PictureIndex:
+        """
+        index of the pictures in the snapshot of catalog, without the changes since. it reads the mapped file only,
+        so it may run in a thread while the event loop serves and changes the catalog
+        """
+        index = PictureIndex(weighted=self.weight_of is not None)
+        snapshot = catalog.snapshot
+        for i in range(0 if snapshot is None else snapshot.count):
+            p = Picture.from_dict(snapshot.record(i))
+            index.update(p.path, p.tags, p.dir, 1.0 if self.weight_of is None else self.weight_of(p))
+        return index
+    
+    def install_index(self, catalog:SnapshotCatalog, index:PictureIndex) -> bool:
+        """
+        bring index from index_snapshot up to date with the changes of catalog and use it.
+        False if path_pictures is no longer catalog, reloaded in the meantime
+        """
+        if catalog is not self.path_pictures or self._index is not None:
+            return False
+        for path in catalog.deleted:
+            index.update(path, None)
+        for path, p in catalog.overlay.items():
+            index.update(path, p.tags, p.dir, 1.0 if self.weight_of is None else self.weight_of(p))
+        self._index = index
+        logger.info('indexed %d pictures', len(catalog))
+        return True
+    
     def get_all_tags(self) -> Dict[str, int]:
-        tag_cnt = defaultdict(int)
-        for pic in self.path_pictures.values():
-            for tag in pic.tags:
-                tag_cnt[tag] += 1
-        tag_cnt_list = list(tag_cnt.items())
-        tag_cnt_list.sort(key=lambda t:t[1], reverse=True)
-        tag_cnt = dict(tag_cnt_list)
-        return tag_cnt
+        """
+        tag -> number of pictures, most used first
+        """
+        return dict(self.index.tag_counts.most_common())
+    
+    def query(self, tags:Iterable[str] = (), any_tags:bool = False, dir:Optional[str] = None,
+              offset:int = 0, limit:int = 50) -> Tuple[int, List[Picture]]:
+        """
+        (number of matches, one page of them ordered by path) of the pictures having all tags
+        (any of them if any_tags), in dir if not None. see PictureIndex.page for the cost
+        """
+        total, paths = self.index.page(tags, any_tags=any_tags, dir=dir, offset=offset, limit=limit)
+        return total, [self.path_pictures[path] for path in paths]
     
     def read_picture(self, path:Path) -> bytes:
-        return picture_utils.read_picture(os.path.join(self.root_dir, path))
+        """
+        raise FileNotFoundError if no such picture
+        """
+        data = self.read_cached_picture(path)
+        if data is None:
+            data = picture_utils.read_picture(self.picture_file(path))
+        return data
+    
+    def read_cached_picture(self, path:Path, st:Optional[os.stat_result] = None) -> Optional[bytes]:
+        """
+        content of the picture from the in-memory cache, or None if too large to cache.
+        raise FileNotFoundError if no such picture
+        """
+        return self.cache.read(self.picture_file(path), st)
+    
+    def validator(self, path:Path, st:os.stat_result) -> FileValidator:
+        """
+        ETag and Last-Modified of the picture, computed once per file version
+        """
+        return FileValidator.of(self.validators, path, st)
     
-    def rand_picture(self) -> Picture:
-        path = self.rand.choice(tuple(self.path_pictures.items()))
-        return self.path_pictures[path]
+    def picture_file(self, path:Path) -> str:
+        """
+        file path of the picture on disk
+        """
+        return os.path.join(self.root_dir, path)
+    
+    def rand_picture(self, tags:Iterable[str] = (), dir:Optional[str] = None, weighted:bool = False,
+                     exclude:Container[Path] = ()) -> Optional[Picture]:
+        """
+        a random picture having all tags, in dir if not None, and not in exclude unless every match is.
+        uniform, or by weight_of if weighted. None if nothing matches
+        """
+        path = self.index.sample(self.rand, tags, dir=dir, weighted=weighted, exclude=exclude)
+        return None if path is None else self.path_pictures[path]
     
     @timeit
     def load_database(self) -> None:
-        if os.path.exists(self.database_file):
-            with open(file=self.database_file, mode='r', encoding='utf-8') as f:
-                items:List[Dict] = json.load(f)
-                for item in items:
-                    p = Picture()
-                    p.populate_dict(item)
-                    self.path_pictures[p.path] = p
+        if self.store.binary:
+            self.path_pictures = SnapshotCatalog(self.store.open_snapshot(), Picture.from_dict)
+            self._index = None
+            self.replay_journal()
+        else:
+            self._index = PictureIndex(weighted=self.weight_of is not None)
+            for item in self.store.load().values():
+                p = Picture.from_dict(item)
+                self.path_pictures[p.path] = p
+                self.reindex(p.path, p)
+        
+        if self.scan_root:
+            for filename in os.listdir(self.root_dir):
+                if filename.endswith('.webp') and filename not in self.path_pictures:
+                    self.add_new_pictures(filename)
         
-        print(self.root_dir)
-        for filename in os.listdir(self.root_dir):
-            if filename.endswith('.webp') and filename not in self.path_pictures:
-                self.add_new_pictures(filename)
+        if self.on_load is not None and not self.read_only:
+            self.on_load(self)
 
     def add_new_pictures(self, path:Path) -> None:
         logger.info('new add pictures %s', path)
         if path in self.path_pictures:
             raise RuntimeError(f"duplicated name {path}")
-        self.path_pictures[path] = Picture(path=path)
+        p = self.path_pictures[path] = Picture(path=path)
+        self.reindex(path, p)
+        self.dirty.add(path)
+    
+    def set_tags(self, path:Path, tags:List[str]) -> None:
+        self.path_pictures[path].tags = list(tags)
+        self.changed(path)
+    
+    def remove_picture(self, path:Path) -> None:
+        """
+        forget the picture, its file is left as is
+        """
+        del self.path_pictures[path]
+        self.changed(path)
+    
+    @timeit
+    def apply_changes(self, added:List[Path], removed:List[Path], moved:List[Tuple[Path, Path]]) -> None:
+        """
+        a batch of picture files added, removed and renamed (keeping name and tags) on disk,
+        persisted at once by the next persistence. applying a batch again changes nothing
+        """
+        for old, new in moved:
+            p = self.path_pictures.pop(old, None)
+            self.validators.pop(old, None)
+            if p is None:
+                added.append(new)
+            elif new not in self.path_pictures:
+                p.path = new
+                self.path_pictures[new] = p
+                self.changed(new)
+            self.changed(old)
+        for path in removed:
+            if path in self.path_pictures:
+                self.remove_picture(path)
+            self.validators.pop(path, None)
+        for path in added:
+            if path not in self.path_pictures:
+                self.add_new_pictures(path)
+    
+    def changed(self, path:Path) -> None:
+        """
+        mark a picture modified in place, or removed from path_pictures, for the indexes and the next persistence
+        """
+        if self.columnar:
+            self.path_pictures.changed(path)
+        self.reindex(path, self.path_pictures.get(path))
+        self.dirty.add(path)
+    
+    def reindex(self, path:Path, p:Optional[Picture]) -> None:
+        if self._index is None: # not built yet, it will index path_pictures as it is then
+            return
+        if p is None:
+            self.index.update(path, None)
+        else:
+            self.index.update(path, p.tags, p.dir, 1.0 if self.weight_of is None else self.weight_of(p))
     
     @timeit
     def persistence(self) -> None:
-        with open(file=self.database_file, mode='w', encoding='utf-8') as f:
-            pictures = [p.to_dict() for p in self.path_pictures.values()]
-            json.dump(pictures, f, ensure_ascii=False, indent=self.json_indent)
+        """
+        journal the pictures changed since the last persistence, compact the journal when it outgrows the snapshot
+        """
+        if self.read_only:
+            logger.debug('read only, skip persistence')
+            return
+        puts = [self.path_pictures[path].to_dict() for path in self.dirty if path in self.path_pictures]
+        dels = [path for path in self.dirty if path not in self.path_pictures]
+        self.store.append(puts, dels)
+        self.dirty.clear()
+        if self.store.journal_records > max(self.compact_min_records, len(self.path_pictures)):
+            self.compact()
+    
+    @timeit
+    def compact(self) -> None:
+        """
+        rewrite the whole database as the snapshot and empty the journal
+        """
+        if self.read_only:
+            return
+        self.store.compact(p.to_dict() for p in self.path_pictures.values())
+    
+    def sync(self) -> None:
+        """
+        fsync journal appends delayed by fsync_interval
+        """
+        if not self.read_only:
+            self.store.sync()
+    
+    def reload_if_changed(self) -> bool:
+        """
+        follow the changes of another process (the writer): replay its journal appends,
+        reload everything if it compacted the snapshot
+        """
+        snapshot_changed, journal_grown = self.store.changed_on_disk()
+        if snapshot_changed:
+            logger.info('database %s compacted, reload', self.database_file)
+            old = self.path_pictures
+            self.path_pictures = self.new_catalog()
+            self.load_database()
+            if isinstance(old, SnapshotCatalog):
+                old.close()
+            return True
+        if not journal_grown:
+            return False
+        self.replay_journal()
+        return True
+    
+    def replay_journal(self) -> None:
+        for path, item in self.store.replay():
+            if item is None:
+                self.path_pictures.pop(path, None)
+                self.reindex(path, None)
+            else:
+                p = Picture.from_dict(item)
+                self.path_pictures[path] = p
+                self.reindex(path, p)
+
+def open_pictures(root_dir:str, database_file:str, json_indent=2, cache:Optional[ByteCache] = None,
+                  on_load:Optional[Callable[[Pictures], None]] = None,
+                  weight_of:Optional[Callable[[Picture], float]] = None, scan_root:bool = True, columnar:bool = False) -> Pictures:
+    """
+    the picture database of database_file, in sqlite if it ends with .sqlite3 or .db,
+    else in json, with a binary snapshot if it ends with .snap
+    """
+    if database_file.endswith(('.sqlite3', '.db')):
+        if weight_of is not None or columnar:
+            raise ValueError('weighted random selection and the columnar catalog need the json database')
+        from sqlite_pictures import SqlitePictures # imports this module
+        return SqlitePictures(root_dir=root_dir, database_file=database_file, json_indent=json_indent, cache=cache, on_load=on_load,
+                              scan_root=scan_root)
+    return Pictures(root_dir=root_dir, database_file=database_file, json_indent=json_indent, cache=cache, on_load=on_load,
+                    weight_of=weight_of, scan_root=scan_root, columnar=columnar)
 
 class PictureServer:
-    def __init__(self, root_dir:str = 'pic', database_file:str = 'db.json', json_indent = 2) -> None:
-        self.pictures = Pictures(root_dir=root_dir, database_file=database_file, json_indent=json_indent)
+    Picture_Cache_Control = 'public, max-age=31536000, immutable' # pictures never change once written
+    Max_Page = 500 # pictures per page of /pictures
+    Max_No_Repeat = 1000 # longest history of a /random session
+    Variant_Sweep_Interval = 60.0 # the writer lists the variants of every worker this often, and evicts
+
+    def __init__(self, root_dir:str = 'pic', database_file:str = 'db.json', json_indent = 2,
+                 cache_bytes:int = 64 * 1024 * 1024, cache_item_bytes:int = 1024 * 1024, favicon_file:str = 'res/favicon.webp',
+                 sync_interval:float = 5.0, io:Optional[BoundedExecutor] = None,
+                 cpu_workers:Optional[int] = None, cpu_max_pending:int = 64,
+                 variant_widths:Tuple[int, ...] = (160, 320, 640, 1280), variant_cache_bytes:int = 1024 * 1024 * 1024,
+                 prewarm_widths:Tuple[int, ...] = (), random_weight:Optional[Callable[[Picture], float]] = None,
+                 watch:bool = True, watch_poll_interval:float = 2.0, columnar:bool = False) -> None:
+        """
+        io: executor of blocking file reads, shared with the static handler. a pool of 8 threads if None
+        cpu_workers: size of the process pool of picture conversions, the number of CPUs if None
+        variant_widths: widths allowed in /thumb/{width}/{path}
+        prewarm_widths: variants generated for every picture when the database is loaded
+        random_weight: weight of a picture in /random with "weighted", which is rejected if None
+        watch: the writer worker follows picture files added, removed or renamed under root_dir (subdirectories
+            included) with a DirectoryWatcher, instead of listing root_dir once at startup
+        watch_poll_interval: period of the watcher where inotify is unavailable
+        columnar: keep the catalog by column (Pictures columnar), for libraries of millions of pictures
+        """
+        cache = ByteCache(max_bytes=cache_bytes, max_item_bytes=cache_item_bytes)
+        self.variants = VariantCache(cache_dir=os.path.normpath(root_dir) + '-variants', widths=variant_widths, max_bytes=variant_cache_bytes)
+        self.variant_validators:Dict[str, FileValidator] = dict()
+        self.prewarm_widths = prewarm_widths
+        self.cpu_workers = cpu_workers
+        self.pictures = open_pictures(root_dir=root_dir, database_file=database_file, json_indent=json_indent, cache=cache,
+                                      on_load=self.prewarm if prewarm_widths else None, weight_of=random_weight,
+                                      scan_root=not watch, columnar=columnar)
+        self.watcher = DirectoryWatcher(root_dir, self.apply_changes, poll_interval=watch_poll_interval) if watch else None
+        self.recent_picks = RecentPicks() # per worker, a session may repeat a picture served by another worker
+        self.favicon_file = favicon_file
+        self.favicon:Optional[bytes] = None # loaded at first request
+        self.sync_interval = sync_interval
+        self.sync_task:Optional[asyncio.Task] = None
+        self.watch_task:Optional[asyncio.Task] = None
+        self.index_task:Optional[asyncio.Task] = None
+        self.sweep_task:Optional[asyncio.Task] = None
+        self.store_lock = asyncio.Lock() # a persistence in the io executor and the sync of the journal
+        self.io = BoundedExecutor.threads('picture-io', workers=8, max_pending=256) if io is None else io
+        self.cpu = BoundedExecutor.processes('picture-cpu', workers=cpu_workers, max_pending=cpu_max_pending)
+        HTTPHeader.precompute('Cache-Control', PictureServer.Picture_Cache_Control)
     
     def register_routers(self, s:HTTPServer) -> None:
         s.add_router(HTTPHandle(path_prefix='/favicon.ico', method='GET', async_callback=self.read_favicon_ico))
         s.add_router(HTTPHandle(path_prefix='/pic/', method='GET', async_callback=self.read_pictures))
+        s.add_router(HTTPHandle(path_prefix='/thumb/', method='GET', async_callback=self.read_thumbnail))
+        s.add_router(HTTPHandle.handle_json(path_prefix='/tags', method='GET', callback=self.all_tags))
+        s.add_router(HTTPHandle.handle_json(path_prefix='/pictures', method='POST', callback=self.list_pictures))
+        s.add_router(HTTPHandle.handle_json(path_prefix='/random', method='GET', callback=self.random_picture))
+        s.add_router(HTTPHandle.handle_json(path_prefix='/random', method='POST', callback=self.random_picture))
+        s.add_router(HTTPHandle.handle_json(path_prefix='/stats', method='GET', callback=lambda _:{
+            'loop_lag': s.loop_lag.stats(),
+            'cache': self.pictures.cache.stats(),
+            'io': self.io.stats(),
+            'cpu': self.cpu.stats(),
+            'variants': self.variants.stats(),
+        }))
+        s.add_router(HTTPHandle.handle_metrics('/metrics'))
+        s.add_startup(self.startup)
+        s.add_shutdown(self.close)
+    
+    async def all_tags(self, _:Optional[Dict]) -> Dict[str, int]:
+        await self.wait_index()
+        return self.pictures.get_all_tags()
+    
+    async def list_pictures(self, obj:Optional[Dict]) -> Dict:
+        """
+        body {"tags": [...], "mode": "and" | "or", "dir": "...", "offset": 0, "limit": 50}, every field optional.
+        raise ValueError (400) on a malformed query
+        """
+        obj = dict() if obj is None else obj
+        if not isinstance(obj, dict):
+            raise ValueError('expect a json object')
+        tags = obj.get('tags', [])
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            raise ValueError('tags: expect a list of strings')
+        mode = obj.get('mode', 'and')
+        if mode not in ('and', 'or'):
+            raise ValueError("mode: expect 'and' or 'or'")
+        dir = obj.get('dir')
+        if dir is not None and not isinstance(dir, str):
+            raise ValueError('dir: expect a string')
+        offset = obj.get('offset', 0)
+        limit = obj.get('limit', 50)
+        if not isinstance(offset, int) or offset < 0 or not isinstance(limit, int) or not 0 < limit <= PictureServer.Max_Page:
+            raise ValueError(f'offset, limit: expect offset >= 0 and 0 < limit <= {PictureServer.Max_Page}')
+        await self.wait_index()
+        total, pictures = self.pictures.query(tags, any_tags=mode == 'or', dir=dir, offset=offset, limit=limit)
+        return {'total': total, 'offset': offset, 'limit': limit, 'pictures': [p.to_dict() for p in pictures]}
+    
+    async def random_picture(self, obj:Optional[Dict]) -> Dict:
+        """
+        body {"tags": [...], "dir": "...", "weighted": false, "session": "...", "no_repeat": 20}, every field optional.
+        no_repeat avoids the last no_repeat pictures of the session. picture is null if nothing matches
+        """
+        obj = dict() if obj is None else obj
+        if not isinstance(obj, dict):
+            raise ValueError('expect a json object')
+        tags = obj.get('tags', [])
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            raise ValueError('tags: expect a list of strings')
+        dir = obj.get('dir')
+        if dir is not None and not isinstance(dir, str):
+            raise ValueError('dir: expect a string')
+        session = obj.get('session')
+        no_repeat = obj.get('no_repeat', 0)
+        if session is not None and not isinstance(session, str):
+            raise ValueError('session: expect a string')
+        if not isinstance(no_repeat, int) or not 0 <= no_repeat <= PictureServer.Max_No_Repeat:
+            raise ValueError(f'no_repeat: expect 0 <= no_repeat <= {PictureServer.Max_No_Repeat}')
+        remember = session is not None and no_repeat > 0
+        exclude = self.recent_picks.recent(session) if remember else ()
+        await self.wait_index()
+        picture = self.pictures.rand_picture(tags, dir=dir, weighted=bool(obj.get('weighted', False)), exclude=exclude)
+        if picture is not None and remember:
+            self.recent_picks.add(session, picture.path, no_repeat)
+        return {'picture': None if picture is None else picture.to_dict()}
+    
+    def startup(self, worker_id:int) -> None:
+        """
+        worker 0 is the only writer of the database, other workers are read only and follow its changes.
+        it is the only one evicting variants too
+        """
+        if worker_id != 0:
+            self.pictures.read_only = True
+            self.variants.evicting = False
+            self.sync_task = asyncio.get_running_loop().create_task(self.follow_database())
+        else:
+            # a restarted writer is forked from the master, whose catalog misses what the crashed writer journaled
+            self.pictures.reload_if_changed()
+            self.sync_task = asyncio.get_running_loop().create_task(self.sync_database())
+            if self.watcher is not None:
+                self.watch_task = asyncio.get_running_loop().create_task(self.watcher.start())
+            self.sweep_task = asyncio.get_running_loop().create_task(self.sweep_variants())
+        if self.pictures.index_pending():
+            self.index_task = asyncio.get_running_loop().create_task(self.build_index())
+    
+    def close(self) -> None:
+        """
+        stop the background tasks and the executors of this worker. the processes of the cpu pool are waited for,
+        forked from the worker they would outlive it, holding the listening socket
+        """
+        for task in (self.sync_task, self.watch_task, self.sweep_task, self.index_task):
+            if task is not None:
+                task.cancel()
+        if self.watcher is not None and self.watch_task is not None:
+            self.watcher.stop()
+        self.io.shutdown()
+        self.cpu.shutdown(wait=True)
+    
+    async def build_index(self) -> None:
+        """
+        index a binary snapshot in the io executor, the event loop keeps serving meanwhile
+        """
+        catalog = self.pictures.path_pictures
+        index = await self.io.run(self.pictures.index_snapshot, catalog)
+        self.pictures.install_index(catalog, index)
+    
+    async def wait_index(self) -> None:
+        """
+        requests needing the index wait for build_index, instead of building it on the event loop
+        """
+        while self.pictures.index_pending():
+            if self.index_task is None or self.index_task.done():
+                self.index_task = asyncio.get_running_loop().create_task(self.build_index())
+            await asyncio.shield(self.index_task)
+    
+    def prewarm(self, pictures:Pictures) -> None:
+        self.variants.prewarm(((pictures.picture_file(path), path) for path in pictures.path_pictures),
+                              widths=self.prewarm_widths, workers=self.cpu_workers)
+    
+    async def sync_database(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                async with self.store_lock:
+                    self.pictures.sync()
+            except Exception as e:
+                logger.warning('sync database failed, %s', str(e))
+    
+    async def apply_changes(self, added:List[Path], removed:List[Path], moved:List[Tuple[Path, Path]]) -> None:
+        """
+        a batch of the watcher: the catalog and its indexes change in the event loop,
+        then the journal append (and a compaction) run in the io executor.
+        the watcher is the only writer of the catalog and awaits each batch, so nothing changes it meanwhile
+        """
+        self.pictures.apply_changes(added, removed, moved)
+        async with self.store_lock:
+            if self.pictures.Persist_In_Thread:
+                await self.io.run(self.pictures.persistence)
+            else:
+                self.pictures.persistence()
+    
+    async def follow_database(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            if self.index_task is not None and not self.index_task.done():
+                continue # its snapshot stays mapped until the index is built
+            try:
+                if self.pictures.reload_if_changed() and self.pictures.index_pending():
+                    self.index_task = asyncio.get_running_loop().create_task(self.build_index())
+            except Exception as e:
+                logger.warning('reload database failed, %s', str(e))
+    
+    async def sweep_variants(self) -> None:
+        while True:
+            await asyncio.sleep(PictureServer.Variant_Sweep_Interval)
+            try:
+                await self.variants.sweep(self.io)
+            except Exception as e:
+                logger.warning('sweep variants failed, %s', str(e))
+    
+    async def convert_to_webp(self, old_path:str, new_path:Optional[str] = None, **kwargs) -> None:
+        """
+        picture_utils.convert_to_webp in the process pool, the event loop is never blocked by Pillow
+        """
+        await self.cpu.run(picture_utils.convert_to_webp, old_path, new_path, **kwargs)
+    
+    async def read_cached_picture(self, file:str, st:os.stat_result) -> Optional[bytes]:
+        """
+        content of picture file from the cache, read by the io executor on a miss.
+        None if too large to cache
+        """
+        cache = self.pictures.cache
+        if st.st_size > cache.max_item_bytes:
+            return None
+        data = cache.get(file, st)
+        if data is None:
+            data = await self.io.run(picture_utils.read_picture, file)
+            cache.put(file, st.st_mtime_ns, data)
+        return data
     
     async def read_favicon_ico(self, _:HTTPRequest) -> HttpResponse:
-        with open(file='res/favicon.webp', mode='rb') as f:
-            data = f.read()
-            header = HTTPHeader().content_type('image/webp').content_length(len(data))
-            return HttpResponse(status=HTTPStatus.OK(), header=header, content=data)
+        if self.favicon is None:
+            try:
+                self.favicon = await self.io.run(picture_utils.read_picture, self.favicon_file)
+            except FileNotFoundError:
+                return HttpResponse.not_found({'path':'favicon.ico'})
+        header = HTTPHeader().content_type('image/webp').content_length(len(self.favicon))
+        return HttpResponse(status=HTTPStatus.OK(), header=header, content=self.favicon)
+
+    async def read_thumbnail(self, request:HTTPRequest) -> HttpResponse:
+        # path_prefix='/thumb/', method='GET'
+        width, _, path = request.path[7:].partition('/') # /thumb/320/123.webp
+        if not width.isdigit() or int(width) not in self.variants.widths:
+            return HttpResponse.bad_request({'width':width, 'widths':self.variants.widths})
+        if path not in self.pictures.path_pictures: # nor any file out of the catalog, like ../res/favicon.webp
+            return HttpResponse.not_found({'path':path})
+        try:
+            file = self.pictures.picture_file(path)
+            st = await self.io.run(os.stat, file)
+            for retry in (False, True):
+                variant = await self.variants.get(file, path, st, int(width), self.cpu, self.io)
+                try:
+                    variant_st = await self.io.run(os.stat, variant)
+                    break
+                except FileNotFoundError: # evicted by another worker
+                    if retry:
+                        raise
+                    self.variants.forget(VariantCache.key(path, st, int(width)))
+            validator = FileValidator.of(self.variant_validators, variant, variant_st)
+            if validator.not_modified(request):
+                return HttpResponse.not_modified(validator, cache_control=PictureServer.Picture_Cache_Control)
+            response = await self.io.run(HttpResponse.file, path=variant, content_type='image/webp', request=request, validator=validator)
+        except FileNotFoundError:
+            return HttpResponse.not_found({'path':path})
+        return response.validated(validator, cache_control=PictureServer.Picture_Cache_Control)
 
     async def read_pictures(self, request:HTTPRequest) -> HttpResponse:
         # path_prefix='/pic/', method='GET'
@@ -100,8 +618,22 @@ class PictureServer:
         if path[0] == '/':
             raise NotImplementedError(path)
         else:
-            data = self.pictures.read_picture(path)
-            header = HTTPHeader().content_type(f'image/{file_type}').content_length(len(data))
-            return HttpResponse(status=HTTPStatus.OK(), header=header, content=data)
+            try:
+                file = self.pictures.picture_file(path)
+                st = await self.io.run(os.stat, file)
+                validator = self.pictures.validator(path, st)
+                if validator.not_modified(request):
+                    return HttpResponse.not_modified(validator, cache_control=PictureServer.Picture_Cache_Control)
+                ranged = request.header is not None and request.header.get('Range') is not None
+                data = None if ranged else await self.read_cached_picture(file, st)
+                if data is None: # large picture or range request, send from file
+                    response = await self.io.run(HttpResponse.file, path=file, content_type=f'image/{file_type}',
+                                                 request=request, validator=validator)
+                else:
+                    header = HTTPHeader().content_type(f'image/{file_type}').content_length(len(data)).header('Accept-Ranges', 'bytes')
+                    response = HttpResponse(status=HTTPStatus.OK(), header=header, content=data)
+            except FileNotFoundError:
+                return HttpResponse.not_found({'path':path})
+            return response.validated(validator, cache_control=PictureServer.Picture_Cache_Control)
 
 
@@ -1,7 +1,9 @@
 import os
 import webp
-from PIL import Image
-from typing import Optional
+import argparse
+import concurrent.futures
+from PIL import Image, ImageSequence
+from typing import Iterable, Iterator, Optional, Tuple
 
 def convert_to_webp(old_path:str, new_path:Optional[str] = None, skip_exists = True, delete_source = True, full_new_path = True) -> None:
     """
@@ -40,42 +42,99 @@ def convert_to_webp(old_path:str, new_path:Optional[str] = None, skip_exists = T
         else:
             _pic_to_webp(old_path, new_path)
 
+def convert_batch(jobs:Iterable[Tuple[str, str]], workers:Optional[int] = None, skip_exists = True, delete_source = False) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """
+    convert (old_path, new_path) jobs by convert_to_webp in a pool of worker processes.
+    results (old_path, new_path, error or None) are yielded as soon as each job completes, in any order.
+    jobs is consumed lazily, at most 4 jobs per worker are submitted ahead
+    """
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for old_path, new_path in jobs:
+            if len(pending) >= 4 * workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(_convert_job, old_path, new_path, skip_exists, delete_source))
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+def _convert_job(old_path:str, new_path:str, skip_exists:bool, delete_source:bool) -> Tuple[str, str, Optional[str]]:
+    try:
+        convert_to_webp(old_path=old_path, new_path=new_path, skip_exists=skip_exists, delete_source=delete_source)
+        return old_path, new_path, None
+    except Exception as e:
+        return old_path, new_path, f'{type(e).__name__}: {e}'
+
 def read_picture(path:str) -> bytes:
+    """
+    raise FileNotFoundError if no such picture, so callers can answer 404, RuntimeError on other errors
+    """
     try:
         st = os.stat(path)
         with open(file=path, mode='rb') as f:
             data = f.read(st.st_size)
             return data
+    except FileNotFoundError:
+        raise
     except Exception as e:
         raise RuntimeError(f"read picture {path} error {e}")
 
+def resize_to_webp(old_path:str, new_path:str, width:int, quality = 80) -> None:
+    """
+    save a copy of picture old_path at most width pixels wide into new_path as webp, keeping the aspect ratio.
+    animated pictures keep their first frame only.
+    new_path is written atomically (temp file + rename)
+    """
+    tmp_path = f'{new_path}.{os.getpid()}.tmp'
+    with Image.open(old_path) as img:
+        img.seek(0)
+        frame = img.convert('RGBA')
+    frame.thumbnail((width, frame.height * width // max(frame.width, 1) + 1))
+    webp.save_image(frame, tmp_path, quality = quality)
+    os.replace(tmp_path, new_path)
+
 def _pic_to_webp(old_path:str, new_path:str) -> None:
     with Image.open(old_path) as img:
         webp.save_image(img, new_path, quality = 80)
 
 def _gif_to_webp(old_path:str, new_path:str) -> None:
+    """
+    frames are fed to the animation encoder one by one as they are decoded, each with its own duration,
+    so memory holds a few frames whatever the number of frames of the gif
+    """
     with Image.open(old_path) as gif:
-        frame_duration = gif.info.get('duration', None)
-        if frame_duration is None:
+        if gif.info.get('duration', None) is None:
             _pic_to_webp(old_path, new_path)
             return
-        fps = int(1000 / frame_duration)
 
-        frames = []
-        for fid in range(gif.n_frames):
-            gif.seek(fid)
-            frames.append(gif.copy())
-        webp.save_images(frames, new_path, fps=fps, lossless = False)
+        options = webp.WebPAnimEncoderOptions.new()
+        options.loop_count = gif.info.get('loop', 0)
+        encoder = webp.WebPAnimEncoder.new(gif.width, gif.height, options)
+        config = webp.WebPConfig.new(lossless = False)
+        timestamp_ms = 0
+        for frame in ImageSequence.Iterator(gif):
+            encoder.encode_frame(webp.WebPPicture.from_pil(frame.convert('RGBA')), timestamp_ms, config)
+            timestamp_ms += frame.info.get('duration') or 100 # browsers show 0 ms frames for 100 ms
+        data = encoder.assemble(timestamp_ms)
+    with open(new_path, 'wb') as f:
+        f.write(data.buffer())
 
 if __name__ == '__main__':
-    for dir, _, fs in os.walk(r'C:\Users\57856\Desktop\src'):
-        for f in fs:
-            if f.endswith('.webp'):
-                continue
-            p = os.path.join(dir, f)
-            print(p)
-            try:
-                convert_to_webp(old_path=p)
-            except Exception as e:
-                print(e)
-                continue
+    # convert every picture under src into webp beside it, see ingest.py to import them into the picture database
+    parser = argparse.ArgumentParser(description='convert pictures into webp in place')
+    parser.add_argument('src')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    def jobs() -> Iterator[Tuple[str, str]]:
+        for dir, _, fs in os.walk(args.src):
+            for f in fs:
+                if f.endswith('.webp') or '.' not in f:
+                    continue
+                p = os.path.join(dir, f)
+                yield p, p[:p.rfind('.')] + '.webp'
+
+    for old_path, _, error in convert_batch(jobs(), workers=args.workers, delete_source=True):
+        print(old_path if error is None else f'{old_path} {error}')
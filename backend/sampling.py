@@ -0,0 +1,173 @@
+import random
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T', bound=Hashable)
+
+class DenseSet(Generic[T]):
+    """
+    set with O(1) add, discard and uniform choice.
+    items are kept in a dense list, a removed item is replaced by the last one
+    """
+    __slots__ = ('items', 'pos')
+
+    def __init__(self, items:Iterable[T] = ()) -> None:
+        self.items:List[T] = []
+        self.pos:Dict[T, int] = dict()
+        for item in items:
+            self.add(item)
+
+    def add(self, item:T) -> bool:
+        if item in self.pos:
+            return False
+        self.pos[item] = len(self.items)
+        self.items.append(item)
+        return True
+
+    def discard(self, item:T) -> Optional[int]:
+        """
+        remove item, return its former position (now holding the former last item) or None if absent
+        """
+        i = self.pos.pop(item, None)
+        if i is None:
+            return None
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.pos[last] = i
+        return i
+
+    def choice(self, rand:random.Random) -> Optional[T]:
+        if not self.items:
+            return None
+        return self.items[rand.randrange(len(self.items))]
+
+    def __contains__(self, item:object) -> bool:
+        return item in self.pos
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self.items)
+
+class WeightedSampler(Generic[T]):
+    """
+    items with non-negative weights, O(log n) weight update and weighted choice.
+    a Fenwick tree of the weights is laid over the positions of a DenseSet,
+    so removal swaps the last item in like DenseSet, at the cost of two tree updates
+    """
+    def __init__(self) -> None:
+        self.dense:DenseSet[T] = DenseSet()
+        self.weights:List[float] = []
+        self.capacity = 1 # size of the tree, a power of 2
+        self.tree:List[float] = [0.0, 0.0] # 1-based
+
+    def set(self, item:T, weight:float) -> None:
+        if weight < 0:
+            raise ValueError(f'negative weight {weight} of {item}')
+        i = self.dense.pos.get(item)
+        if i is None:
+            self.dense.add(item)
+            self.weights.append(0.0)
+            i = len(self.weights) - 1
+            if len(self.weights) > self.capacity:
+                self._rebuild(self.capacity * 2)
+        self._add(i, weight - self.weights[i])
+        self.weights[i] = weight
+
+    def discard(self, item:T) -> None:
+        i = self.dense.pos.get(item)
+        if i is None:
+            return
+        last = len(self.weights) - 1
+        self._add(i, -self.weights[i])
+        if i != last:
+            self._add(last, -self.weights[last])
+            self._add(i, self.weights[last])
+            self.weights[i] = self.weights[last]
+        self.weights.pop()
+        self.dense.discard(item)
+
+    def weight(self, item:T) -> float:
+        return self.weights[self.dense.pos[item]]
+
+    def total(self) -> float:
+        return self._prefix(len(self.weights))
+
+    def choice(self, rand:random.Random) -> Optional[T]:
+        """
+        an item with probability weight / total, None if empty or all weights are 0
+        """
+        total = self._prefix(len(self.weights))
+        if total <= 0:
+            return None
+        rest = rand.random() * total
+        i = 0
+        step = self.capacity
+        while step:
+            j = i + step
+            if j <= self.capacity and self.tree[j] <= rest:
+                i = j
+                rest -= self.tree[j]
+            step >>= 1
+        i = min(i, len(self.weights) - 1) # float rounding at the very end
+        while i > 0 and self.weights[i] == 0: # rounding may land on a zero weight
+            i -= 1
+        return self.dense.items[i]
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def _add(self, i:int, delta:float) -> None:
+        i += 1
+        while i <= self.capacity:
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, n:int) -> float:
+        s = 0.0
+        while n > 0:
+            s += self.tree[n]
+            n -= n & -n
+        return s
+
+    def _rebuild(self, capacity:int) -> None:
+        self.capacity = capacity
+        self.tree = [0.0] * (capacity + 1)
+        for i, w in enumerate(self.weights, 1):
+            self.tree[i] += w
+            j = i + (i & -i)
+            if j <= capacity:
+                self.tree[j] += self.tree[i]
+
+class RecentPicks:
+    """
+    the last picks of each session, to avoid repeats. least recently used sessions are forgotten beyond max_sessions
+    """
+    def __init__(self, max_sessions:int = 10000) -> None:
+        self.max_sessions = max_sessions
+        self.sessions:'OrderedDict[str, Dict[Hashable, None]]' = OrderedDict()
+
+    def recent(self, session:str) -> Dict[Hashable, None]:
+        """
+        picks of the session, oldest first, as a dict for O(1) membership
+        """
+        picks = self.sessions.get(session)
+        if picks is None:
+            picks = self.sessions[session] = dict()
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(session)
+        return picks
+
+    def add(self, session:str, item:Hashable, k:int) -> None:
+        """
+        record a pick, keeping the last k of the session
+        """
+        picks = self.recent(session)
+        picks.pop(item, None)
+        picks[item] = None
+        while len(picks) > k:
+            del picks[next(iter(picks))]
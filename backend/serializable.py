@@ -1,11 +1,41 @@
+import sys
 import json
-from io import BufferedReader
-from typing import Dict, Union, Any
+from typing import Dict, Union, Any, Optional, Tuple
 
 SupportsRead = Any
 
 class Json:
+    """
+    a subclass declaring __slots__ (in every class of its hierarchy) is schema driven: its fields are the slots,
+    read and written directly instead of scanning dir(self). __interned__ names the fields whose strings,
+    or lists of strings, are interned by populate_dict, so repeated values share one object
+    """
+    __slots__ = ()
+    __fields__:Optional[Tuple[str, ...]] = None # sorted like dir(), so the keys of to_dict keep their order
+    __interned__:Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs:Any) -> None:
+        super().__init_subclass__(**kwargs)
+        if all('__slots__' in c.__dict__ for c in cls.__mro__ if c is not object):
+            cls.__fields__ = tuple(sorted(name for c in cls.__mro__ for name in c.__dict__.get('__slots__', ()) if not name.startswith('_')))
+        else:
+            cls.__fields__ = None
+
+    @classmethod
+    def from_dict(cls, obj:Dict[str, Any]) -> 'Json':
+        self = cls()
+        self.populate_dict(obj)
+        return self
+
     def to_dict(self) -> Dict[str, Any]:
+        if self.__fields__ is not None:
+            obj = dict()
+            for name in self.__fields__:
+                value = getattr(self, name)
+                if isinstance(value, Json):
+                    value = value.to_dict()
+                obj[name] = value
+            return obj
         obj = dict()
         for name in dir(self):
             if name[1] == '_':
@@ -18,6 +48,9 @@ class Json:
         return obj
 
     def populate_dict(self, obj:Dict[str, Any]) -> None:
+        if self.__fields__ is not None:
+            self._populate_fields(obj)
+            return
         for k, v in obj.items():
             if isinstance(v, dict):
                 old_value = getattr(self, k)
@@ -25,6 +58,30 @@ class Json:
                     old_value.populate_dict(v)
             else:
                 setattr(self, k, v)
+
+    def _populate_fields(self, obj:Dict[str, Any]) -> None:
+        """
+        populate_dict of the schema driven: declared fields only, a slot cannot hold others
+        """
+        fields = self.__fields__
+        interned = self.__interned__
+        for k, v in obj.items():
+            if k in interned:
+                if type(v) is str:
+                    v = sys.intern(v)
+                elif type(v) is list:
+                    try:
+                        v = list(map(sys.intern, v))
+                    except TypeError: # not only strings
+                        pass
+            elif k not in fields:
+                continue
+            elif isinstance(v, dict):
+                old_value = getattr(self, k)
+                if isinstance(old_value, Json):
+                    old_value.populate_dict(v)
+                continue
+            setattr(self, k, v)
     
     def populate_json(self, json_source:Union[str, bytes, bytearray, SupportsRead]) -> None:
         if isinstance(json_source, str) or isinstance(json_source, bytes):
@@ -0,0 +1,205 @@
+"""
+binary snapshot of the picture database, opened in constant time and decoded lazily
+
+layout, little endian:
+    header   magic 'PICSNAP1', count u64, keys offset u64, index offset u64
+    records  per picture: length u32 + compact json of the record
+    keys     the utf-8 paths, back to back
+    index    per picture, sorted by path bytes: key offset u64, key length u32, record offset u64
+opening maps the file and reads the header, a lookup is a binary search of the index
+
+convert a json database (and its journal) once:
+python snapshot.py pic/db.json pic/db.snap
+"""
+
+import os
+import mmap
+import json
+import struct
+import logging
+import argparse
+from typing import Any, Callable, Dict, Iterable, Iterator, MutableMapping, Optional, Set, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+Path = str
+P = TypeVar('P') # Picture
+
+class BinarySnapshot:
+    Magic = b'PICSNAP1'
+    Header = struct.Struct('<8sQQQ')
+    Length = struct.Struct('<I')
+    Entry = struct.Struct('<QIQ')
+
+    def __init__(self, file:str) -> None:
+        self.file = file
+        with open(file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if size < BinarySnapshot.Header.size:
+            raise ValueError(f'{file}: truncated snapshot')
+        magic, self.count, self.keys_offset, self.index_offset = BinarySnapshot.Header.unpack_from(self.map, 0)
+        if magic != BinarySnapshot.Magic:
+            raise ValueError(f'{file}: not a picture snapshot')
+
+    def key(self, i:int) -> bytes:
+        key_offset, key_length, _ = BinarySnapshot.Entry.unpack_from(self.map, self.index_offset + i * BinarySnapshot.Entry.size)
+        return self.map[key_offset:key_offset + key_length]
+
+    def find(self, path:Path) -> int:
+        """
+        position of path in the index, -1 if absent
+        """
+        key = path.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self.key(lo) == key else -1
+
+    def record(self, i:int) -> Dict[str, Any]:
+        _, _, record_offset = BinarySnapshot.Entry.unpack_from(self.map, self.index_offset + i * BinarySnapshot.Entry.size)
+        length, = BinarySnapshot.Length.unpack_from(self.map, record_offset)
+        start = record_offset + BinarySnapshot.Length.size
+        return json.loads(self.map[start:start + length])
+
+    def get(self, path:Path) -> Optional[Dict[str, Any]]:
+        i = self.find(path)
+        return None if i < 0 else self.record(i)
+
+    def paths(self) -> Iterator[Path]:
+        for i in range(self.count):
+            yield self.key(i).decode()
+
+    def close(self) -> None:
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    @staticmethod
+    def write(file:str, records:Iterable[Dict[str, Any]]) -> int:
+        """
+        write records (each with its 'path') as a snapshot, return their number. the caller makes it atomic
+        """
+        entries = [] # (key, record offset)
+        with open(file, 'wb') as f:
+            f.write(b'\0' * BinarySnapshot.Header.size)
+            offset = BinarySnapshot.Header.size
+            for record in records:
+                data = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode()
+                f.write(BinarySnapshot.Length.pack(len(data)))
+                f.write(data)
+                entries.append((record['path'].encode(), offset))
+                offset += BinarySnapshot.Length.size + len(data)
+            entries.sort()
+            keys_offset = offset
+            key_offsets = []
+            for key, _ in entries:
+                key_offsets.append(offset)
+                f.write(key)
+                offset += len(key)
+            index_offset = offset
+            f.write(b''.join(BinarySnapshot.Entry.pack(key_offset, len(key), record_offset)
+                             for key_offset, (key, record_offset) in zip(key_offsets, entries)))
+            f.seek(0)
+            f.write(BinarySnapshot.Header.pack(BinarySnapshot.Magic, len(entries), keys_offset, index_offset))
+            f.flush()
+            os.fsync(f.fileno())
+        return len(entries)
+
+class SnapshotCatalog(MutableMapping[Path, P]):
+    """
+    path -> Picture over a BinarySnapshot, in place of the dict of Pictures.
+    a picture is decoded at its first access and kept, as are the pictures added or replaced since;
+    removed ones are masked. iteration follows the snapshot order, then the added pictures
+    """
+    def __init__(self, snapshot:Optional[BinarySnapshot], make:Callable[[Dict[str, Any]], P]) -> None:
+        """
+        make(record): the Picture of a record
+        """
+        self.snapshot = snapshot
+        self.make = make
+        self.overlay:Dict[Path, P] = dict()
+        self.deleted:Set[Path] = set()
+        self.count = 0 if snapshot is None else snapshot.count
+
+    def in_snapshot(self, path:Path) -> bool:
+        return self.snapshot is not None and self.snapshot.find(path) >= 0
+
+    def __getitem__(self, path:Path) -> P:
+        p = self.overlay.get(path)
+        if p is None:
+            if path in self.deleted or self.snapshot is None:
+                raise KeyError(path)
+            record = self.snapshot.get(path)
+            if record is None:
+                raise KeyError(path)
+            p = self.overlay[path] = self.make(record)
+        return p
+
+    def __setitem__(self, path:Path, picture:P) -> None:
+        if path not in self:
+            self.count += 1
+        self.deleted.discard(path)
+        self.overlay[path] = picture
+
+    def __delitem__(self, path:Path) -> None:
+        if path not in self:
+            raise KeyError(path)
+        self.count -= 1
+        self.overlay.pop(path, None)
+        if self.in_snapshot(path):
+            self.deleted.add(path)
+
+    def __contains__(self, path:object) -> bool:
+        return path in self.overlay or (path not in self.deleted and self.in_snapshot(path))
+
+    def __iter__(self) -> Iterator[Path]:
+        if self.snapshot is not None:
+            for path in self.snapshot.paths():
+                if path not in self.deleted:
+                    yield path
+        for path in list(self.overlay):
+            if not self.in_snapshot(path):
+                yield path
+
+    def __len__(self) -> int:
+        return self.count
+
+    def values(self) -> Iterator[P]: # type: ignore[override]
+        """
+        every picture, the ones not accessed yet are decoded without being kept
+        """
+        if self.snapshot is not None:
+            for i, path in enumerate(self.snapshot.paths()):
+                if path in self.deleted:
+                    continue
+                p = self.overlay.get(path)
+                yield self.make(self.snapshot.record(i)) if p is None else p
+        for path, p in list(self.overlay.items()):
+            if not self.in_snapshot(path):
+                yield p
+
+    def items(self) -> Iterator[Tuple[Path, P]]: # type: ignore[override]
+        for p in self.values():
+            yield p.path, p
+
+    def close(self) -> None:
+        """
+        unmap the snapshot once the catalog is replaced, the pictures handed out stay valid
+        """
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+if __name__ == '__main__':
+    from logger import setup_logging
+    setup_logging()
+    from storage import JournalStore
+    parser = argparse.ArgumentParser(description="convert the json picture database to a binary snapshot")
+    parser.add_argument("json_file", help="db.json to read, with its journal")
+    parser.add_argument("snapshot_file", help="snapshot to write, its journal starts empty")
+    args = parser.parse_args()
+    JournalStore(args.snapshot_file).compact(JournalStore(args.json_file).load().values())
+    logger.info('converted %s to %s', args.json_file, args.snapshot_file)
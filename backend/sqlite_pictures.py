@@ -0,0 +1,385 @@
+"""
+picture database in SQLite, an alternative to db.json for large libraries
+
+pictures are not loaded in memory: path_pictures is a mapping over the database, tags and dirs
+are normalized in their own tables with indexes, and tag counts are kept by triggers,
+so get_all_tags reads one row per tag. WAL mode lets the read only workers query while the writer commits.
+
+migrate an existing db.json (and its journal) once:
+python sqlite_pictures.py pic/db.json pic/db.sqlite3
+"""
+
+import os
+import sqlite3
+import logging
+import argparse
+from utils import timeit
+from cache import ByteCache
+from storage import JournalStore
+from index import PictureIndex
+from picture_server import Path, Picture, Pictures
+from collections import OrderedDict
+from typing import Callable, Container, Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Schema = """
+CREATE TABLE IF NOT EXISTS pictures (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tags_count ON tags(count);
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS picture_tags (
+    picture_id INTEGER NOT NULL REFERENCES pictures(id),
+    position INTEGER NOT NULL,
+    tag_id INTEGER NOT NULL REFERENCES tags(id),
+    PRIMARY KEY (picture_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS picture_tags_tag ON picture_tags(tag_id, picture_id);
+CREATE TABLE IF NOT EXISTS picture_dirs (
+    picture_id INTEGER NOT NULL REFERENCES pictures(id),
+    position INTEGER NOT NULL,
+    dir_id INTEGER NOT NULL REFERENCES dirs(id),
+    PRIMARY KEY (picture_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS picture_dirs_dir ON picture_dirs(dir_id, picture_id);
+CREATE TRIGGER IF NOT EXISTS picture_tags_insert AFTER INSERT ON picture_tags BEGIN
+    UPDATE tags SET count = count + 1 WHERE id = NEW.tag_id;
+END;
+CREATE TRIGGER IF NOT EXISTS picture_tags_delete AFTER DELETE ON picture_tags BEGIN
+    UPDATE tags SET count = count - 1 WHERE id = OLD.tag_id;
+END;
+"""
+
+class Database:
+    """
+    connection of the current process, reopened after fork (connections must not cross processes)
+    """
+    def __init__(self, file:str) -> None:
+        self.file = file
+        self.pid = -1
+        self._conn:Optional[sqlite3.Connection] = None
+        self.tag_ids:Dict[str, int] = dict()
+        self.dir_ids:Dict[str, int] = dict()
+        self.data_version:Optional[int] = None # PRAGMA data_version last seen by the connection
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self.pid != os.getpid():
+            self._conn = sqlite3.connect(self.file)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(Schema)
+            self.pid = os.getpid()
+            self.tag_ids.clear()
+            self.dir_ids.clear()
+            self.data_version = None
+        return self._conn
+
+    def changed_by_others(self) -> bool:
+        """
+        whether another connection committed since the last call, or since the connection was opened if first called.
+        PRAGMA data_version changes on the commits of the other connections only
+        """
+        conn = self.conn
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        changed = version != self.data_version
+        self.data_version = version
+        return changed
+
+    def name_id(self, table:str, ids:Dict[str, int], name:str) -> int:
+        id = ids.get(name)
+        if id is None:
+            conn = self.conn
+            conn.execute(f'INSERT OR IGNORE INTO {table}(name) VALUES (?)', (name,))
+            id = conn.execute(f'SELECT id FROM {table} WHERE name = ?', (name,)).fetchone()[0]
+            ids[name] = id
+        return id
+
+    def write(self, picture:Picture) -> None:
+        """
+        insert or replace the picture, in the current transaction
+        """
+        conn = self.conn
+        conn.execute('INSERT INTO pictures(path, name) VALUES (?, ?) ON CONFLICT(path) DO UPDATE SET name = excluded.name',
+                     (picture.path, picture.name))
+        id = conn.execute('SELECT id FROM pictures WHERE path = ?', (picture.path,)).fetchone()[0]
+        conn.execute('DELETE FROM picture_tags WHERE picture_id = ?', (id,))
+        conn.execute('DELETE FROM picture_dirs WHERE picture_id = ?', (id,))
+        conn.executemany('INSERT INTO picture_tags(picture_id, position, tag_id) VALUES (?, ?, ?)',
+                         [(id, i, self.name_id('tags', self.tag_ids, tag)) for i, tag in enumerate(picture.tags)])
+        conn.executemany('INSERT INTO picture_dirs(picture_id, position, dir_id) VALUES (?, ?, ?)',
+                         [(id, i, self.name_id('dirs', self.dir_ids, dir)) for i, dir in enumerate(picture.dir)])
+
+    def delete(self, path:Path) -> bool:
+        conn = self.conn
+        row = conn.execute('SELECT id FROM pictures WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return False
+        conn.execute('DELETE FROM picture_tags WHERE picture_id = ?', row)
+        conn.execute('DELETE FROM picture_dirs WHERE picture_id = ?', row)
+        conn.execute('DELETE FROM pictures WHERE id = ?', row)
+        return True
+
+    def pictures(self, where:str = '', params:Tuple = ()) -> Iterator[Picture]:
+        """
+        pictures selected by where (on table pictures), with their tags and dirs merged from ordered scans
+        """
+        conn = self.conn
+        rows = conn.execute(f'SELECT id, path, name FROM pictures {where} ORDER BY id', params)
+        tags = conn.execute(f'SELECT pt.picture_id, t.name FROM picture_tags pt JOIN tags t ON t.id = pt.tag_id '
+                            f'WHERE pt.picture_id IN (SELECT id FROM pictures {where}) ORDER BY pt.picture_id, pt.position', params)
+        dirs = conn.execute(f'SELECT pd.picture_id, d.name FROM picture_dirs pd JOIN dirs d ON d.id = pd.dir_id '
+                            f'WHERE pd.picture_id IN (SELECT id FROM pictures {where}) ORDER BY pd.picture_id, pd.position', params)
+        tag = next(tags, None)
+        dir = next(dirs, None)
+        for id, path, name in rows:
+            p = Picture(path=path)
+            p.name = name
+            p.tags = []
+            while tag is not None and tag[0] == id:
+                p.tags.append(tag[1])
+                tag = next(tags, None)
+            p.dir = []
+            while dir is not None and dir[0] == id:
+                p.dir.append(dir[1])
+                dir = next(dirs, None)
+            yield p
+
+class SqliteCatalog(MutableMapping[Path, Picture]):
+    """
+    path -> Picture over the database, in place of the dict of Pictures.
+    writes go into the open transaction and are committed by Pictures.persistence.
+    the pictures handed out last are kept, so changed(path) can write back an in-place edit;
+    they are forgotten when another process commits, see SqlitePictures.reload_if_changed
+    """
+    Recent_Pictures = 4096
+
+    def __init__(self, db:Database) -> None:
+        self.db = db
+        self.handed:'OrderedDict[Path, Picture]' = OrderedDict()
+        self.dirty:Dict[Path, Picture] = dict()
+
+    def __getitem__(self, path:Path) -> Picture:
+        p = self.dirty.get(path) or self.handed.get(path)
+        if p is None:
+            p = next(self.db.pictures('WHERE path = ?', (path,)), None)
+            if p is None:
+                raise KeyError(path)
+            self.hand(p)
+        return p
+
+    def __setitem__(self, path:Path, picture:Picture) -> None:
+        self.db.write(picture)
+        self.hand(picture)
+
+    def __delitem__(self, path:Path) -> None:
+        self.dirty.pop(path, None)
+        self.handed.pop(path, None)
+        if not self.db.delete(path):
+            raise KeyError(path)
+
+    def __contains__(self, path:object) -> bool:
+        return self.db.conn.execute('SELECT 1 FROM pictures WHERE path = ?', (path,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[Path]:
+        for (path,) in self.db.conn.execute('SELECT path FROM pictures ORDER BY id'):
+            yield path
+
+    def __len__(self) -> int:
+        return self.db.conn.execute('SELECT COUNT(*) FROM pictures').fetchone()[0]
+
+    def values(self) -> Iterator[Picture]: # type: ignore[override]
+        """
+        all pictures in three ordered scans, instead of a query per picture
+        """
+        for p in self.db.pictures():
+            yield self.dirty.get(p.path) or self.handed.get(p.path) or p
+
+    def items(self) -> Iterator[Tuple[Path, Picture]]: # type: ignore[override]
+        for p in self.values():
+            yield p.path, p
+
+    def hand(self, picture:Picture) -> None:
+        self.handed[picture.path] = picture
+        self.handed.move_to_end(picture.path)
+        if len(self.handed) > SqliteCatalog.Recent_Pictures:
+            self.handed.popitem(last=False)
+
+    def changed(self, path:Path) -> None:
+        p = self.handed.get(path)
+        if p is not None:
+            self.dirty[path] = p
+
+    def flush(self) -> None:
+        for p in self.dirty.values():
+            self.db.write(p)
+        self.dirty.clear()
+
+    def forget(self, dirty:bool) -> None:
+        """
+        drop the pictures kept, so the next accesses read the database. dirty: the edits not written back as well
+        """
+        self.handed.clear()
+        if dirty:
+            self.dirty.clear()
+
+class SqlitePictures(Pictures):
+    """
+    Pictures stored in SQLite, same API as the json database
+    """
+    Persist_In_Thread = False # the connection of the process is used by the event loop thread
+    def __init__(self, root_dir:str, database_file:str, json_indent=2, cache:Optional[ByteCache] = None,
+                 on_load:Optional[Callable[[Pictures], None]] = None, scan_root:bool = True) -> None:
+        """
+        on_load: called at the end of load_database, unless read only
+        scan_root: load_database lists root_dir for new pictures, off when a DirectoryWatcher reports them
+        """
+        self.db = Database(os.path.join(root_dir, database_file)) # before Pictures.__init__ makes the catalog
+        super().__init__(root_dir=root_dir, database_file=database_file, json_indent=json_indent, cache=cache,
+                         on_load=on_load, scan_root=scan_root)
+
+    def new_catalog(self) -> Dict[Path, Picture]:
+        return SqliteCatalog(self.db) # type: ignore[return-value]
+
+    @timeit
+    def get_all_tags(self) -> Dict[str, int]:
+        rows = self.db.conn.execute('SELECT name, count FROM tags WHERE count > 0 ORDER BY count DESC')
+        return dict(rows)
+
+    def query(self, tags:Iterable[str] = (), any_tags:bool = False, dir:Optional[str] = None,
+              offset:int = 0, limit:int = 50) -> Tuple[int, List[Picture]]:
+        """
+        same as Pictures.query, answered from the tag and dir indexes
+        """
+        where, params = self._where(tags, any_tags, dir)
+        conn = self.db.conn
+        total = conn.execute(f'SELECT COUNT(*) FROM pictures {where}', params).fetchone()[0]
+        page = [path for (path,) in conn.execute(f'SELECT path FROM pictures {where} ORDER BY path LIMIT ? OFFSET ?', params + [limit, offset])]
+        pictures = {p.path: p for p in self.db.pictures(f'WHERE path IN ({",".join("?" * len(page))})', tuple(page))} if page else {}
+        return total, [pictures[path] for path in page]
+
+    def rand_picture(self, tags:Iterable[str] = (), dir:Optional[str] = None, weighted:bool = False,
+                     exclude:Container[Path] = ()) -> Optional[Picture]:
+        """
+        same as Pictures.rand_picture, without weights. unfiltered picks draw random ids and retry on holes,
+        filtered picks choose among the matches
+        """
+        if weighted:
+            raise ValueError('weighted random selection needs the json database')
+        tags = list(tags)
+        conn = self.db.conn
+        if not tags and dir is None:
+            max_id = conn.execute('SELECT MAX(id) FROM pictures').fetchone()[0]
+            if max_id is None:
+                return None
+            for _ in range(PictureIndex.Max_Tries):
+                row = conn.execute('SELECT path FROM pictures WHERE id = ?', (self.rand.randint(1, max_id),)).fetchone()
+                if row is not None and row[0] not in exclude:
+                    return self.path_pictures[row[0]]
+        where, params = self._where(tags, False, dir)
+        matches = [path for (path,) in conn.execute(f'SELECT path FROM pictures {where}', params)]
+        candidates = [path for path in matches if path not in exclude] or matches
+        return self.path_pictures[self.rand.choice(candidates)] if candidates else None
+
+    @staticmethod
+    def _where(tags:Iterable[str], any_tags:bool, dir:Optional[str]) -> Tuple[str, List]:
+        """
+        where clause on table pictures and its parameters, for the pictures having all tags (any if any_tags), in dir
+        """
+        tags = list(dict.fromkeys(tags))
+        conditions:List[str] = []
+        params:List = []
+        if tags:
+            having = '' if any_tags else f' GROUP BY pt.picture_id HAVING COUNT(DISTINCT pt.tag_id) = {len(tags)}'
+            conditions.append(f'id IN (SELECT pt.picture_id FROM picture_tags pt JOIN tags t ON t.id = pt.tag_id '
+                              f'WHERE t.name IN ({",".join("?" * len(tags))}){having})')
+            params.extend(tags)
+        if dir is not None:
+            conditions.append('id IN (SELECT pd.picture_id FROM picture_dirs pd JOIN dirs d ON d.id = pd.dir_id WHERE d.name = ?)')
+            params.append(dir)
+        return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    @timeit
+    def load_database(self) -> None:
+        if self.scan_root:
+            for filename in os.listdir(self.root_dir):
+                if filename.endswith('.webp') and filename not in self.path_pictures:
+                    self.add_new_pictures(filename)
+
+        if self.on_load is not None and not self.read_only:
+            self.on_load(self)
+
+    def add_new_pictures(self, path:Path) -> None:
+        logger.info('new add pictures %s', path)
+        if path in self.path_pictures:
+            raise RuntimeError(f"duplicated name {path}")
+        self.path_pictures[path] = Picture(path=path)
+
+    def changed(self, path:Path) -> None:
+        self.path_pictures.changed(path) # type: ignore[attr-defined]
+
+    @timeit
+    def persistence(self) -> None:
+        """
+        commit the pictures added, changed or removed since the last persistence
+        """
+        if self.read_only:
+            logger.debug('read only, skip persistence')
+            return
+        self.path_pictures.flush() # type: ignore[attr-defined]
+        self.db.conn.commit()
+
+    def compact(self) -> None:
+        """
+        move the WAL into the database file
+        """
+        if not self.read_only:
+            self.db.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def sync(self) -> None:
+        pass # committed transactions are durable at the WAL checkpoints of sqlite
+
+    def reload_if_changed(self) -> bool:
+        """
+        queries read the committed database, but the pictures kept by the catalog would stay stale:
+        forget them once another process (the writer) committed. a read only worker never persists its edits,
+        they are forgotten too
+        """
+        if not self.db.changed_by_others():
+            return False
+        logger.debug('database %s committed by another process, forget the kept pictures', self.database_file)
+        self.path_pictures.forget(dirty=self.read_only) # type: ignore[attr-defined]
+        return True
+
+@timeit
+def migrate(json_file:str, sqlite_file:str) -> int:
+    """
+    copy the json database (snapshot and journal) into sqlite in one transaction, return the number of pictures
+    """
+    db = Database(sqlite_file)
+    count = 0
+    for item in JournalStore(json_file).load().values():
+        db.write(Picture.from_dict(item))
+        count += 1
+    db.conn.commit()
+    return count
+
+if __name__ == '__main__':
+    from logger import setup_logging
+    setup_logging()
+    parser = argparse.ArgumentParser(description="migrate the json picture database to sqlite")
+    parser.add_argument("json_file", help="db.json to read, with its journal")
+    parser.add_argument("sqlite_file", help="sqlite database to write, created if missing")
+    args = parser.parse_args()
+    logger.info('migrated %d pictures', migrate(args.json_file, args.sqlite_file))
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import logging
+from snapshot import BinarySnapshot
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class JournalStore:
+    """
+    storage of json records keyed by 'path': a snapshot plus an append-only journal of changes.
+
+    the snapshot is the plain json list of records (the former db.json format),
+    or a BinarySnapshot if snapshot_file ends with .snap, which open_snapshot maps without reading it,
+    the journal (snapshot_file + '.journal') holds one change per line,
+    {"op": "put", "record": {...}} or {"op": "del", "path": "..."}.
+    load replays the journal over the snapshot. compact rewrites the snapshot atomically
+    (temp file + fsync + rename) and empties the journal.
+    appended changes are flushed at once and fsynced at most every fsync_interval seconds,
+    so a power loss may lose the changes of the last interval, a process crash loses none
+    """
+    def __init__(self, snapshot_file:str, fsync_interval:float = 1.0, json_indent:Optional[int] = None) -> None:
+        self.snapshot_file = snapshot_file
+        self.journal_file = snapshot_file + '.journal'
+        self.fsync_interval = fsync_interval
+        self.json_indent = json_indent
+        self.binary = snapshot_file.endswith('.snap')
+        self.journal_records = 0 # records in the journal since the last compaction
+        self.journal_offset = 0 # bytes of the journal already replayed
+        self.snapshot_mtime_ns = 0
+        self.last_fsync = 0.0
+        self.unsynced = False
+        self.journal = None
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """
+        records of the snapshot with the journal replayed, by path
+        """
+        records:Dict[str, Dict[str, Any]] = dict()
+        if self.binary:
+            snapshot = self.open_snapshot()
+            if snapshot is not None:
+                for i in range(snapshot.count):
+                    record = snapshot.record(i)
+                    records[record['path']] = record
+                snapshot.close()
+        else:
+            self.journal_records = 0
+            self.journal_offset = 0
+            self.snapshot_mtime_ns = 0
+            if os.path.exists(self.snapshot_file):
+                self.snapshot_mtime_ns = os.stat(self.snapshot_file).st_mtime_ns
+                with open(file=self.snapshot_file, mode='r', encoding='utf-8') as f:
+                    for record in json.load(f):
+                        records[record['path']] = record
+        for path, record in self.replay():
+            if record is None:
+                records.pop(path, None)
+            else:
+                records[path] = record
+        return records
+
+    def open_snapshot(self) -> Optional[BinarySnapshot]:
+        """
+        map the binary snapshot, None if there is none yet. the journal is then replayed from its start
+        """
+        self.journal_records = 0
+        self.journal_offset = 0
+        self.snapshot_mtime_ns = 0
+        if not os.path.exists(self.snapshot_file):
+            return None
+        self.snapshot_mtime_ns = os.stat(self.snapshot_file).st_mtime_ns
+        return BinarySnapshot(self.snapshot_file)
+
+    def replay(self) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        changes journaled since the last load/replay, (path, record) or (path, None) when deleted.
+        a torn last line (crash while appending) is left out, and cut off by the next append
+        once _open_journal has checked it on disk
+        """
+        changes:List[Tuple[str, Optional[Dict[str, Any]]]] = []
+        if not os.path.exists(self.journal_file):
+            return changes
+        with open(file=self.journal_file, mode='rb') as f:
+            f.seek(self.journal_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    break
+                if change['op'] == 'put':
+                    changes.append((change['record']['path'], change['record']))
+                else:
+                    changes.append((change['path'], None))
+                self.journal_offset += len(line)
+                self.journal_records += 1
+        return changes
+
+    def append(self, puts:Iterable[Dict[str, Any]], dels:Iterable[str] = ()) -> None:
+        """
+        journal changed records and deleted paths. cost depends on the changes only
+        """
+        lines = [json.dumps({'op':'put', 'record':record}, ensure_ascii=False) + '\n' for record in puts]
+        lines.extend(json.dumps({'op':'del', 'path':path}, ensure_ascii=False) + '\n' for path in dels)
+        if not lines:
+            return
+        journal = self._open_journal()
+        journal.write(''.join(lines).encode())
+        journal.flush()
+        self.journal_offset = journal.tell()
+        self.journal_records += len(lines)
+        self.unsynced = True
+        if time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        if self.unsynced and self.journal is not None:
+            os.fsync(self.journal.fileno())
+            self.unsynced = False
+        self.last_fsync = time.monotonic()
+
+    def compact(self, records:Iterable[Dict[str, Any]]) -> None:
+        """
+        write records as the new snapshot atomically, then empty the journal.
+        a crash in between only replays changes already in the snapshot, which is harmless
+        """
+        tmp_file = f'{self.snapshot_file}.{os.getpid()}.tmp'
+        if self.binary:
+            BinarySnapshot.write(tmp_file, records)
+        else:
+            with open(file=tmp_file, mode='w', encoding='utf-8') as f:
+                json.dump(list(records), f, ensure_ascii=False, indent=self.json_indent)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        self._fsync_dir()
+        self.snapshot_mtime_ns = os.stat(self.snapshot_file).st_mtime_ns
+        journal = self._open_journal()
+        journal.truncate(0)
+        journal.seek(0)
+        os.fsync(journal.fileno())
+        self.journal_offset = 0
+        self.journal_records = 0
+        self.unsynced = False
+
+    def changed_on_disk(self) -> Tuple[bool, bool]:
+        """
+        (snapshot rewritten, journal grown) since the last load/replay, by another process
+        """
+        try:
+            snapshot_changed = os.stat(self.snapshot_file).st_mtime_ns != self.snapshot_mtime_ns
+        except FileNotFoundError:
+            snapshot_changed = False
+        try:
+            journal_size = os.stat(self.journal_file).st_size
+        except FileNotFoundError:
+            journal_size = 0
+        return snapshot_changed, journal_size != self.journal_offset
+
+    def close(self) -> None:
+        if self.journal is not None:
+            self.sync()
+            self.journal.close()
+            self.journal = None
+
+    def _open_journal(self):
+        if self.journal is None:
+            journal = open(file=self.journal_file, mode='ab')
+            if journal.tell() != self.journal_offset:
+                try:
+                    self._cut_torn_tail(journal)
+                except BaseException:
+                    journal.close()
+                    raise
+            self.journal = journal
+        return self.journal
+
+    def _cut_torn_tail(self, journal) -> None:
+        """
+        cut what follows the replayed journal if it is a torn line, a partial write without its newline.
+        complete lines are changes not replayed yet (another process wrote them), a shorter journal was
+        compacted by another process: both raise RuntimeError rather than lose changes
+        """
+        size = journal.tell()
+        with open(file=self.journal_file, mode='rb') as f:
+            f.seek(self.journal_offset)
+            tail = f.read()
+        if size < self.journal_offset or b'\n' in tail:
+            raise RuntimeError(f'{self.journal_file} changed since it was replayed ({size} bytes, {self.journal_offset} replayed), '
+                               'reload before appending')
+        logger.warning('cut a torn line of %d bytes at the end of %s', len(tail), self.journal_file)
+        journal.truncate(self.journal_offset)
+        journal.seek(self.journal_offset)
+
+    def _fsync_dir(self) -> None:
+        if os.name == 'nt':
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.snapshot_file)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
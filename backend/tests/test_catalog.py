@@ -0,0 +1,110 @@
+"""
+pictures read back from the catalogs equal the ones stored
+
+python -m pytest tests  (from backend/)
+"""
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from typing import List
+from columnar import ColumnarCatalog
+from snapshot import BinarySnapshot, SnapshotCatalog
+
+class Record:
+    __slots__ = ('path', 'name', 'dir', 'tags')
+
+    def __init__(self, path:str, name:str, dir:List[str], tags:List[str]) -> None:
+        self.path, self.name, self.dir, self.tags = path, name, dir, tags
+
+    def fields(self) -> tuple:
+        return (self.path, self.name, self.dir, self.tags)
+
+class ColumnarCatalogTest(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        catalog = ColumnarCatalog(Record)
+        records = [Record(f'd{i % 3}/p{i}.webp', f'p{i}', [f'd{i % 3}'], [f't{j}' for j in range(i % 4)]) for i in range(20)]
+        for r in records:
+            catalog[r.path] = r
+        self.assertEqual(len(catalog), 20)
+        self.assertEqual(list(catalog), [r.path for r in records])
+        self.assertEqual([p.fields() for p in catalog.values()], [r.fields() for r in records])
+        self.assertEqual(catalog['d1/p4.webp'].fields(), records[4].fields())
+        self.assertEqual(len(catalog.strings.strings), 20 + 3 + 3) # names, dirs and tags once each
+        self.assertNotIn('missing', catalog)
+        with self.assertRaises(KeyError):
+            catalog['missing']
+
+    def test_edit_in_place_then_changed(self) -> None:
+        catalog = ColumnarCatalog(Record)
+        catalog['a'] = Record('a', 'a', [], ['cat'])
+        p = catalog['a']
+        self.assertIs(catalog['a'], p) # handed out pictures are kept
+        p.tags.append('dog')
+        catalog.changed('a')
+        catalog.handed.clear()
+        self.assertEqual(catalog['a'].tags, ['cat', 'dog'])
+
+    def test_holes_are_compacted(self) -> None:
+        catalog = ColumnarCatalog(Record)
+        for i in range(3000):
+            catalog[str(i)] = Record(str(i), str(i), ['d'], ['t'])
+        for i in range(1, 3000, 2):
+            del catalog[str(i)]
+        for i in range(0, 3000, 2): # replacing leaves holes as well, compacted once they are half of the rows
+            catalog[str(i)] = Record(str(i), f'{i}b', ['d'], ['t', 'u'])
+        catalog.handed.clear()
+        self.assertLess(len(catalog.paths), 3000)
+        self.assertEqual(len(catalog), 1500)
+        self.assertEqual(catalog['10'].fields(), ('10', '10b', ['d'], ['t', 'u']))
+        self.assertEqual(sorted(catalog, key=int), [str(i) for i in range(0, 3000, 2)])
+class SnapshotCatalogTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'db.snap')
+        self.records = [{'path': path, 'name': path.upper(), 'tags': ['t', path]} for path in ('b', 'é', 'a', 'c')]
+        self.assertEqual(BinarySnapshot.write(self.file, self.records), 4)
+        self.snapshot = BinarySnapshot(self.file)
+
+    def tearDown(self) -> None:
+        self.snapshot.close()
+        self.dir.cleanup()
+
+    def test_round_trip(self) -> None:
+        self.assertEqual(list(self.snapshot.paths()), ['a', 'b', 'c', 'é']) # sorted by utf-8 bytes
+        for record in self.records:
+            self.assertEqual(self.snapshot.get(record['path']), record)
+        self.assertIsNone(self.snapshot.get('d'))
+        catalog = SnapshotCatalog(self.snapshot, lambda record: SimpleNamespace(**record))
+        self.assertEqual(len(catalog), 4)
+        self.assertEqual(catalog['é'].tags, ['t', 'é'])
+        self.assertIs(catalog['é'], catalog['é']) # decoded once
+        self.assertEqual([p.name for p in catalog.values()], ['A', 'B', 'C', 'É'])
+
+    def test_changes_over_the_snapshot(self) -> None:
+        catalog = SnapshotCatalog(self.snapshot, lambda record: SimpleNamespace(**record))
+        del catalog['b']
+        catalog['a'] = SimpleNamespace(path='a', name='A2', tags=[])
+        catalog['d'] = SimpleNamespace(path='d', name='D', tags=[])
+        self.assertEqual(len(catalog), 4)
+        self.assertNotIn('b', catalog)
+        with self.assertRaises(KeyError):
+            catalog['b']
+        with self.assertRaises(KeyError):
+            del catalog['b']
+        self.assertEqual(list(catalog), ['a', 'c', 'é', 'd'])
+        self.assertEqual([p.name for p in catalog.values()], ['A2', 'C', 'É', 'D'])
+        catalog['b'] = SimpleNamespace(path='b', name='B2', tags=[])
+        self.assertEqual(dict((path, p.name) for path, p in catalog.items()), {'a': 'A2', 'b': 'B2', 'c': 'C', 'é': 'É', 'd': 'D'})
+        self.assertEqual(len(catalog), 5)
+
+    def test_bad_file(self) -> None:
+        file = os.path.join(self.dir.name, 'db.json')
+        with open(file, 'wb') as f:
+            f.write(b'{"not": "a snapshot at all"}')
+        with self.assertRaises(ValueError):
+            BinarySnapshot(file)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+the content encoding follows the preference of the client among the supported ones
+
+python -m pytest tests  (from backend/)
+"""
+
+import gzip
+import unittest
+import compression
+from compression import negotiate
+
+class NegotiateTest(unittest.TestCase):
+    def test_identity(self) -> None:
+        for accept_encoding in (None, '', 'identity', 'deflate', 'gzip;q=0', '*;q=0', 'gzip;q=x'):
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertIsNone(negotiate(accept_encoding))
+
+    def test_gzip(self) -> None:
+        for accept_encoding in ('gzip', 'GZIP', 'deflate, gzip', 'gzip;q=0.5', ' gzip ; q=1.0 ,identity'):
+            with self.subTest(accept_encoding=accept_encoding):
+                self.assertEqual(negotiate(accept_encoding), 'gzip')
+
+    def test_preference(self) -> None:
+        best = compression.Encodings[0]
+        self.assertEqual(negotiate('*'), best)
+        self.assertEqual(negotiate('gzip, deflate, br'), best)
+        self.assertEqual(negotiate('br;q=0, gzip;q=0.1'), 'gzip')
+        if 'br' in compression.Encodings:
+            self.assertEqual(negotiate('gzip;q=0.5, br'), 'br')
+            self.assertEqual(negotiate('gzip, br;q=0.5'), 'gzip')
+        else:
+            self.assertEqual(negotiate('br'), None)
+        self.assertEqual(negotiate('*;q=0.5, gzip;q=0'), None if best == 'gzip' else 'br')
+
+    def test_compress(self) -> None:
+        data = b'{"tags": ["cat", "dog"]}' * 100
+        self.assertEqual(gzip.decompress(compression.compress(data, 'gzip')), data)
+        with self.assertRaises(ValueError):
+            compression.compress(data, 'zstd')
+
+if __name__ == '__main__':
+    unittest.main()
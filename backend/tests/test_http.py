@@ -0,0 +1,137 @@
+"""
+conditional and range requests are answered from the validators of the file version
+
+python -m pytest tests  (from backend/)
+"""
+
+import os
+import asyncio
+import tempfile
+import unittest
+import email.utils
+from http_server import FileResponse, FileValidator, HTTPHeader, HTTPRequest, HttpResponse, HTTPServer, parse_range
+
+Mtime = 1700000000
+
+def request(**headers:str) -> HTTPRequest:
+    header = HTTPHeader()
+    for key, value in headers.items():
+        header.header(key.replace('_', '-'), value)
+    return HTTPRequest(header=header, content=b'')
+
+class FileValidatorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'a.webp')
+        with open(self.file, 'wb') as f:
+            f.write(b'0123456789')
+        os.utime(self.file, ns=(Mtime * 10 ** 9, Mtime * 10 ** 9))
+        self.validator = FileValidator(os.stat(self.file))
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_validators(self) -> None:
+        self.assertEqual(self.validator.etag, f'"a-{Mtime * 10 ** 9:x}"')
+        self.assertEqual(self.validator.last_modified, email.utils.formatdate(Mtime, usegmt=True))
+
+    def test_if_none_match(self) -> None:
+        etag = self.validator.etag
+        self.assertTrue(self.validator.not_modified(request(If_None_Match=etag)))
+        self.assertTrue(self.validator.not_modified(request(If_None_Match=f'"other", W/{etag}')))
+        self.assertTrue(self.validator.not_modified(request(If_None_Match='*')))
+        self.assertFalse(self.validator.not_modified(request(If_None_Match='"other"')))
+        # If-None-Match wins over If-Modified-Since
+        self.assertFalse(self.validator.not_modified(request(If_None_Match='"other"', If_Modified_Since=self.validator.last_modified)))
+
+    def test_if_modified_since(self) -> None:
+        self.assertTrue(self.validator.not_modified(request(If_Modified_Since=self.validator.last_modified)))
+        self.assertTrue(self.validator.not_modified(request(If_Modified_Since=email.utils.formatdate(Mtime + 60, usegmt=True))))
+        self.assertFalse(self.validator.not_modified(request(If_Modified_Since=email.utils.formatdate(Mtime - 60, usegmt=True))))
+        self.assertFalse(self.validator.not_modified(request(If_Modified_Since='yesterday')))
+        self.assertFalse(self.validator.not_modified(request()))
+
+    def test_of_recomputes_changed_file(self) -> None:
+        validators = dict()
+        validator = FileValidator.of(validators, 'a.webp', os.stat(self.file))
+        self.assertIs(FileValidator.of(validators, 'a.webp', os.stat(self.file)), validator)
+        with open(self.file, 'ab') as f:
+            f.write(b'!')
+        changed = FileValidator.of(validators, 'a.webp', os.stat(self.file))
+        self.assertIsNot(changed, validator)
+        self.assertNotEqual(changed.etag, validator.etag)
+    def test_if_range(self) -> None:
+        self.assertTrue(self.validator.if_range(request()))
+        self.assertTrue(self.validator.if_range(request(If_Range=self.validator.etag)))
+        self.assertTrue(self.validator.if_range(request(If_Range=self.validator.last_modified)))
+        self.assertFalse(self.validator.if_range(request(If_Range='"other"')))
+        self.assertFalse(self.validator.if_range(request(If_Range=email.utils.formatdate(Mtime - 60, usegmt=True))))
+
+class ParseRangeTest(unittest.TestCase):
+    def test_ranges(self) -> None:
+        self.assertEqual(parse_range('bytes=0-99', 1000), [(0, 100)])
+        self.assertEqual(parse_range('bytes=900-', 1000), [(900, 100)])
+        self.assertEqual(parse_range('bytes=-100', 1000), [(900, 100)])
+        self.assertEqual(parse_range('bytes=990-2000', 1000), [(990, 10)])
+        self.assertEqual(parse_range('bytes=-2000', 1000), [(0, 1000)])
+        self.assertEqual(parse_range('bytes=0-0, 10-19', 1000), [(0, 1), (10, 10)])
+
+    def test_unsatisfiable(self) -> None:
+        self.assertEqual(parse_range('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range('bytes=2000-3000', 1000), [])
+        self.assertEqual(parse_range('bytes=-0', 1000), [])
+
+    def test_invalid_is_ignored(self) -> None:
+        for value in ('items=0-9', 'bytes=', 'bytes=9-0', 'bytes=a-9', 'bytes=0-b', 'bytes=5', 'bytes=--5'):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_range(value, 1000))
+class FileResponseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'a.webp')
+        with open(self.file, 'wb') as f:
+            f.write(b'0123456789')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def body(self, response:HttpResponse) -> bytes:
+        buffers = []
+        response.send(buffers.append)
+        return b''.join(buffers).partition(b'\r\n\r\n')[2]
+
+    def test_send(self) -> None:
+        response = HttpResponse.file(self.file, 'image/webp')
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(self.body(response), b'0123456789')
+        self.assertEqual(self.body(HttpResponse.file(self.file, 'image/webp', request(Range='bytes=2-4'))), b'234')
+        body = self.body(HttpResponse.file(self.file, 'image/webp', request(Range='bytes=0-0,-2')))
+        self.assertIn(b'Content-Range: bytes 0-0/10\r\n\r\n0\r\n', body)
+        self.assertIn(b'Content-Range: bytes 8-9/10\r\n\r\n89\r\n', body)
+
+    def test_file_opened_when_sent(self) -> None:
+        response = HttpResponse.file(self.file, 'image/webp')
+        with open(self.file, 'ab') as f:
+            f.write(b'!')
+        with self.assertRaises(RuntimeError): # the header was made for 10 bytes
+            response.send(lambda buffer: None)
+        os.remove(self.file)
+        with self.assertRaises(FileNotFoundError):
+            HttpResponse.file(self.file, 'image/webp')
+
+class HTTPServerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_shutdown_hooks_run_when_stopped(self) -> None:
+        server = HTTPServer(ip='127.0.0.1', port=0)
+        events = []
+        server.add_startup(lambda worker_id: events.append(('startup', worker_id)))
+        server.add_shutdown(lambda: events.append(('shutdown',)))
+        task = asyncio.get_running_loop().create_task(server.start_async())
+        while not events:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(events, [('startup', 0), ('shutdown',)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+the picture index answers tag and dir queries as a scan of the catalog would, and samples its matches
+
+python -m pytest tests  (from backend/)
+"""
+
+import random
+import unittest
+from collections import Counter
+from index import PictureIndex, TagCounts
+from sampling import DenseSet, WeightedSampler
+
+class TagCountsTest(unittest.TestCase):
+    def test_most_common_follows_changes(self) -> None:
+        counts = TagCounts()
+        for tag, delta in (('cat', 3), ('dog', 1), ('sky', 2), ('dog', 2), ('cat', -3)):
+            counts.increase(tag, delta)
+        self.assertEqual(list(counts.most_common()), [('dog', 3), ('sky', 2)])
+        self.assertEqual(counts.counts, [2, 3])
+        counts.increase('sky', -2)
+        counts.increase('dog', -3)
+        self.assertEqual(list(counts.most_common()), [])
+        self.assertEqual((counts.count, counts.buckets, counts.counts), ({}, {}, []))
+
+class PictureIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = PictureIndex(weighted=True)
+        self.index.update('a', ['cat', 'sky'], ['x'], weight=1.0)
+        self.index.update('b', ['cat'], ['x', 'y'], weight=3.0)
+        self.index.update('c', ['dog', 'sky'], ['y'], weight=0.0)
+        self.index.update('d', [], [])
+
+    def test_select(self) -> None:
+        self.assertEqual(set(self.index.select()), {'a', 'b', 'c', 'd'})
+        self.assertEqual(set(self.index.select(['cat'])), {'a', 'b'})
+        self.assertEqual(set(self.index.select(['cat', 'sky'])), {'a'})
+        self.assertEqual(set(self.index.select(['cat', 'dog'], any_tags=True)), {'a', 'b', 'c'})
+        self.assertEqual(set(self.index.select(['sky'], dir='y')), {'c'})
+        self.assertEqual(set(self.index.select(dir='x')), {'a', 'b'})
+        self.assertEqual(set(self.index.select(['bird'])), set())
+        self.assertEqual(set(self.index.select(['cat'], dir='z')), set())
+
+    def test_page(self) -> None:
+        self.assertEqual(self.index.page(['sky'], limit=1), (2, ['a']))
+        self.assertEqual(self.index.page(['cat', 'dog'], any_tags=True, offset=1), (3, ['b', 'c']))
+        self.assertEqual(self.index.page(['cat'], dir='y'), (1, ['b']))
+        self.assertEqual(self.index.page(['bird']), (0, []))
+        self.assertEqual(self.index.page(offset=1, limit=2), (4, ['b', 'c']))
+        self.index.update('ab', ['cat']) # the sorted paths follow adds and removes
+        self.index.update('c', None)
+        self.index.update('a', ['dog']) # reindexed, not added twice
+        self.assertEqual(self.index.page(), (4, ['a', 'ab', 'b', 'd']))
+        self.assertEqual(self.index.page(offset=3, limit=5), (4, ['d']))
+        self.assertEqual(self.index.page(['cat']), (2, ['ab', 'b']))
+
+    def test_update_reindexes(self) -> None:
+        self.index.update('a', ['dog'], ['y'])
+        self.assertEqual(set(self.index.select(['cat'])), {'b'})
+        self.assertEqual(set(self.index.select(['dog'], dir='y')), {'a', 'c'})
+        self.assertEqual(next(self.index.tag_counts.most_common()), ('dog', 2))
+        self.assertEqual(dict(self.index.tag_counts.most_common()), {'dog': 2, 'cat': 1, 'sky': 1})
+        self.index.update('b', None)
+        self.index.update('c', None)
+        self.assertNotIn('cat', self.index.by_tag)
+        self.assertNotIn('x', self.index.by_dir)
+        self.assertEqual(set(self.index.select()), {'a', 'd'})
+        self.assertEqual(list(self.index.tag_counts.most_common()), [('dog', 1)])
+    def test_sample(self) -> None:
+        rand = random.Random(1)
+        for _ in range(50):
+            self.assertIn(self.index.sample(rand, ['sky']), {'a', 'c'})
+            self.assertEqual(self.index.sample(rand, ['cat'], dir='y'), 'b')
+            self.assertEqual(self.index.sample(rand, ['cat'], exclude={'a'}), 'b')
+            self.assertNotEqual(self.index.sample(rand, weighted=True), 'c') # weight 0
+        self.assertIsNone(self.index.sample(rand, ['bird']))
+        self.assertIn(self.index.sample(rand, ['cat'], exclude={'a', 'b'}), {'a', 'b'}) # every match excluded
+        self.assertIsNone(self.index.sample(rand, ['dog'], weighted=True)) # only weight 0 matches
+        with self.assertRaises(ValueError):
+            PictureIndex().sample(rand, weighted=True)
+
+    def test_sample_rare_matches(self) -> None:
+        for i in range(1000):
+            self.index.update(f'p{i}', ['common'])
+        self.index.update('rare', ['common', 'bird'])
+        rand = random.Random(1)
+        self.assertEqual(self.index.sample(rand, ['common', 'bird']), 'rare')
+        self.assertEqual(self.index.sample(rand, ['common', 'bird'], weighted=True), 'rare')
+
+class DenseSetTest(unittest.TestCase):
+    def test_add_discard(self) -> None:
+        s = DenseSet('abcd')
+        self.assertFalse(s.add('a'))
+        self.assertEqual(s.discard('b'), 1)
+        self.assertIsNone(s.discard('b'))
+        self.assertEqual(s.items, ['a', 'd', 'c']) # the last item fills the hole
+        self.assertEqual({item: s.pos[item] for item in s}, {'a': 0, 'd': 1, 'c': 2})
+        self.assertEqual(len(s), 3)
+        self.assertNotIn('b', s)
+        rand = random.Random(1)
+        self.assertEqual({s.choice(rand) for _ in range(100)}, {'a', 'c', 'd'})
+        for item in 'acd':
+            s.discard(item)
+        self.assertIsNone(s.choice(rand))
+
+class WeightedSamplerTest(unittest.TestCase):
+    def test_choice_follows_weights(self) -> None:
+        sampler = WeightedSampler()
+        for i, weight in enumerate([0.0, 1.0, 0.0, 3.0, 0.0]):
+            sampler.set(i, weight)
+        self.assertEqual(sampler.total(), 4.0)
+        rand = random.Random(1)
+        picks = Counter(sampler.choice(rand) for _ in range(4000))
+        self.assertEqual(set(picks), {1, 3})
+        self.assertAlmostEqual(picks[3] / 4000, 0.75, delta=0.05)
+
+    def test_zero_weights(self) -> None:
+        sampler = WeightedSampler()
+        rand = random.Random(1)
+        self.assertIsNone(sampler.choice(rand))
+        for i in range(10):
+            sampler.set(i, 0.0)
+        self.assertIsNone(sampler.choice(rand))
+        sampler.set(0, 2.0) # the first item, where rounding falls back to
+        self.assertEqual({sampler.choice(rand) for _ in range(100)}, {0})
+        sampler.set(0, 0.0)
+        sampler.set(9, 1.0) # the last one
+        self.assertEqual({sampler.choice(rand) for _ in range(100)}, {9})
+        with self.assertRaises(ValueError):
+            sampler.set(1, -1.0)
+
+    def test_discard_moves_last(self) -> None:
+        sampler = WeightedSampler()
+        for i in range(5):
+            sampler.set(i, float(i))
+        sampler.discard(1)
+        sampler.discard(7)
+        self.assertEqual(len(sampler), 4)
+        self.assertEqual(sampler.total(), 9.0)
+        self.assertEqual([sampler.weight(i) for i in (0, 2, 3, 4)], [0.0, 2.0, 3.0, 4.0])
+        rand = random.Random(1)
+        self.assertEqual({sampler.choice(rand) for _ in range(500)}, {2, 3, 4})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+requests are read within their size limits, pipelined ones in order
+
+python -m pytest tests  (from backend/)
+"""
+
+import asyncio
+import unittest
+from http_server import HTTPReader, HTTPRequest
+
+class HTTPReaderTest(unittest.IsolatedAsyncioTestCase):
+    def http_reader(self, data:bytes, limit:int = 2 ** 16, **kwargs:int) -> HTTPReader:
+        reader = asyncio.StreamReader(limit=limit)
+        reader.feed_data(data)
+        reader.feed_eof()
+        return HTTPReader(reader=reader, peername='test', timeout=5.0, **kwargs)
+
+    async def test_request(self) -> None:
+        http_reader = self.http_reader(b'POST /api/tags HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\n\r\n{"a"')
+        request = await http_reader.read_request_header()
+        self.assertEqual((request.method, request.path, request.protocol), ('POST', '/api/tags', 'HTTP/1.1'))
+        self.assertEqual(request.header.get('host'), 'x')
+        request = await http_reader.read_request_body(request)
+        self.assertEqual(request.content, b'{"a"')
+
+    async def test_header_too_long(self) -> None:
+        header = b'GET / HTTP/1.1\r\nX-Pad: ' + b'a' * 200 + b'\r\n\r\n'
+        with self.assertRaises(HTTPRequest.Error):
+            await self.http_reader(header, max_header_size=100).read_request_header()
+        with self.assertRaises(HTTPRequest.Error): # beyond the StreamReader limit
+            await self.http_reader(header, limit=100, max_header_size=100).read_request_header()
+
+    async def test_body_too_long(self) -> None:
+        for length in (b'11', b'-1', b'ten'):
+            with self.subTest(length=length):
+                http_reader = self.http_reader(b'POST / HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\n0123456789', max_body_size=10)
+                request = await http_reader.read_request_header()
+                with self.assertRaises(HTTPRequest.Error):
+                    await http_reader.read_request_body(request)
+
+    async def test_bad_request_line(self) -> None:
+        with self.assertRaises(HTTPRequest.Error):
+            await self.http_reader(b'GET /\r\n\r\n').read_request_header()
+        with self.assertRaises(HTTPRequest.Error):
+            await self.http_reader(b'GET / HTTP/1.1\r\nno delimiter\r\n\r\n').read_request_header()
+
+    async def test_connection_closed(self) -> None:
+        with self.assertRaises(HTTPRequest.Exception):
+            await self.http_reader(b'GET / HTTP/1.1\r\n').read_request_header()
+        http_reader = self.http_reader(b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n0123')
+        request = await http_reader.read_request_header()
+        with self.assertRaises(HTTPRequest.Exception):
+            await http_reader.read_request_body(request)
+    async def test_pipelined_requests(self) -> None:
+        http_reader = self.http_reader(b'POST /a HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc'
+                                       b'GET /b HTTP/1.1\r\n\r\n'
+                                       b'POST /c HTTP/1.1\r\nContent-Length: 1\r\n\r\nz')
+        served = []
+        for _ in range(3):
+            request = await http_reader.read_request_header(idle_timeout=0.1)
+            request = await http_reader.read_request_body(request)
+            served.append((request.path, request.content))
+        self.assertEqual(served, [('/a', b'abc'), ('/b', b''), ('/c', b'z')])
+        with self.assertRaises(HTTPRequest.Exception):
+            await http_reader.read_request_header(idle_timeout=0.1)
+
+    async def test_idle_timeout(self) -> None:
+        http_reader = HTTPReader(reader=asyncio.StreamReader(), peername='test', timeout=5.0)
+        with self.assertRaises(TimeoutError):
+            await http_reader.read_request_header(idle_timeout=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+routes are found by the longest registered prefix of the path
+
+python -m pytest tests  (from backend/)
+"""
+
+import asyncio
+import unittest
+from metrics import registry
+from http_server import HTTPHandle, HTTPHeader, HTTPRequest, HttpResponse, HTTPServer, RadixTree, Router
+
+class RadixTreeTest(unittest.TestCase):
+    def test_longest_prefix(self) -> None:
+        tree = RadixTree()
+        for prefix in ('/pic', '/picture', '/pic/thumb', '/api'):
+            tree.insert(prefix, prefix)
+        self.assertEqual(len(tree), 4)
+        self.assertEqual(tree.longest_prefix('/pic/a.webp'), '/pic')
+        self.assertEqual(tree.longest_prefix('/pictures'), '/picture')
+        self.assertEqual(tree.longest_prefix('/pic/thumb/a.webp'), '/pic/thumb')
+        self.assertEqual(tree.longest_prefix('/pic/thum'), '/pic')
+        self.assertEqual(tree.longest_prefix('/api'), '/api')
+        self.assertIsNone(tree.longest_prefix('/ap'))
+        self.assertIsNone(tree.longest_prefix(''))
+
+    def test_split_edge_keeps_both_prefixes(self) -> None:
+        tree = RadixTree()
+        tree.insert('/abcd', 1)
+        tree.insert('/abxy', 2) # splits the edge '/abcd' at '/ab'
+        self.assertEqual(tree.longest_prefix('/abcde'), 1)
+        self.assertEqual(tree.longest_prefix('/abxyz'), 2)
+        self.assertIsNone(tree.longest_prefix('/ab'))
+        tree.insert('/ab', 3)
+        self.assertEqual(tree.longest_prefix('/abz'), 3)
+        self.assertEqual(len(tree), 3)
+
+    def test_empty_prefix_and_overwrite(self) -> None:
+        tree = RadixTree()
+        tree.insert('', 'root')
+        tree.insert('/a', 'a')
+        tree.insert('/a', 'a2')
+        self.assertEqual(len(tree), 2)
+        self.assertEqual(tree.longest_prefix('/b'), 'root')
+        self.assertEqual(tree.longest_prefix('/ab'), 'a2')
+
+class RouterTest(unittest.TestCase):
+    def test_most_specific_route_wins(self) -> None:
+        router = Router()
+        responses = {}
+        for method, prefix in (('GET', '/pic/thumb'), ('GET', '/pic'), ('POST', '/pic')):
+            response = responses[method, prefix] = HttpResponse.ok_json({})
+            async def callback(request:HTTPRequest, response:HttpResponse = response) -> HttpResponse:
+                return response
+            router.add_router(HTTPHandle(path_prefix=prefix, method=method, async_callback=callback))
+
+        def routed(method:str, path:str) -> HttpResponse:
+            request = HTTPRequest(method=method, path=path, header=HTTPHeader(), content=b'')
+            return asyncio.run(router.route(request)(request))
+
+        self.assertIs(routed('GET', '/pic/thumb/a.webp'), responses['GET', '/pic/thumb'])
+        self.assertIs(routed('GET', '/pic/a.webp'), responses['GET', '/pic'])
+        self.assertIs(routed('POST', '/pic/thumb/a.webp'), responses['POST', '/pic'])
+        request = HTTPRequest(method='GET', path='/res/index.html', header=HTTPHeader(), content=b'')
+        self.assertIs(router.route(request), router.fall_back)
+        request = HTTPRequest(method='DELETE', path='/pic/a.webp', header=HTTPHeader(), content=b'')
+        self.assertIs(router.route(request), router.fall_back)
+
+    def test_metrics_of_a_router_stay_in_its_registry(self) -> None:
+        async def callback(request:HTTPRequest) -> HttpResponse:
+            return HttpResponse.ok_json({})
+        router = Router()
+        router.add_router(HTTPHandle(path_prefix='/unserved', method='GET', async_callback=callback))
+        self.assertIn('route="/unserved"', router.registry.render())
+        self.assertNotIn('route="/unserved"', registry.render())
+        server = HTTPServer()
+        server.add_router(HTTPHandle(path_prefix='/served', method='GET', async_callback=callback))
+        self.assertIn('route="/served"', registry.render())
+
+if __name__ == '__main__':
+    unittest.main()
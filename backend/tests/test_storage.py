@@ -0,0 +1,112 @@
+"""
+the picture database keeps every journaled change across crashes and writer restarts
+
+python -m pytest tests  (from backend/)
+"""
+
+import os
+import signal
+import asyncio
+import logging
+import tempfile
+import unittest
+from storage import JournalStore
+from picture_server import PictureServer
+from sqlite_pictures import SqlitePictures
+
+class JournalTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'db.json')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_torn_tail_is_cut(self) -> None:
+        store = JournalStore(self.file)
+        store.append([{'path': 'a.webp'}])
+        store.close()
+        with open(store.journal_file, 'ab') as f:
+            f.write(b'{"op": "put", "rec') # crash while appending
+        store = JournalStore(self.file)
+        self.assertEqual(list(store.load()), ['a.webp'])
+        store.append([{'path': 'b.webp'}])
+        store.close()
+        self.assertEqual(list(JournalStore(self.file).load()), ['a.webp', 'b.webp'])
+
+    def test_unreplayed_changes_are_kept(self) -> None:
+        stale = JournalStore(self.file)
+        stale.load()
+        other = JournalStore(self.file)
+        other.append([{'path': 'a.webp'}])
+        other.close()
+        with self.assertRaises(RuntimeError):
+            stale.append([{'path': 'b.webp'}])
+        self.assertEqual(list(JournalStore(self.file).load()), ['a.webp'])
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'workers need os.fork')
+class WriterRestartTest(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.dir = tempfile.TemporaryDirectory()
+        self.root_dir = os.path.join(self.dir.name, 'pic')
+        os.mkdir(self.root_dir)
+
+    def tearDown(self) -> None:
+        logging.disable(logging.NOTSET)
+        self.dir.cleanup()
+
+    def kill_writer_after_append(self, ps:PictureServer, path:str) -> None:
+        """
+        fork writer worker 0 from ps as HTTPServer.start_workers does, add a picture, then kill it
+        """
+        pid = os.fork()
+        if pid == 0:
+            async def write() -> None:
+                ps.startup(0)
+                ps.pictures.add_new_pictures(path)
+                ps.pictures.persistence()
+            try:
+                asyncio.run(write())
+            finally:
+                os.kill(os.getpid(), signal.SIGKILL)
+        _, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WIFSIGNALED(status))
+
+    def test_restarted_writer_keeps_changes(self) -> None:
+        for database_file in ('db.json', 'db.snap'):
+            with self.subTest(database_file=database_file):
+                ps = PictureServer(root_dir=self.root_dir, database_file=database_file, watch=False, cpu_workers=1)
+                self.kill_writer_after_append(ps, f'a-{database_file}.webp')
+                self.kill_writer_after_append(ps, f'b-{database_file}.webp') # restarted from the stale master
+                records = JournalStore(os.path.join(self.root_dir, database_file)).load()
+                self.assertEqual(sorted(records), [f'a-{database_file}.webp', f'b-{database_file}.webp'])
+
+class SqliteFollowTest(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        logging.disable(logging.NOTSET)
+        self.dir.cleanup()
+
+    def test_read_only_worker_sees_commits(self) -> None:
+        writer = SqlitePictures(root_dir=self.dir.name, database_file='db.sqlite3')
+        reader = SqlitePictures(root_dir=self.dir.name, database_file='db.sqlite3')
+        reader.read_only = True
+        reader.reload_if_changed()
+        writer.add_new_pictures('a.webp')
+        writer.persistence()
+        self.assertTrue(reader.reload_if_changed())
+        self.assertEqual(reader.path_pictures['a.webp'].tags, []) # kept by the reader
+        self.assertFalse(reader.reload_if_changed())
+        writer.path_pictures['a.webp'].tags.append('cat')
+        writer.changed('a.webp')
+        writer.persistence()
+        self.assertTrue(reader.reload_if_changed())
+        self.assertEqual(reader.path_pictures['a.webp'].tags, ['cat'])
+        self.assertEqual([p.tags for p in reader.path_pictures.values()], [['cat']])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+the variant cache is capped as a whole, whichever worker generated the variants
+
+python -m pytest tests  (from backend/)
+"""
+
+import os
+import tempfile
+import unittest
+from variants import VariantCache
+from executors import BoundedExecutor
+
+class VariantSweepTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, 'variants')
+        self.source = os.path.join(self.dir.name, 'a.webp')
+        with open(self.source, 'wb') as f:
+            f.write(b'RIFF')
+        self.st = os.stat(self.source)
+        self.io = BoundedExecutor.threads('test-io', workers=1, max_pending=4)
+
+    def tearDown(self) -> None:
+        self.io.shutdown()
+        self.dir.cleanup()
+
+    def write(self, cache:VariantCache, width:int, mtime:float) -> str:
+        """
+        a variant of 100 bytes at width, as generated by cache
+        """
+        key = VariantCache.key('a.webp', self.st, width)
+        file = cache.file_of(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, 'wb') as f:
+            f.write(bytes(100))
+        os.utime(file, (mtime, mtime))
+        self.assertEqual(cache.add(key, 100), [])
+        return file
+
+    async def test_sweep_caps_the_variants_of_every_worker(self) -> None:
+        writer = VariantCache(self.cache_dir, max_bytes=250)
+        reader = VariantCache(self.cache_dir, max_bytes=250)
+        reader.evicting = False
+        files = [self.write(reader, width, mtime) for width, mtime in ((160, 1), (320, 2), (640, 3))]
+        self.assertTrue(all(os.path.exists(file) for file in files))
+        await writer.sweep(self.io)
+        self.assertEqual([os.path.exists(file) for file in files], [False, True, True])
+        self.assertEqual(writer.stats()['bytes'], 200)
+
+    async def test_sweep_keeps_the_hits_of_the_writer(self) -> None:
+        writer = VariantCache(self.cache_dir, max_bytes=250)
+        old = self.write(writer, 160, 1)
+        reader = VariantCache(self.cache_dir, max_bytes=250)
+        reader.evicting = False
+        files = [self.write(reader, width, mtime) for width, mtime in ((320, 2), (640, 3))]
+        self.assertEqual(await writer.get(self.source, 'a.webp', self.st, 160, cpu=None, io=self.io), old)
+        await writer.sweep(self.io)
+        self.assertEqual([os.path.exists(file) for file in [old] + files], [True, False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+the watcher reports every change of the picture files, a batch that failed included
+
+python -m pytest tests  (from backend/)
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from typing import List, Tuple
+from watcher import DirectoryWatcher
+
+class DirectoryWatcherTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.batches:List[Tuple] = []
+        self.failures = 0
+        self.watcher = DirectoryWatcher(self.dir.name, self.on_change, use_inotify=False)
+
+    def tearDown(self) -> None:
+        self.watcher.scanner.shutdown()
+        self.dir.cleanup()
+
+    async def on_change(self, added:List[str], removed:List[str], moved:List[Tuple[str, str]]) -> None:
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError('persistence failed')
+        self.batches.append((sorted(added), sorted(removed), moved))
+
+    def touch(self, name:str) -> None:
+        with open(os.path.join(self.dir.name, name), 'wb') as f:
+            f.write(b'RIFF')
+
+    async def test_failed_batch_is_reported_again(self) -> None:
+        self.touch('a.webp')
+        self.watcher.dirty_dirs.add('')
+        self.failures = 1
+        with self.assertRaises(RuntimeError):
+            await self.watcher.flush()
+        self.touch('b.webp')
+        self.watcher.dirty_files.add('b.webp')
+        await self.watcher.flush()
+        self.assertEqual(self.batches, [(['a.webp'], [], []), (['b.webp'], [], [])])
+
+    async def test_failed_rescan_keeps_paths_dirty(self) -> None:
+        self.touch('a.webp')
+        rescan = self.watcher.rescan
+        def failing(*args):
+            self.watcher.rescan = rescan
+            raise OSError('scan failed')
+        self.watcher.rescan = failing
+        self.watcher.dirty_dirs.add('')
+        with self.assertRaises(OSError):
+            await self.watcher.flush()
+        self.assertEqual(self.watcher.dirty_dirs, {''})
+        await self.watcher.flush()
+        self.assertEqual(self.batches, [(['a.webp'], [], [])])
+
+    async def test_unreadable_dir_is_listed_again(self) -> None:
+        self.touch('a.webp')
+        os.mkdir(os.path.join(self.dir.name, 'sub'))
+        self.touch('sub/b.webp')
+        scandir = os.scandir
+        def failing(path):
+            if path.endswith('sub'):
+                raise PermissionError('denied')
+            return scandir(path)
+        self.watcher.dirty_dirs.add('')
+        with mock.patch('os.scandir', failing):
+            await self.watcher.flush()
+        self.assertEqual(self.watcher.dirty_dirs, {'sub'})
+        await self.watcher.flush()
+        self.assertEqual(self.batches, [(['a.webp'], [], []), (['sub/b.webp'], [], [])])
+
+if __name__ == '__main__':
+    unittest.main()
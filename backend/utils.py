@@ -1,20 +1,25 @@
 import time
 import logging
+from metrics import registry
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
 def timeit(func):
+    """
+    record the duration of each call in the function_seconds histogram, and log it at debug level
+    """
+    histogram = registry.histogram('function_seconds', 'duration of the calls of @timeit functions', function=func.__qualname__)
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time() 
-        
-        execution_time = duration_readable(end_time - start_time)
-        logger.debug(f"call {func.__name__} {execution_time}")
-        
-        return result
+        start_ns = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            ns = time.perf_counter_ns() - start_ns
+            histogram.observe_ns(ns)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("call %s %s", func.__name__, duration_readable(ns / 1e9))
     return wrapper
 
 def duration_readable(s:float) -> str:
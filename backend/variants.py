@@ -0,0 +1,213 @@
+import os
+import asyncio
+import hashlib
+import logging
+import concurrent.futures
+import picture_utils
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from executors import BoundedExecutor
+
+logger = logging.getLogger(__name__)
+
+def generate(source_file:str, file:str, width:int, quality:int) -> int:
+    """
+    in a worker process: write the variant of source_file at width into file, return its size
+    """
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    picture_utils.resize_to_webp(source_file, file, width, quality)
+    return os.stat(file).st_size
+
+class VariantCache:
+    """
+    on-disk cache of resized webp variants of pictures.
+
+    a variant is content addressed: its file name is a hash of the source path, size, mtime and width,
+    so a changed source never hits a stale variant. files live in cache_dir/ab/abcdef....webp.
+    concurrent requests of the same variant share one generation.
+    the total size is capped by max_bytes, the least recently used variants are deleted first.
+
+    workers sharing cache_dir all generate variants, but only the one with evicting set deletes them.
+    it lists cache_dir by sweep, so the size of the variants of every worker is capped, not each worker's own.
+    the variants of other workers are ordered by mtime, i.e. by generation, as their hits are not seen
+    """
+    def __init__(self, cache_dir:str, widths:Tuple[int, ...] = (160, 320, 640, 1280), max_bytes:int = 1024 * 1024 * 1024, quality:int = 80) -> None:
+        self.cache_dir = cache_dir
+        self.widths = widths
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.entries:OrderedDict[str, int] = OrderedDict() # key -> file size, least recently used first
+        self.total_bytes = 0
+        self.inflight:Dict[str, asyncio.Future] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicting = True
+        self.used:Set[str] = set() # keys hit or added since the last sweep, when evicting
+        os.makedirs(cache_dir, exist_ok=True)
+        self.scan()
+
+    def scan(self) -> None:
+        """
+        index the variants already on disk, ordered by mtime, blocking
+        """
+        found = self.list_files(remove_tmp=True)
+        self.entries = OrderedDict((key, size) for _, key, size in found)
+        self.total_bytes = sum(self.entries.values())
+        VariantCache.remove_files(self.evict())
+
+    def list_files(self, remove_tmp:bool = False) -> List[Tuple[float, str, int]]:
+        """
+        (mtime, key, size) of the variants on disk, oldest first.
+        remove_tmp: delete the temp files left by a crash, only while no worker generates
+        """
+        found = []
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    if entry.name.endswith('.webp'):
+                        st = entry.stat()
+                        found.append((st.st_mtime, entry.name[:-len('.webp')], st.st_size))
+                    elif remove_tmp and entry.name.endswith('.tmp'):
+                        os.remove(entry.path)
+                except FileNotFoundError: # evicted meanwhile
+                    pass
+        found.sort()
+        return found
+
+    async def sweep(self, io:BoundedExecutor) -> None:
+        """
+        index the variants generated by every worker, then evict down to max_bytes. listing and deletion run in io
+        """
+        found = await io.run(self.list_files)
+        entries = OrderedDict((key, size) for _, key, size in found if key not in self.used)
+        for key, size in self.entries.items(): # hit here since the listing started, most recently used last
+            if key in self.used:
+                entries[key] = size
+        self.entries = entries
+        self.total_bytes = sum(entries.values())
+        self.used.clear()
+        victims = self.evict()
+        if victims:
+            await io.run(VariantCache.remove_files, victims)
+
+    @staticmethod
+    def key(path:str, st:os.stat_result, width:int) -> str:
+        return hashlib.sha1(f'{path}\0{st.st_size}\0{st.st_mtime_ns}\0{width}'.encode()).hexdigest()
+
+    def file_of(self, key:str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.webp')
+
+    async def get(self, source_file:str, path:str, st:os.stat_result, width:int, cpu:BoundedExecutor, io:BoundedExecutor) -> str:
+        """
+        file of the variant of picture path (at source_file, with os.stat st) at width,
+        generated by the cpu executor if absent. evicted files are deleted by io
+        """
+        key = VariantCache.key(path, st, width)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            if self.evicting:
+                self.used.add(key)
+            return self.file_of(key)
+        future = self.inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._generate(key, source_file, width, cpu, io))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        await asyncio.shield(future)
+        return self.file_of(key)
+
+    async def _generate(self, key:str, source_file:str, width:int, cpu:BoundedExecutor, io:BoundedExecutor) -> None:
+        size = await cpu.run(generate, source_file, self.file_of(key), width, self.quality)
+        victims = self.add(key, size)
+        if victims:
+            await io.run(VariantCache.remove_files, victims)
+
+    def add(self, key:str, size:int) -> List[str]:
+        """
+        index a variant written to disk, return the files evicted to make room, left to delete
+        """
+        self.forget(key)
+        self.entries[key] = size
+        self.total_bytes += size
+        if not self.evicting:
+            return []
+        self.used.add(key)
+        return self.evict()
+
+    def forget(self, key:str) -> None:
+        """
+        drop key from the index, e.g. when its file was deleted by another worker
+        """
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def evict(self) -> List[str]:
+        """
+        drop the least recently used keys beyond max_bytes, return their files
+        """
+        victims = []
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            self.used.discard(key)
+            victims.append(self.file_of(key))
+        return victims
+
+    @staticmethod
+    def remove_files(files:List[str]) -> None:
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+    def prewarm(self, sources:Iterable[Tuple[str, str]], widths:Optional[Iterable[int]] = None, workers:Optional[int] = None) -> int:
+        """
+        generate the missing variants of (source_file, path) pictures at widths (all widths if None)
+        in a pool of worker processes, blocking. return the number generated
+        """
+        widths = tuple(self.widths if widths is None else widths)
+        jobs = []
+        for source_file, path in sources:
+            try:
+                st = os.stat(source_file)
+            except FileNotFoundError:
+                continue
+            for width in widths:
+                key = VariantCache.key(path, st, width)
+                if key not in self.entries:
+                    jobs.append((key, source_file, width))
+        if not jobs:
+            return 0
+        generated = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(generate, source_file, self.file_of(key), width, self.quality):key
+                       for key, source_file, width in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                try:
+                    size = future.result()
+                except Exception as e:
+                    logger.warning('prewarm variant %s failed, %s', key, str(e))
+                    continue
+                VariantCache.remove_files(self.add(key, size))
+                generated += 1
+        logger.info('prewarm %d variants', generated)
+        return generated
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'items': len(self.entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'inflight': len(self.inflight),
+        }
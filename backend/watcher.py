@@ -0,0 +1,341 @@
+"""
+watch the picture files under a directory, subdirectories included, and report their changes in batches
+
+with inotify (linux) each event names the file or directory that changed; elsewhere, or if inotify fails,
+the known directories are polled and only those whose mtime moved are listed again.
+either way changes are debounced: a batch is reported once events stop for `debounce` seconds,
+or `max_delay` after the first one. rescans run in a thread, never in the event loop
+"""
+
+import os
+import ctypes
+import struct
+import asyncio
+import inspect
+import logging
+import ctypes.util
+from executors import BoundedExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Path = str # relative to the root dir, '/' separated
+Changes = Tuple[List[Path], List[Path], List[Tuple[Path, Path]]] # added, removed, moved (old, new)
+
+class Inotify:
+    """
+    minimal inotify binding by ctypes
+    """
+    In_Close_Write = 0x8
+    In_Moved_From = 0x40
+    In_Moved_To = 0x80
+    In_Create = 0x100
+    In_Delete = 0x200
+    In_Delete_Self = 0x400
+    In_Move_Self = 0x800
+    In_Q_Overflow = 0x4000
+    In_Ignored = 0x8000
+    In_Onlydir = 0x1000000
+    In_Isdir = 0x40000000
+    Mask = In_Close_Write | In_Moved_From | In_Moved_To | In_Create | In_Delete | In_Delete_Self | In_Move_Self | In_Onlydir
+    Event = struct.Struct('iIII') # wd, mask, cookie, len
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path:str) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), Inotify.Mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch {path} failed')
+        return wd
+
+    def read(self) -> List[Tuple[int, int, str]]:
+        """
+        pending events as (wd, mask, name)
+        """
+        events = []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = Inotify.Event.unpack_from(data, offset)
+            offset += Inotify.Event.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    def __init__(self, root_dir:str, on_change:Callable[[List[Path], List[Path], List[Tuple[Path, Path]]], Union[None, Awaitable[None]]],
+                 suffix:str = '.webp', debounce:float = 0.5, max_delay:float = 5.0, poll_interval:float = 2.0,
+                 use_inotify:bool = True) -> None:
+        """
+        on_change(added, removed, moved): called in the event loop with each batch, awaited if a coroutine function.
+        the first batch, after the initial scan, adds every file found.
+        a batch on_change failed on is passed again, before the next one
+        """
+        self.root_dir = root_dir
+        self.on_change = on_change
+        self.suffix = suffix
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.files:Dict[Path, Dict[str, int]] = dict() # dir -> file name -> inode, as last seen
+        self.dir_mtimes:Dict[Path, int] = dict() # dir -> mtime_ns at its last listing, the polling checkpoint
+        self.children:Dict[Path, List[Path]] = dict() # dir -> subdirs
+        self.dirty_dirs:Set[Path] = set() # to list again
+        self.dirty_files:Set[Path] = set() # to stat again
+        self.unreported:Optional[Changes] = None # the batch on_change failed on
+        self.changed = asyncio.Event()
+        self.inotify:Optional[Inotify] = None
+        self.wds:Dict[int, Path] = dict()
+        self.scanner = BoundedExecutor.threads('watcher', workers=1, max_pending=4)
+        self.tasks:List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """
+        scan everything once, then follow the changes in background tasks.
+        inotify is set up before the scan, so nothing changed during the scan is missed
+        """
+        loop = asyncio.get_running_loop()
+        if self.use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e: # no inotify on this platform
+                logger.warning('inotify unavailable, %s', str(e))
+        self.dirty_dirs.add('')
+        await self.flush()
+        if self.inotify is not None and len(self.wds) == len(self.files):
+            loop.add_reader(self.inotify.fd, self.read_events)
+            logger.info('watch %s with inotify, %d dirs', self.root_dir, len(self.wds))
+        else: # or out of watches
+            if self.inotify is not None:
+                self.inotify.close()
+                self.inotify = None
+                self.wds.clear()
+            logger.info('watch %s by polling every %.1fs', self.root_dir, self.poll_interval)
+            self.tasks.append(loop.create_task(self.poll()))
+        self.tasks.append(loop.create_task(self.debounce_loop()))
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        if self.inotify is not None:
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+        self.scanner.shutdown()
+
+    def watch(self, dir:Path) -> None:
+        self.wds[self.inotify.add_watch(self.full_path(dir))] = dir
+
+    def read_events(self) -> None:
+        for wd, mask, name in self.inotify.read():
+            if mask & Inotify.In_Q_Overflow:
+                logger.warning('inotify queue overflow, rescan %s', self.root_dir)
+                self.dirty_dirs.update(self.files)
+                continue
+            dir = self.wds.get(wd)
+            if dir is None:
+                continue
+            if mask & Inotify.In_Ignored:
+                del self.wds[wd]
+                continue
+            if mask & (Inotify.In_Delete_Self | Inotify.In_Move_Self):
+                self.dirty_dirs.add(self.parent(dir))
+            elif mask & Inotify.In_Isdir:
+                self.dirty_dirs.add(dir)
+            elif name.endswith(self.suffix):
+                self.dirty_files.add(self.join(dir, name))
+        if self.dirty_dirs or self.dirty_files:
+            self.changed.set()
+
+    async def poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                moved = await self.scanner.run(self.moved_dirs)
+            except Exception as e:
+                logger.warning('poll %s failed, %s', self.root_dir, str(e))
+                continue
+            if moved:
+                self.dirty_dirs.update(moved)
+                self.changed.set()
+
+    def moved_dirs(self) -> List[Path]:
+        """
+        known dirs whose mtime changed since their last listing: an entry was added, removed or renamed in them
+        """
+        moved = []
+        for dir, mtime_ns in list(self.dir_mtimes.items()):
+            try:
+                if os.stat(self.full_path(dir)).st_mtime_ns != mtime_ns:
+                    moved.append(dir)
+            except FileNotFoundError:
+                moved.append(self.parent(dir))
+        return moved
+
+    async def debounce_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.changed.wait()
+            first = loop.time()
+            while True:
+                self.changed.clear()
+                timeout = min(self.debounce, first + self.max_delay - loop.time())
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning('watch %s failed, %s. retry in %.1fs', self.root_dir, str(e), self.max_delay)
+                loop.call_later(self.max_delay, self.changed.set)
+
+    async def flush(self) -> None:
+        """
+        rescan the dirty dirs and files, and report their changes.
+        the dirs and files that cannot be read stay dirty and are retried after max_delay. if on_change fails its batch is reported again by the next flush
+        """
+        if self.unreported is not None:
+            await self.report(*self.unreported)
+        dirs, files = self.dirty_dirs, self.dirty_files
+        self.dirty_dirs, self.dirty_files = set(), set()
+        failed:Set[Path] = set()
+        try:
+            added, removed, moved = await self.scanner.run(self.rescan, dirs, files, failed)
+        except BaseException:
+            self.dirty_dirs.update(dirs)
+            self.dirty_files.update(files)
+            raise
+        if failed:
+            self.dirty_dirs.update(failed.difference(files))
+            self.dirty_files.update(failed.intersection(files))
+            asyncio.get_running_loop().call_later(self.max_delay, self.changed.set)
+        if added or removed or moved:
+            await self.report(added, removed, moved)
+
+    async def report(self, added:List[Path], removed:List[Path], moved:List[Tuple[Path, Path]]) -> None:
+        self.unreported = (added, removed, moved)
+        result = self.on_change(list(added), list(removed), list(moved))
+        if inspect.isawaitable(result):
+            await result
+        self.unreported = None
+
+    def rescan(self, dirs:Set[Path], files:Set[Path], failed:Set[Path]) -> Changes:
+        """
+        in the scanner thread: list dirs (recursively for the new ones) and stat files again,
+        compare with what was seen. a file removed and one added with the same inode is a move,
+        a file replaced in place is no change.
+        the dirs and files that cannot be read are added to failed, what was seen of them is kept
+        """
+        gone:Dict[int, Path] = dict() # inode -> removed path
+        came:Dict[int, Path] = dict() # inode -> added path
+        for dir in sorted(dirs, key=len):
+            if dir in self.files or dir == '':
+                self.list_dir(dir, gone, came, failed)
+        for path in files:
+            dir, name = self.split(path)
+            if dir in dirs or dir not in self.files:
+                continue
+            known = self.files[dir]
+            try:
+                inode = os.stat(self.full_path(path)).st_ino
+            except FileNotFoundError:
+                inode = None
+            except OSError as e:
+                logger.warning('cannot stat %s, %s', path, str(e))
+                failed.add(path)
+                continue
+            if known.get(name) == inode:
+                continue
+            if name in known:
+                gone[known.pop(name)] = path
+            if inode is not None:
+                known[name] = inode
+                came[inode] = path
+        moved = [(gone.pop(inode), path) for inode, path in list(came.items()) if inode in gone]
+        moved_to = set(new for _, new in moved)
+        replaced = set(came.values()).intersection(gone.values())
+        added = [path for path in came.values() if path not in moved_to and path not in replaced]
+        removed = [path for path in gone.values() if path not in replaced]
+        return added, removed, moved
+
+    def list_dir(self, dir:Path, gone:Dict[int, Path], came:Dict[int, Path], failed:Set[Path]) -> None:
+        known = self.files.get(dir)
+        if known is None: # watched before listed, so no file added meanwhile is missed
+            known = self.files[dir] = dict()
+            if self.inotify is not None:
+                try:
+                    self.watch(dir)
+                except OSError as e:
+                    logger.warning('cannot watch %s, %s', dir, str(e))
+        seen:Dict[str, int] = dict()
+        subdirs:List[Path] = []
+        try:
+            mtime_ns = os.stat(self.full_path(dir)).st_mtime_ns
+            with os.scandir(self.full_path(dir)) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(self.join(dir, entry.name))
+                    elif entry.name.endswith(self.suffix) and entry.is_file():
+                        seen[entry.name] = entry.inode()
+        except (FileNotFoundError, NotADirectoryError):
+            self.forget_dir(dir, gone)
+            return
+        except OSError as e:
+            logger.warning('cannot list %s, %s', dir, str(e))
+            failed.add(dir)
+            return
+        self.dir_mtimes[dir] = mtime_ns
+        for name, inode in known.items():
+            if seen.get(name) != inode:
+                gone[inode] = self.join(dir, name)
+        for name, inode in seen.items():
+            if known.get(name) != inode:
+                came[inode] = self.join(dir, name)
+        self.files[dir] = seen
+        for subdir in set(self.children.get(dir, ())).difference(subdirs):
+            self.forget_dir(subdir, gone)
+        self.children[dir] = subdirs
+        for subdir in subdirs:
+            if subdir not in self.files:
+                self.list_dir(subdir, gone, came, failed)
+
+    def forget_dir(self, dir:Path, gone:Dict[int, Path]) -> None:
+        """
+        the dir and everything under it disappeared
+        """
+        for name, inode in self.files.pop(dir, dict()).items():
+            gone[inode] = self.join(dir, name)
+        self.dir_mtimes.pop(dir, None)
+        for subdir in self.children.pop(dir, ()):
+            self.forget_dir(subdir, gone)
+
+    def full_path(self, path:Path) -> str:
+        return os.path.join(self.root_dir, *path.split('/')) if path else self.root_dir
+
+    @staticmethod
+    def join(dir:Path, name:str) -> Path:
+        return f'{dir}/{name}' if dir else name
+
+    @staticmethod
+    def split(path:Path) -> Tuple[Path, str]:
+        dir, _, name = path.rpartition('/')
+        return dir, name
+
+    @staticmethod
+    def parent(dir:Path) -> Path:
+        return dir.rpartition('/')[0]